@@ -78,6 +78,27 @@ else:
     }
 
 
+# Cache
+# Holds the availability versions the streams watch and the cached card and row fragments
+# of the list pages, two per parking lot and monitor. Only Redis is shared by the workers:
+# without REDIS_URL every process has its own cache, so run a single worker (gunicorn's
+# default unless WEB_CONCURRENCY is set)
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -147,3 +168,55 @@ EMAIL_HOST_USER = 'faiz.bscs4430@iiu.edu.pk'
 EMAIL_HOST_PASSWORD = 'mzml iqqt bcgk mngt'
 DEFAULT_FROM_EMAIL = 'noreply@vehiscan.com'
 ADMIN_EMAIL = 'faiz.bscs4430@iiu.edu.pk'
+
+
+# Geocoding of the parking search
+# The backend is swappable, e.g. 'vehiscanWebsite.geocoding.StubGeocoder' in tests
+GEOCODER_BACKEND = 'vehiscanWebsite.geocoding.NominatimGeocoder'
+GEOCODER_CACHE_TTL = 30 * 24 * 60 * 60  # Seconds a resolved query is reused
+GEOCODER_NEGATIVE_CACHE_TTL = 24 * 60 * 60  # Seconds an unresolved query is not looked up again
+GEOCODER_USE_PLACE_INDEX = True  # Resolve lot names, addresses and known places locally first
+
+
+# Write-behind batching of log rows, see vehiscanWebsite/batching.py
+# A batch size of 1 writes every row right away
+PARKING_LOT_LOG_BATCH_SIZE = 200
+PARKING_LOT_LOG_FLUSH_SECONDS = 5.0
+# Searches never wait for their log row, full batches are left to the flush thread
+PARKING_REQUEST_LOG_BATCH_SIZE = 500
+PARKING_REQUEST_LOG_FLUSH_SECONDS = 5.0
+PARKING_REQUEST_LOG_MAX_PENDING = 20000  # Further rows are dropped while the database lags
+PARKING_REQUEST_LOG_FLUSH_IN_BACKGROUND = True
+
+# Retention of parking lot logs, see vehiscanWebsite/rollups.py
+PARKING_LOT_LOG_RETENTION_DAYS = 30  # Raw rows, once rolled up
+PARKING_LOT_LOG_MINUTE_RETENTION_DAYS = 90  # Minute rollups, hour and day rollups are kept
+LOG_ROLLUP_SETTLE_SECONDS = 60  # Rows wait this long after their insert, longer than any transaction inserting logs
+
+# Thumbnails of uploaded images, see vehiscanWebsite/thumbnails.py
+IMAGE_DERIVATIVE_SIZES = {"small": (160, 160), "medium": (480, 360), "large": (1280, 960)}
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = 2  # Threads building thumbnails, off the request threads
+IMAGE_DERIVATIVES_IN_BACKGROUND = True
+
+# Ranked parking lot search, see vehiscanWebsite/ranking.py
+SEARCH_RANKING_WEIGHTS = {"distance": 0.5, "availability": 0.3, "price": 0.2}  # The "best match" ranking
+SEARCH_RANKING_PRICE_SCALE = 100.0  # Hourly price counted as half expensive
+
+# Hour-of-week availability forecasts, see vehiscanWebsite/forecasts.py
+AVAILABILITY_FORECAST_SMOOTHING = 0.3  # Weight of the latest week, older weeks fade by 1 - 0.3
+
+# Server-sent events of availability changes, see vehiscanWebsite/availability_stream.py
+AVAILABILITY_STREAM_POLL_SECONDS = 1.0  # How often a worker checks the cache for changes saved by others
+AVAILABILITY_STREAM_QUEUE_SIZE = 100  # Events a slow client may lag behind before it must resync
+AVAILABILITY_STREAM_KEEPALIVE_SECONDS = 15.0
+AVAILABILITY_STREAM_MAX_SUBSCRIBERS = 10000  # Open streams per worker, further clients poll
+
+# Bulk sync pages of the REST API, see vehiscanWebsite/bulk_sync.py
+API_SYNC_PAGE_SIZE = 1000
+API_SYNC_MAX_PAGE_SIZE = 10000
+
+# Home page map tiles, see vehiscanWebsite/map_tiles.py
+MAP_TILE_CACHE_TIMEOUT = 30  # Seconds a tile can lag behind availability updates
+MAP_TILE_MAX_MARKERS = 100  # Busier tiles are clustered
+MAP_CLUSTER_MAX_ZOOM = 14  # From this zoom level on lots are never clustered
@@ -10,6 +10,7 @@ router.register(r'users', viewsets.UserViewSet)
 router.register(r'groups', viewsets.GroupViewSet)
 router.register(r'parking-lots', viewsets.ParkingLotViewSet)
 router.register(r'parking-lot-monitors', viewsets.ParkingLotMonitorViewSet)
+router.register(r'search-demand', viewsets.SearchDemandViewSet, basename='search-demand')
 
 urlpatterns = [
     path('/', include("django.contrib.auth.urls")),
@@ -0,0 +1,69 @@
+"""Benchmarks the per-frame cost of the preprocessing stage.
+
+Compares the previous ``_enhance_contrast`` implementation against every
+FramePreprocessor mode on the same frame.
+
+    python benchmarks/preprocess_benchmark.py --image images/parking_lot_1.png --data data/coordinates_1.yml
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from preprocessing import FramePreprocessor, MODES
+
+
+def enhance_contrast(frame):
+    """The per-frame implementation the preprocessing stage replaced."""
+    lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
+    l_channel, a, b = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    lab = cv2.merge([clahe.apply(l_channel), a, b])
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+
+def spots_roi(data_file: str) -> tuple:
+    with open(data_file, "r") as data:
+        parking_spaces = yaml.full_load(data)
+    points = np.array([point for spot in parking_spaces for point in spot["coordinates"]])
+    x, y, w, h = cv2.boundingRect(points)
+    return x, y, x + w, y + h
+
+
+def time_per_frame(function, frame, iterations: int) -> float:
+    function(frame)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(frame)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks per-frame preprocessing cost")
+    parser.add_argument("--image", dest="image_file", default="images/parking_lot_1.png")
+    parser.add_argument("--data", dest="data_file", default="data/coordinates_1.yml")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--scale", type=float, default=1.0, help="Resize the frame, e.g. 2.25 for 1080p")
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image_file)
+    roi = spots_roi(args.data_file)
+    if args.scale != 1.0:
+        frame = cv2.resize(frame, None, fx=args.scale, fy=args.scale)
+        roi = tuple(int(value * args.scale) for value in roi)
+
+    print(f"Frame {frame.shape[1]}x{frame.shape[0]}, lot ROI {roi}, {args.iterations} iterations")
+    print(f"{'_enhance_contrast (previous)':<30}{time_per_frame(enhance_contrast, frame, args.iterations):8.3f} ms")
+    for mode in MODES:
+        preprocessor = FramePreprocessor(mode=mode, roi=roi, auto_daylight=False)
+        print(f"{mode:<30}{time_per_frame(preprocessor.process, frame, args.iterations):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,17 +9,16 @@ def draw_contours(image,
                   border_color=COLOR_RED,
                   line_thickness=1,
                   font=open_cv.FONT_HERSHEY_SIMPLEX,
-                  font_scale=0.5):
+                  font_scale=0.5,
+                  center=None):
     open_cv.drawContours(image,
                          [coordinates],
                          contourIdx=-1,
                          color=border_color,
                          thickness=2,
                          lineType=open_cv.LINE_8)
-    moments = open_cv.moments(coordinates)
-
-    center = (int(moments["m10"] / moments["m00"]) - 3,
-              int(moments["m01"] / moments["m00"]) + 3)
+    if center is None:
+        center = label_center(coordinates)
 
     open_cv.putText(image,
                     label,
@@ -29,3 +28,10 @@ def draw_contours(image,
                     font_color,
                     line_thickness,
                     open_cv.LINE_AA)
+
+
+def label_center(coordinates):
+    moments = open_cv.moments(coordinates)
+
+    return (int(moments["m10"] / moments["m00"]) - 3,
+            int(moments["m01"] / moments["m00"]) + 3)
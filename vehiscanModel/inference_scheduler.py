@@ -0,0 +1,133 @@
+"""This module shares one inference budget between all cameras running on a box.
+
+Instead of every camera running detection on every frame, cameras ask the scheduler for
+permission before each detection. The global budget (detections per second) is split
+between cameras in proportion to a weight made of their recent occupancy churn and the
+time since their last detection, so a full overnight lot is refreshed rarely while a busy
+entrance row is refreshed often. Every camera is still guaranteed a detection at least
+once per ``min_refresh_seconds``.
+"""
+import logging
+import math
+import threading
+import time
+
+DEFAULT_MIN_REFRESH_SECONDS = 30.0
+CHURN_WINDOW_SECONDS = 300.0  # Time constant of the churn moving average
+CHURN_WEIGHT = 60.0           # Weight of one state change per second relative to full staleness
+BUCKET_CAPACITY_SECONDS = 1.0  # Unused budget can accumulate for at most this long, and at least one detection
+STATS_LOG_INTERVAL_SECONDS = 60.0
+
+
+class _CameraState:
+
+    def __init__(self, now: float, min_refresh_seconds: float):
+        self.last_detection = now - min_refresh_seconds  # Detect right away on start
+        self.churn = 0.0
+        self.churn_updated = now
+        self.detections = 0
+        self.forced_detections = 0
+
+    def decayed_churn(self, now: float) -> float:
+        return self.churn * math.exp(-(now - self.churn_updated) / CHURN_WINDOW_SECONDS)
+
+
+class InferenceScheduler:
+    """Grants detections to cameras from a shared budget, weighted by churn and staleness."""
+
+    def __init__(self, budget_per_second: float, min_refresh_seconds: float = DEFAULT_MIN_REFRESH_SECONDS,
+                 clock=time.monotonic):
+        self.budget_per_second = budget_per_second
+        self.min_refresh_seconds = min_refresh_seconds
+        self.clock = clock
+        self._cameras = {}
+        self._lock = threading.Lock()
+        # Budgets below one detection per second still need room for a whole detection
+        self._capacity = max(1.0, budget_per_second * BUCKET_CAPACITY_SECONDS)
+        self._tokens = self._capacity
+        self._tokens_updated = clock()
+        self._stats_logged = self._tokens_updated
+
+    def register(self, camera_id: str):
+        with self._lock:
+            self._cameras[camera_id] = _CameraState(self.clock(), self.min_refresh_seconds)
+
+    def acquire(self, camera_id: str) -> bool:
+        """Returns True when the camera should run detection on its current frame.
+
+        Args:
+            camera_id (str): the id the camera was registered with
+
+        Returns:
+            bool: whether a detection was granted (and charged to the budget)
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            camera = self._cameras[camera_id]
+            age = now - camera.last_detection
+
+            if age >= self.min_refresh_seconds:
+                # The minimum refresh guarantee is honoured even when the budget is exhausted
+                camera.forced_detections += 1
+            elif self._tokens < 1 or age * self._target_rate(camera_id, now) < 1:
+                return False
+
+            self._tokens -= 1
+            camera.last_detection = now
+            camera.detections += 1
+            self._log_stats(now)
+            return True
+
+    def report(self, camera_id: str, state_changes: int):
+        """Records how many spots changed state in the camera's last detection."""
+        with self._lock:
+            now = self.clock()
+            camera = self._cameras[camera_id]
+            camera.churn = camera.decayed_churn(now) + state_changes / CHURN_WINDOW_SECONDS
+            camera.churn_updated = now
+
+    def staleness(self) -> dict:
+        """Returns the seconds since the last detection of every camera."""
+        with self._lock:
+            now = self.clock()
+            return {camera_id: now - camera.last_detection for camera_id, camera in self._cameras.items()}
+
+    def stats(self) -> dict:
+        """Returns the staleness, churn and detection counts of every camera."""
+        with self._lock:
+            now = self.clock()
+            return {
+                camera_id: {
+                    "staleness_seconds": round(now - camera.last_detection, 2),
+                    "churn_per_minute": round(camera.decayed_churn(now) * 60, 3),
+                    "target_rate": round(self._target_rate(camera_id, now), 3),
+                    "detections": camera.detections,
+                    "forced_detections": camera.forced_detections,
+                }
+                for camera_id, camera in self._cameras.items()
+            }
+
+    def _weight(self, camera: _CameraState, now: float) -> float:
+        staleness = (now - camera.last_detection) / self.min_refresh_seconds
+        return CHURN_WEIGHT * camera.decayed_churn(now) + staleness
+
+    def _target_rate(self, camera_id: str, now: float) -> float:
+        weights = {key: self._weight(camera, now) for key, camera in self._cameras.items()}
+        total = sum(weights.values())
+        if total <= 0:
+            return self.budget_per_second / len(self._cameras)
+        return self.budget_per_second * weights[camera_id] / total
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity, self._tokens + (now - self._tokens_updated) * self.budget_per_second)
+        self._tokens_updated = now
+
+    def _log_stats(self, now: float):
+        if now - self._stats_logged < STATS_LOG_INTERVAL_SECONDS:
+            return
+        self._stats_logged = now
+        for camera_id, camera in self._cameras.items():
+            logging.info("Camera %s: staleness %.1fs, churn %.2f/min, %d detections (%d forced)",
+                         camera_id, now - camera.last_detection, camera.decayed_churn(now) * 60,
+                         camera.detections, camera.forced_detections)
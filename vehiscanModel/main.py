@@ -1,11 +1,14 @@
 """This module is the main module of the PerfectParkingClient package."""
 import argparse
 import logging
+import threading
 import yaml
 from perfectparking import create_image_from_video, ParkingMonitorData, RestApiUtility
 from colors import COLOR_RED
 from coordinates_generator import CoordinatesGenerator
-from motion_detector import MotionDetector
+from motion_detector import MotionDetector, ENGINE_YOLO, ENGINE_CLASSIFIER
+from overlay_renderer import MjpegPreviewServer, DEFAULT_PREVIEW_HOST, DEFAULT_PREVIEW_FPS
+from inference_scheduler import InferenceScheduler, DEFAULT_MIN_REFRESH_SECONDS
 import requests
 from requests.auth import HTTPBasicAuth
 
@@ -17,6 +20,10 @@ def main():
 
     args = parse_args()
 
+    if args.cameras_file is not None:
+        run_cameras(args)
+        return
+
     image_file = args.image_file
     data_file = args.data_file
     start_frame = args.start_frame
@@ -35,13 +42,68 @@ def main():
         update_total_spaces_to_backend(data_file, config_filepath)
         parking_spaces:list = yaml.full_load(data)
         parking_monitor_data = ParkingMonitorData(config_filepath)
-        detector = MotionDetector(args.video_file, parking_spaces, int(start_frame), parking_monitor_data)
-        while True:
-            was_stopped = detector.detect_motion()
-            if was_stopped:
-                break
+        preview_server = None
+        if args.preview_port is not None:
+            preview_server = MjpegPreviewServer(args.preview_host, int(args.preview_port), float(args.preview_fps))
+            preview_server.start()
+        detector = MotionDetector(args.video_file, parking_spaces, int(start_frame), parking_monitor_data,
+                                  occupancy_engine=args.engine,
+                                  show_window=not args.headless,
+                                  preview_server=preview_server)
+        try:
+            while True:
+                was_stopped = detector.detect_motion()
+                if was_stopped:
+                    break
+        finally:
+            if preview_server is not None:
+                preview_server.stop()
         
 
+def run_cameras(args):
+    """Runs every camera listed in the cameras file on this box, sharing one YOLO model
+    and one inference budget between them.
+
+    Each entry of the cameras file needs a ``video``, ``data`` and ``config`` key and may set a
+    ``preview_port``. Cameras run headless on their own thread.
+    """
+    with open(args.cameras_file, "r") as cameras_file:
+        cameras: list = yaml.full_load(cameras_file)
+
+    scheduler = InferenceScheduler(float(args.inference_budget), float(args.min_refresh))
+    model = None
+    threads = []
+    for camera in cameras:
+        update_total_spaces_to_backend(camera["data"], camera["config"])
+        with open(camera["data"], "r") as data:
+            parking_spaces: list = yaml.full_load(data)
+        preview_server = None
+        if camera.get("preview_port") is not None:
+            preview_server = MjpegPreviewServer(args.preview_host, int(camera["preview_port"]), float(args.preview_fps))
+            preview_server.start()
+        detector = MotionDetector(camera["video"], parking_spaces, int(camera.get("start_frame", 1)),
+                                  ParkingMonitorData(camera["config"]),
+                                  occupancy_engine=camera.get("engine", args.engine),
+                                  show_window=False,
+                                  preview_server=preview_server,
+                                  scheduler=scheduler,
+                                  model=model)
+        model = detector.model
+        thread = threading.Thread(target=run_detector, args=(detector,), name=f"camera-{detector.camera_id}")
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+
+def run_detector(detector: MotionDetector):
+    while True:
+        was_stopped = detector.detect_motion()
+        if was_stopped:
+            break
+
+
 def parse_args():
     """Parses the command line arguments."""
     parser = argparse.ArgumentParser(description='Generates Coordinates File')
@@ -53,12 +115,12 @@ def parse_args():
 
     parser.add_argument("--video",
                         dest="video_file",
-                        required=True,
+                        required=False,
                         help="Video file to detect motion on")
 
     parser.add_argument("--data",
                         dest="data_file",
-                        required=True,
+                        required=False,
                         help="Data file to be used with OpenCV")
 
     parser.add_argument("--start-frame",
@@ -71,8 +133,49 @@ def parse_args():
                         required=False,
                         help="Config file to use"
                         )
+    parser.add_argument("--engine",
+                        dest="engine",
+                        required=False,
+                        default=ENGINE_YOLO,
+                        choices=[ENGINE_YOLO, ENGINE_CLASSIFIER],
+                        help="Occupancy engine: full-frame YOLO, or the per-spot classifier with YOLO as fallback")
+    parser.add_argument("--headless",
+                        dest="headless",
+                        action="store_true",
+                        help="Do not open a local window")
+    parser.add_argument("--preview-port",
+                        dest="preview_port",
+                        required=False,
+                        help="Serve the overlay as an MJPEG stream on this port")
+    parser.add_argument("--preview-host",
+                        dest="preview_host",
+                        required=False,
+                        default=DEFAULT_PREVIEW_HOST,
+                        help="Interface the preview stream listens on")
+    parser.add_argument("--preview-fps",
+                        dest="preview_fps",
+                        required=False,
+                        default=DEFAULT_PREVIEW_FPS,
+                        help="Maximum frame rate of the preview stream")
+    parser.add_argument("--cameras",
+                        dest="cameras_file",
+                        required=False,
+                        help="YAML file listing several cameras to run on this box instead of --video/--data")
+    parser.add_argument("--inference-budget",
+                        dest="inference_budget",
+                        required=False,
+                        default=4.0,
+                        help="Detections per second shared by all cameras of --cameras")
+    parser.add_argument("--min-refresh",
+                        dest="min_refresh",
+                        required=False,
+                        default=DEFAULT_MIN_REFRESH_SECONDS,
+                        help="Seconds after which every camera is refreshed regardless of the budget")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.cameras_file is None and (args.video_file is None or args.data_file is None):
+        parser.error("--video and --data are required unless --cameras is given")
+    return args
 
 
 def update_total_spaces_to_backend(data_file: str, config_filepath: str):
@@ -1,19 +1,33 @@
+import logging
+import threading
 import time
 import cv2
 import numpy as np
 from ultralytics import YOLO
 from collections import deque
 from colors import COLOR_GREEN, COLOR_WHITE, COLOR_BLUE
-from drawing_utils import draw_contours
+from drawing_utils import label_center
 from cv2 import boundingRect, destroyAllWindows, imshow, VideoCapture, drawContours
 from typing import Optional
 from numpy import ndarray, ndarray as Mat
 from perfectparking import ParkingMonitorData, RestApiUtility
+from occupancy_classifier import OccupancyClassifier
+from preprocessing import FramePreprocessor
+from overlay_renderer import OverlayRenderer, MjpegPreviewServer
+from snapshot_uploader import SnapshotUploader
+from inference_scheduler import InferenceScheduler
 
 SECONDS_TIME_DELAY = 0.002
 IOU_THRESHOLD = 0.1  # Minimum overlap to consider occupied
 HISTORY_LENGTH = 4     # Frames for temporal filtering
 CONFIDENCE_THRESHOLD = 0.6  # YOLO detection confidence
+ARBITRATION_PADDING = 0.5   # Context kept around ambiguous spots when cropping for YOLO
+
+# Cameras on one box share a single model, which is not safe to call concurrently
+INFERENCE_LOCK = threading.Lock()
+
+ENGINE_YOLO = "yolo"
+ENGINE_CLASSIFIER = "classifier"
 
 class ParkingSpot:
     def __init__(self, coordinates: ndarray, parking_spot_id: int):
@@ -24,6 +38,7 @@ class ParkingSpot:
         self.mask = self.create_contours_mask()
         self.history = deque(maxlen=HISTORY_LENGTH)
         self.area = cv2.contourArea(coordinates)
+        self.label_center = label_center(coordinates)
 
     def create_contours_mask(self) -> ndarray:
         x, y, w, h = self.rect
@@ -33,7 +48,9 @@ class ParkingSpot:
         return mask == 255
 
     def determine_and_mark_occupancy_from_image(self, frame: Mat, car_boxes: list):
-        current_state = False
+        self.mark_occupancy(self.is_covered_by_car(car_boxes))
+
+    def is_covered_by_car(self, car_boxes: list) -> bool:
         spot_poly = self.coordinates.reshape(-1, 1, 2).astype(np.int32)
         
         for box in car_boxes:
@@ -47,9 +64,10 @@ class ParkingSpot:
             )[0]
             
             if intersection / self.area > IOU_THRESHOLD:
-                current_state = True
-                break
-        
+                return True
+        return False
+
+    def mark_occupancy(self, current_state: bool):
         # Temporal filtering
         self.history.append(current_state)
         self.is_occupied = sum(self.history)/HISTORY_LENGTH > 0.7
@@ -62,7 +80,10 @@ class ParkingSpot:
 
 
 class MotionDetector:
-    def __init__(self, video, parking_spots_json_dict, start_frame, parking_monitor_data: ParkingMonitorData):
+    def __init__(self, video, parking_spots_json_dict, start_frame, parking_monitor_data: ParkingMonitorData,
+                 occupancy_engine: str = ENGINE_YOLO, show_window: bool = True,
+                 preview_server: Optional[MjpegPreviewServer] = None,
+                 scheduler: Optional[InferenceScheduler] = None, model: Optional[YOLO] = None):
         self.video = video
         self.parking_spots = [
             ParkingSpot(np.array(spot["coordinates"]), spot["id"])
@@ -70,8 +91,22 @@ class MotionDetector:
         ]
         self.start_frame = start_frame
         self.parking_monitor_data = parking_monitor_data
-        self.model = YOLO("yolov8x.pt")
+        self.model = model if model is not None else YOLO("yolov8x.pt")
         self.class_ids = [2, 5, 7]  # Car, bus, truck
+        self.preprocessor = FramePreprocessor.from_monitor_data(parking_monitor_data, roi=self._spots_roi())
+        self.overlay_renderer = OverlayRenderer(self.parking_spots)
+        self.show_window = show_window
+        self.preview_server = preview_server
+        self.snapshot_uploader: Optional[SnapshotUploader] = None
+        if parking_monitor_data.snapshot_enabled:
+            self.snapshot_uploader = SnapshotUploader(parking_monitor_data)
+        self.classifier: Optional[OccupancyClassifier] = None
+        if occupancy_engine == ENGINE_CLASSIFIER:
+            self.classifier = OccupancyClassifier(self.parking_spots)
+        self.scheduler = scheduler
+        self.camera_id = str(parking_monitor_data.id)
+        if scheduler is not None:
+            scheduler.register(self.camera_id)
 
     def detect_motion(self) -> bool:
         video_capture = VideoCapture(self.video)
@@ -83,23 +118,31 @@ class MotionDetector:
             if not is_open or video_frame is None:
                 break
 
-            # Enhanced preprocessing
-            video_frame = self._enhance_contrast(video_frame)
-            
-            # Optimized YOLO detection
-            results = self.model(video_frame, imgsz=640, conf=CONFIDENCE_THRESHOLD)
-            car_boxes = []
-            for result in results:
-                for box in result.boxes:
-                    if int(box.cls) in self.class_ids:
-                        car_boxes.append(box.xyxy[0].cpu().numpy())
-
-            # Update parking spots
-            for spot in self.parking_spots:
-                spot.determine_and_mark_occupancy_from_image(video_frame, car_boxes)
-
-            # Visualization
-            self._draw_detections(video_frame, car_boxes)
+            # Cameras sharing a box only detect when the scheduler grants it;
+            # otherwise the spots keep their last state
+            if self.scheduler is None or self.scheduler.acquire(self.camera_id):
+                was_occupied = [spot.is_occupied for spot in self.parking_spots]
+
+                # Enhanced preprocessing
+                video_frame = self.preprocessor.process(video_frame)
+
+                if self.classifier is not None:
+                    car_boxes = self._classify_parking_spots(video_frame)
+                else:
+                    # Optimized YOLO detection
+                    car_boxes = self._detect_car_boxes(video_frame)
+
+                    # Update parking spots
+                    for spot in self.parking_spots:
+                        spot.determine_and_mark_occupancy_from_image(video_frame, car_boxes)
+
+                if self.scheduler is not None:
+                    state_changes = sum(spot.is_occupied != occupied
+                                        for spot, occupied in zip(self.parking_spots, was_occupied))
+                    self.scheduler.report(self.camera_id, state_changes)
+
+                # Visualization
+                self._draw_detections(video_frame, car_boxes)
             self.display_image(video_frame)
 
             # Backend update
@@ -108,20 +151,55 @@ class MotionDetector:
                 self.on_free_parking_spaces_changed(len(self.parking_spots), current_free)
                 free_spaces = current_free
 
-            if cv2.waitKey(1) == ord("q"):
+            if self.show_window and cv2.waitKey(1) == ord("q"):
                 break
             time.sleep(SECONDS_TIME_DELAY)
 
         video_capture.release()
-        destroyAllWindows()
+        if self.show_window:
+            destroyAllWindows()
+        if self.classifier is not None:
+            logging.info("Occupancy classifier stats: %s", self.classifier.stats.as_dict())
         return False
 
-    def _enhance_contrast(self, frame: Mat) -> Mat:
-        lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-        l_channel, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        lab = cv2.merge([clahe.apply(l_channel), a, b])
-        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    def _detect_car_boxes(self, frame: Mat, offset: tuple = (0, 0)) -> list:
+        with INFERENCE_LOCK:
+            results = self.model(frame, imgsz=640, conf=CONFIDENCE_THRESHOLD)
+        car_boxes = []
+        for result in results:
+            for box in result.boxes:
+                if int(box.cls) in self.class_ids:
+                    car_boxes.append(box.xyxy[0].cpu().numpy() + np.tile(offset, 2))
+        return car_boxes
+
+    def _classify_parking_spots(self, frame: Mat) -> list:
+        """Settles spots with the cheap classifier and asks YOLO only about ambiguous ones.
+
+        YOLO runs on a padded crop around the ambiguous spots rather than the full frame,
+        and its verdicts are fed back to the classifier as empty-spot references.
+        """
+        occupied, ambiguous, _ = self.classifier.classify(frame)
+        car_boxes = []
+        arbitrated = np.flatnonzero(ambiguous)
+        if len(arbitrated):
+            x1, y1, x2, y2 = self.classifier.rect_of(arbitrated)
+            pad_x, pad_y = int((x2 - x1) * ARBITRATION_PADDING), int((y2 - y1) * ARBITRATION_PADDING)
+            height, width = frame.shape[:2]
+            x1, y1 = max(x1 - pad_x, 0), max(y1 - pad_y, 0)
+            x2, y2 = min(x2 + pad_x, width), min(y2 + pad_y, height)
+            car_boxes = self._detect_car_boxes(frame[y1:y2, x1:x2], offset=(x1, y1))
+            verdicts = np.array([self.parking_spots[i].is_covered_by_car(car_boxes) for i in arbitrated])
+            occupied[arbitrated] = verdicts
+            self.classifier.learn(arbitrated, verdicts)
+
+        for spot, state in zip(self.parking_spots, occupied):
+            spot.mark_occupancy(bool(state))
+        return car_boxes
+
+    def _spots_roi(self) -> tuple:
+        rects = np.array([spot.rect for spot in self.parking_spots])
+        return (int(rects[:, 0].min()), int(rects[:, 1].min()),
+                int((rects[:, 0] + rects[:, 2]).max()), int((rects[:, 1] + rects[:, 3]).max()))
 
     def _draw_detections(self, frame: Mat, boxes: list):
         pass
@@ -131,11 +209,20 @@ class MotionDetector:
 
     # Original preserved methods
     def display_image(self, video_frame: Mat):
-        for spot in self.parking_spots:
-            color = COLOR_BLUE if spot.is_occupied else COLOR_GREEN
-            draw_contours(video_frame, spot.coordinates,
-                         str(spot.parking_spot_id), COLOR_WHITE, color)
-        imshow("Press q to quit", video_frame)
+        """Shows the overlay locally, on the preview stream and in snapshots; renders nothing if nobody needs it."""
+        wants_preview = self.preview_server is not None and self.preview_server.wants_frame()
+        wants_snapshot = self.snapshot_uploader is not None and self.snapshot_uploader.is_due()
+        if not (self.show_window or wants_preview or wants_snapshot):
+            return
+        occupied = np.fromiter((spot.is_occupied for spot in self.parking_spots), dtype=bool,
+                               count=len(self.parking_spots))
+        overlay = self.overlay_renderer.render(video_frame, occupied)
+        if wants_preview:
+            self.preview_server.submit(overlay)
+        if wants_snapshot:
+            self.snapshot_uploader.submit(overlay, occupied)
+        if self.show_window:
+            imshow("Press q to quit", overlay)
 
     def count_occupied_parking_spaces(self) -> int:
         return sum(1 for spot in self.parking_spots if spot.is_occupied)
@@ -0,0 +1,210 @@
+"""This module contains a cheap per-spot occupancy classifier.
+
+Every spot's masked crop is compared against a learned empty-spot reference using a
+handful of vectorized features (edge density, color variance and brightness-normalized
+difference). All spots are scored in one batch with NumPy; only spots whose score is
+ambiguous need to be arbitrated by the full YOLO detector.
+"""
+import logging
+import cv2
+import numpy as np
+from numpy import ndarray
+
+EMPTY_SCORE_THRESHOLD = 0.35     # Scores below this are classified as empty
+OCCUPIED_SCORE_THRESHOLD = 0.65  # Scores above this are classified as occupied
+REFERENCE_LEARNING_RATE = 0.05   # Blend factor when refreshing a confident empty reference
+EDGE_SCALE = 0.15                # Edge density change that counts as fully "different"
+VARIANCE_SCALE = 1.0             # Log variance ratio that counts as fully "different"
+DIFFERENCE_SCALE = 0.25          # Normalized difference that counts as fully "different"
+FEATURE_WEIGHTS = (0.4, 0.2, 0.4)  # Edge density, color variance, normalized difference
+CANNY_THRESHOLDS = (50, 150)
+STATS_LOG_INTERVAL = 500         # Frames between stats log lines
+EPSILON = 1e-6
+
+
+class ClassifierStats:
+    """Counts how often the classifier settled spots without asking YOLO."""
+
+    def __init__(self):
+        self.frames = 0
+        self.frames_without_yolo = 0
+        self.spot_decisions = 0
+        self.spot_decisions_by_classifier = 0
+
+    def record(self, spot_count: int, ambiguous_count: int):
+        self.frames += 1
+        if ambiguous_count == 0:
+            self.frames_without_yolo += 1
+        self.spot_decisions += spot_count
+        self.spot_decisions_by_classifier += spot_count - ambiguous_count
+
+    @property
+    def yolo_avoidance_rate(self) -> float:
+        """Fraction of frames on which YOLO was not invoked at all."""
+        return self.frames_without_yolo / self.frames if self.frames else 0.0
+
+    @property
+    def spot_avoidance_rate(self) -> float:
+        """Fraction of spot decisions that did not need YOLO arbitration."""
+        return self.spot_decisions_by_classifier / self.spot_decisions if self.spot_decisions else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "frames_without_yolo": self.frames_without_yolo,
+            "yolo_avoidance_rate": round(self.yolo_avoidance_rate, 4),
+            "spot_avoidance_rate": round(self.spot_avoidance_rate, 4),
+        }
+
+
+class OccupancyClassifier:
+    """Scores all parking spots of a frame against their learned empty references.
+
+    The masked pixels of every spot are flattened once into a single index array with a
+    matching segment id per pixel, so per-spot features are computed with ``np.bincount``
+    instead of a Python loop over spots. Spots start without a reference and are reported
+    as ambiguous until YOLO has seen them empty at least once.
+    """
+
+    def __init__(self, parking_spots: list):
+        self.parking_spots = parking_spots
+        self.stats = ClassifierStats()
+        self._frame_shape = None
+        self._roi = None
+        self._pixel_index = None
+        self._segment = None
+        self._pixel_count = None
+        self._reference = None
+        self._reference_edge_density = None
+        self._reference_variance = None
+        self._has_reference = np.zeros(len(parking_spots), dtype=bool)
+        self._last_features = None
+
+    def classify(self, frame: ndarray) -> tuple:
+        """Classifies every spot in the frame.
+
+        Args:
+            frame (ndarray): the BGR video frame
+
+        Returns:
+            tuple: (occupied, ambiguous, scores) arrays with one entry per spot. ``occupied``
+            is only meaningful where ``ambiguous`` is False.
+        """
+        features = self._compute_features(frame)
+        scores = self._score(features)
+        ambiguous = ~self._has_reference | (
+            (scores >= EMPTY_SCORE_THRESHOLD) & (scores <= OCCUPIED_SCORE_THRESHOLD))
+        occupied = scores > OCCUPIED_SCORE_THRESHOLD
+
+        confident_empty = ~ambiguous & ~occupied
+        if confident_empty.any():
+            self._update_reference(features, confident_empty, REFERENCE_LEARNING_RATE)
+
+        self.stats.record(len(self.parking_spots), int(ambiguous.sum()))
+        if self.stats.frames % STATS_LOG_INTERVAL == 0:
+            logging.info("Occupancy classifier stats: %s", self.stats.as_dict())
+        self._last_features = features
+        return occupied, ambiguous, scores
+
+    def learn(self, spot_indexes: ndarray, occupied: ndarray):
+        """Feeds YOLO verdicts for arbitrated spots back into the empty references.
+
+        Must be called after ``classify`` for the same frame. Spots YOLO found empty have
+        their reference replaced outright when they had none, or blended otherwise.
+
+        Args:
+            spot_indexes (ndarray): indexes of the arbitrated spots
+            occupied (ndarray): the YOLO verdict for each of those spots
+        """
+        empty = np.zeros(len(self.parking_spots), dtype=bool)
+        empty[np.asarray(spot_indexes)[~np.asarray(occupied, dtype=bool)]] = True
+        if not empty.any():
+            return
+        fresh = empty & ~self._has_reference
+        if fresh.any():
+            self._update_reference(self._last_features, fresh, 1.0)
+        known = empty & ~fresh
+        if known.any():
+            self._update_reference(self._last_features, known, REFERENCE_LEARNING_RATE)
+
+    def rect_of(self, spot_indexes: ndarray) -> tuple:
+        """Returns the bounding rect (x1, y1, x2, y2) covering the given spots."""
+        rects = np.array([self.parking_spots[i].rect for i in spot_indexes])
+        x1, y1 = rects[:, 0].min(), rects[:, 1].min()
+        x2, y2 = (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max()
+        return int(x1), int(y1), int(x2), int(y2)
+
+    def _prepare(self, frame_shape: tuple):
+        """Builds the flattened pixel index of every spot mask for a frame size."""
+        height, width = frame_shape[:2]
+        x1, y1, x2, y2 = self.rect_of(range(len(self.parking_spots)))
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, width), min(y2, height)
+        roi_width = x2 - x1
+
+        indexes, segments = [], []
+        for segment, spot in enumerate(self.parking_spots):
+            x, y, _, _ = spot.rect
+            ys, xs = np.nonzero(spot.mask)
+            ys, xs = ys + y, xs + x
+            inside = (xs >= x1) & (xs < x2) & (ys >= y1) & (ys < y2)
+            indexes.append((ys[inside] - y1) * roi_width + (xs[inside] - x1))
+            segments.append(np.full(int(inside.sum()), segment, dtype=np.int32))
+
+        self._frame_shape = frame_shape
+        self._roi = (x1, y1, x2, y2)
+        self._pixel_index = np.concatenate(indexes)
+        self._segment = np.concatenate(segments)
+        self._pixel_count = np.maximum(
+            np.bincount(self._segment, minlength=len(self.parking_spots)), 1).astype(np.float32)
+        self._reference = np.zeros(len(self._pixel_index), dtype=np.float32)
+        self._reference_edge_density = np.zeros(len(self.parking_spots), dtype=np.float32)
+        self._reference_variance = np.zeros(len(self.parking_spots), dtype=np.float32)
+        self._has_reference[:] = False
+
+    def _spot_means(self, values: ndarray) -> ndarray:
+        return np.bincount(self._segment, weights=values,
+                           minlength=len(self.parking_spots)) / self._pixel_count
+
+    def _compute_features(self, frame: ndarray) -> dict:
+        if frame.shape != self._frame_shape:
+            self._prepare(frame.shape)
+        x1, y1, x2, y2 = self._roi
+        roi = frame[y1:y2, x1:x2]
+        gray_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        edges = cv2.Canny(gray_roi, *CANNY_THRESHOLDS).reshape(-1)[self._pixel_index]
+        gray = gray_roi.reshape(-1)[self._pixel_index].astype(np.float32)
+        color = roi.reshape(-1, 3)[self._pixel_index].astype(np.float32)
+
+        edge_density = self._spot_means((edges > 0).astype(np.float32))
+        variance = np.zeros(len(self.parking_spots), dtype=np.float64)
+        for channel in range(3):
+            values = color[:, channel]
+            mean = self._spot_means(values)
+            variance += self._spot_means(values * values) - mean * mean
+        variance = np.maximum(variance / 3, 0)
+
+        # Brightness-normalized pixels make the difference robust to global lighting changes
+        gray_mean = self._spot_means(gray)
+        normalized = gray / (gray_mean[self._segment] + EPSILON)
+        return {"edge_density": edge_density, "variance": variance, "normalized": normalized}
+
+    def _score(self, features: dict) -> ndarray:
+        edge_delta = np.abs(features["edge_density"] - self._reference_edge_density) / EDGE_SCALE
+        variance_delta = np.abs(np.log1p(features["variance"]) -
+                                np.log1p(self._reference_variance)) / VARIANCE_SCALE
+        difference = self._spot_means(np.abs(features["normalized"] - self._reference)) / DIFFERENCE_SCALE
+        edge_weight, variance_weight, difference_weight = FEATURE_WEIGHTS
+        scores = (edge_weight * np.minimum(edge_delta, 1) +
+                  variance_weight * np.minimum(variance_delta, 1) +
+                  difference_weight * np.minimum(difference, 1))
+        return scores.astype(np.float32)
+
+    def _update_reference(self, features: dict, spots: ndarray, rate: float):
+        pixels = spots[self._segment]
+        self._reference[pixels] += rate * (features["normalized"][pixels] - self._reference[pixels])
+        self._reference_edge_density[spots] += rate * (
+            features["edge_density"][spots] - self._reference_edge_density[spots])
+        self._reference_variance[spots] += rate * (
+            features["variance"][spots] - self._reference_variance[spots])
+        self._has_reference |= spots
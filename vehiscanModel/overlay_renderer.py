@@ -0,0 +1,270 @@
+"""This module renders the parking spot overlay and serves it as an MJPEG preview stream.
+
+The overlay geometry never changes while the monitor runs, so spot outlines and labels are
+rendered once into a "free" and an "occupied" layer. Each frame only copies the layer
+pixels of every spot according to its state, instead of calling ``draw_contours`` (and
+``cv2.moments``) per spot per frame. The anti-aliased edges of the labels are blended
+with the frame through a coverage mask drawn with ``draw_contours`` itself, so the
+overlay matches a direct draw.
+
+The preview server lets remote operators watch the overlay from a browser without a GUI
+on the edge box. Frames are only rendered while someone is connected, at a capped rate,
+and JPEG encoding happens on a worker thread so detection is never blocked.
+"""
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+from colors import COLOR_BLUE, COLOR_GREEN, COLOR_WHITE
+from drawing_utils import draw_contours
+
+DEFAULT_PREVIEW_HOST = "127.0.0.1"
+DEFAULT_PREVIEW_PORT = 8090
+DEFAULT_PREVIEW_FPS = 2.0
+DEFAULT_JPEG_QUALITY = 70
+STREAM_BOUNDARY = "frame"
+CLIENT_FRAME_TIMEOUT = 5.0  # Seconds a client waits for a frame before re-checking the connection
+
+
+class OverlayRenderer:
+    """Draws the spot overlay from pre-rendered layers and cached label centers."""
+
+    def __init__(self, parking_spots: list):
+        self.parking_spots = parking_spots
+        self._shape = None
+        self._output = None
+        self._pixels = None
+        self._pixel_spot = None
+        self._free_colors = None
+        self._occupied_colors = None
+        self._colors = None
+        self._edges = None
+        self._edge_pixels = None
+        self._edge_transparency = None
+        self._state = None
+
+    def render(self, frame: ndarray, occupied: ndarray) -> ndarray:
+        """Returns the frame with the overlay drawn on it.
+
+        Args:
+            frame (ndarray): the BGR video frame, left untouched
+            occupied (ndarray): the occupancy state of every spot
+
+        Returns:
+            ndarray: an internal buffer that is overwritten by the next call
+        """
+        if frame.shape != self._shape:
+            self._prepare(frame.shape)
+        occupied = np.asarray(occupied, dtype=bool)
+        if self._state is None or not np.array_equal(occupied, self._state):
+            # Occupancy rarely changes between frames, so the overlay colors are reused
+            self._colors = np.where(occupied[self._pixel_spot][:, None],
+                                    self._occupied_colors, self._free_colors)
+            self._state = occupied.copy()
+        np.copyto(self._output, frame)
+        output = self._output.reshape(-1, 3)
+        # The layers are drawn on black, so edge colors only lack the frame behind them
+        background = output[self._edge_pixels].astype(np.uint16)
+        output[self._pixels] = self._colors
+        blended = self._colors[self._edges] + (background * self._edge_transparency + 127) // 255
+        output[self._edge_pixels] = np.minimum(blended, 255)
+        return self._output
+
+    def _prepare(self, shape: tuple):
+        """Renders the static layers and the pixel ownership map for a frame size."""
+        free_layer = np.zeros(shape, dtype=np.uint8)
+        occupied_layer = np.zeros(shape, dtype=np.uint8)
+        owner = np.zeros(shape[:2], dtype=np.int32)
+        coverage = np.zeros(shape[:2], dtype=np.uint8)
+        stroke = np.zeros(shape[:2], dtype=np.uint8)
+        for index, spot in enumerate(self.parking_spots):
+            label = str(spot.parking_spot_id)
+            draw_contours(free_layer, spot.coordinates, label, COLOR_WHITE, COLOR_GREEN,
+                          center=spot.label_center)
+            draw_contours(occupied_layer, spot.coordinates, label, COLOR_WHITE, COLOR_BLUE,
+                          center=spot.label_center)
+            # Later spots are drawn over earlier ones, so they own the shared pixels
+            stroke[:] = 0
+            draw_contours(stroke, spot.coordinates, label, (255,), (255,), center=spot.label_center)
+            is_drawn = stroke > 0
+            owner[is_drawn] = index + 1
+            coverage[is_drawn] = stroke[is_drawn]
+
+        self._pixels = np.flatnonzero(owner)
+        self._pixel_spot = owner.reshape(-1)[self._pixels].astype(np.intp) - 1
+        self._free_colors = free_layer.reshape(-1, 3)[self._pixels].astype(np.uint16)
+        self._occupied_colors = occupied_layer.reshape(-1, 3)[self._pixels].astype(np.uint16)
+        pixel_coverage = coverage.reshape(-1)[self._pixels]
+        self._edges = np.flatnonzero(pixel_coverage < 255)
+        self._edge_pixels = self._pixels[self._edges]
+        self._edge_transparency = (255 - pixel_coverage[self._edges].astype(np.uint16))[:, None]
+        self._output = np.empty(shape, dtype=np.uint8)
+        self._state = None
+        self._shape = shape
+
+
+class MjpegPreviewServer:
+    """Serves the latest overlay frame as a rate-limited MJPEG stream over HTTP.
+
+    ``GET /`` returns a small viewer page, ``GET /stream`` the multipart MJPEG stream and
+    ``GET /snapshot.jpg`` the latest encoded frame.
+    """
+
+    def __init__(self, host: str = DEFAULT_PREVIEW_HOST, port: int = DEFAULT_PREVIEW_PORT,
+                 fps: float = DEFAULT_PREVIEW_FPS, jpeg_quality: int = DEFAULT_JPEG_QUALITY):
+        self.host = host
+        self.port = port
+        self.frame_interval = 1.0 / fps
+        self.jpeg_quality = jpeg_quality
+        self.viewers = 0
+        self._viewers_lock = threading.Lock()
+        self._last_submitted = 0.0
+        self._pending: Optional[ndarray] = None
+        self._pending_lock = threading.Lock()
+        self._pending_event = threading.Event()
+        self._jpeg: Optional[bytes] = None
+        self._sequence = 0
+        self._jpeg_condition = threading.Condition()
+        self._running = False
+        self._http_server: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        self._running = True
+        self._http_server = ThreadingHTTPServer((self.host, self.port), _PreviewRequestHandler)
+        self._http_server.daemon_threads = True
+        self._http_server.preview = self
+        threading.Thread(target=self._http_server.serve_forever, name="preview-http", daemon=True).start()
+        threading.Thread(target=self._encode_loop, name="preview-encoder", daemon=True).start()
+        logging.info("Overlay preview available at http://%s:%s/", self.host, self.port)
+
+    def stop(self):
+        self._running = False
+        self._pending_event.set()
+        with self._jpeg_condition:
+            self._jpeg_condition.notify_all()
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def has_viewers(self) -> bool:
+        return self.viewers > 0
+
+    def add_viewer(self):
+        with self._viewers_lock:
+            self.viewers += 1
+
+    def remove_viewer(self):
+        with self._viewers_lock:
+            self.viewers -= 1
+
+    def wants_frame(self) -> bool:
+        """Returns True when a viewer is connected and the frame rate budget allows a frame."""
+        return self.has_viewers() and time.monotonic() - self._last_submitted >= self.frame_interval
+
+    def submit(self, frame: ndarray):
+        """Hands a rendered frame to the encoder thread, replacing any frame not yet encoded."""
+        self._last_submitted = time.monotonic()
+        with self._pending_lock:
+            if self._pending is None or self._pending.shape != frame.shape:
+                self._pending = frame.copy()
+            else:
+                np.copyto(self._pending, frame)
+            self._pending_event.set()
+
+    def wait_for_jpeg(self, last_sequence: int, timeout: float) -> tuple:
+        """Blocks until a frame newer than ``last_sequence`` is encoded.
+
+        Returns:
+            tuple: (sequence, jpeg bytes), the jpeg is None on timeout or shutdown
+        """
+        with self._jpeg_condition:
+            self._jpeg_condition.wait_for(
+                lambda: self._sequence > last_sequence or not self._running, timeout)
+            if self._sequence > last_sequence:
+                return self._sequence, self._jpeg
+            return last_sequence, None
+
+    def latest_jpeg(self) -> Optional[bytes]:
+        return self._jpeg
+
+    def _encode_loop(self):
+        encode_parameters = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        frame = None
+        while self._running:
+            self._pending_event.wait()
+            with self._pending_lock:
+                self._pending_event.clear()
+                if self._pending is None:
+                    continue
+                # Swap buffers so the detector can fill the next frame while this one encodes
+                frame, self._pending = self._pending, frame
+            is_encoded, jpeg = cv2.imencode(".jpg", frame, encode_parameters)
+            if is_encoded:
+                with self._jpeg_condition:
+                    self._jpeg = jpeg.tobytes()
+                    self._sequence += 1
+                    self._jpeg_condition.notify_all()
+
+
+class _PreviewRequestHandler(BaseHTTPRequestHandler):
+
+    VIEWER_PAGE = (b"<!DOCTYPE html><html><head><title>VehiScan preview</title></head>"
+                   b"<body style=\"margin:0;background:#000\">"
+                   b"<img src=\"/stream\" style=\"width:100%\"></body></html>")
+
+    def do_GET(self):
+        preview: MjpegPreviewServer = self.server.preview
+        if self.path == "/":
+            self._send_body(self.VIEWER_PAGE, "text/html")
+        elif self.path == "/snapshot.jpg":
+            jpeg = preview.latest_jpeg()
+            if jpeg is None:
+                self.send_error(503, "No frame rendered yet")
+            else:
+                self._send_body(jpeg, "image/jpeg")
+        elif self.path == "/stream":
+            self._stream(preview)
+        else:
+            self.send_error(404)
+
+    def _send_body(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, preview: MjpegPreviewServer):
+        # Counted before the headers go out, so the detector renders for a client as soon as it connects
+        preview.add_viewer()
+        sequence = 0
+        try:
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache, private")
+            self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={STREAM_BOUNDARY}")
+            self.end_headers()
+            while preview.is_running:
+                sequence, jpeg = preview.wait_for_jpeg(sequence, CLIENT_FRAME_TIMEOUT)
+                if jpeg is None:
+                    continue
+                self.wfile.write(f"--{STREAM_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                 f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            preview.remove_viewer()
+
+    def log_message(self, format, *args):
+        logging.debug("Preview %s - %s", self.address_string(), format % args)
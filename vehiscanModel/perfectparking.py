@@ -4,6 +4,8 @@ from requests.auth import HTTPBasicAuth
 import requests
 from cv2 import destroyAllWindows, imshow, imwrite, INTER_CUBIC, Mat, resize, VideoCapture, waitKey
 
+SNAPSHOT_UPLOAD_TIMEOUT = 30  # Seconds
+
 
 class ParkingMonitorData:
     """This class represents the data of a parking monitor"""
@@ -28,7 +30,19 @@ class ParkingMonitorData:
         self.app_username = config_parser["App"]["Username"]
         self.app_password = config_parser["App"]["Password"]
         self.server_url = config_parser["App"]["ServerUrl"]
-        
+
+        # Optional per camera preprocessing, see preprocessing.FramePreprocessor
+        self.preprocessing_mode = config_parser.get("Preprocessing", "Mode", fallback="full")
+        self.preprocessing_clip_limit = config_parser.getfloat("Preprocessing", "ClipLimit", fallback=3.0)
+        self.preprocessing_tile_grid = config_parser.getint("Preprocessing", "TileGrid", fallback=8)
+        self.preprocessing_downscale_factor = config_parser.getint("Preprocessing", "DownscaleFactor", fallback=4)
+        self.preprocessing_auto_daylight = config_parser.getboolean("Preprocessing", "AutoDaylight", fallback=True)
+
+        # Optional periodic snapshot upload, see snapshot_uploader.SnapshotUploader
+        self.snapshot_enabled = config_parser.getboolean("Snapshot", "Enabled", fallback=False)
+        self.snapshot_interval_seconds = config_parser.getfloat("Snapshot", "IntervalSeconds", fallback=60.0)
+        self.snapshot_max_width = config_parser.getint("Snapshot", "MaxWidth", fallback=640)
+        self.snapshot_jpeg_quality = config_parser.getint("Snapshot", "JpegQuality", fallback=70)
 
 class RestApiUtility:
     """This class contains utility methods for interacting with the server REST API"""
@@ -121,6 +135,30 @@ class RestApiUtility:
 
         return response
 
+    @staticmethod
+    def upload_parking_monitor_snapshot(parking_monitor_data: ParkingMonitorData, jpeg_bytes: bytes) -> requests.Response:
+        """Uploads a JPEG snapshot of the monitored lot as a multipart PUT request.
+
+        Args:
+            parking_monitor_data (ParkingMonitorData): the parking monitor data
+            jpeg_bytes (bytes): the JPEG encoded snapshot
+
+        Returns:
+            requests.Response: the response from the server
+        """
+        request_headers = {
+            "Authorization": f"Token {parking_monitor_data.app_token}",
+        }
+        request_url = f"{parking_monitor_data.server_url}/{parking_monitor_data.id}/snapshot/"
+        http_basic_auth = HTTPBasicAuth(parking_monitor_data.app_username,
+                                        parking_monitor_data.app_password)
+        files = {"image": (f"monitor-{parking_monitor_data.id}.jpg", jpeg_bytes, "image/jpeg")}
+        return requests.put(request_url,
+                            auth=http_basic_auth,
+                            headers=request_headers,
+                            files=files,
+                            timeout=SNAPSHOT_UPLOAD_TIMEOUT)
+
 def create_image_from_video(image_file_path:str, video_connection_string:str) -> None:
     """ Creates an image file from a video source.
 
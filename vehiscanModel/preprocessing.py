@@ -0,0 +1,157 @@
+"""This module contains the frame preprocessing stage that runs before inference.
+
+The stage replaces the old per-frame ``_enhance_contrast`` which created a new CLAHE
+object, split/merged the LAB planes and allocated two color conversions for every frame.
+Here the CLAHE instance and all intermediate buffers are created once per frame size and
+reused, and the work can be limited to the lot ROI or a downscaled luminance plane.
+"""
+import cv2
+import numpy as np
+from numpy import ndarray
+from typing import Optional
+
+MODE_OFF = "off"
+MODE_FULL = "full"
+MODE_ROI = "roi"
+MODE_LUMINANCE = "luminance"
+MODES = (MODE_OFF, MODE_FULL, MODE_ROI, MODE_LUMINANCE)
+
+DEFAULT_CLIP_LIMIT = 3.0
+DEFAULT_TILE_GRID = 8
+DEFAULT_DOWNSCALE_FACTOR = 4
+DAYLIGHT_MEAN_LUMINANCE = 120   # Mean L above this ...
+DAYLIGHT_MIN_CONTRAST = 45      # ... with a standard deviation above this is considered daylight
+DAYLIGHT_HYSTERESIS = 10        # Luminance margin required to switch back on
+DAYLIGHT_CHECK_INTERVAL = 30    # Frames between histogram checks
+DAYLIGHT_SAMPLE_WIDTH = 160     # Width of the plane used for histogram stats
+
+
+class FramePreprocessor:
+    """Applies CLAHE to the luminance of a frame using preallocated buffers.
+
+    Modes:
+        off: frames are passed through untouched.
+        full: CLAHE on the luminance of the whole frame (the previous behaviour).
+        roi: CLAHE only inside the bounding rect of the parking spots.
+        luminance: CLAHE on a downscaled gray plane; the correction is upscaled and added
+            to every color channel, skipping the LAB round trip entirely.
+
+    The returned frame is an internal buffer that is overwritten by the next call.
+    """
+
+    def __init__(self, mode: str = MODE_FULL, roi: Optional[tuple] = None,
+                 clip_limit: float = DEFAULT_CLIP_LIMIT, tile_grid: int = DEFAULT_TILE_GRID,
+                 downscale_factor: int = DEFAULT_DOWNSCALE_FACTOR, auto_daylight: bool = True):
+        if mode not in MODES:
+            raise ValueError(f"Unknown preprocessing mode '{mode}', expected one of {MODES}")
+        self.mode = mode
+        self.roi = roi
+        self.downscale_factor = max(int(downscale_factor), 1)
+        self.auto_daylight = auto_daylight
+        self.is_daylight = False
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid, tile_grid))
+        self._frame_count = 0
+        self._shape = None
+        self._region = None
+
+    @classmethod
+    def from_monitor_data(cls, parking_monitor_data, roi: Optional[tuple] = None) -> "FramePreprocessor":
+        """Builds the preprocessor configured in the camera's config.ini [Preprocessing] section."""
+        return cls(mode=parking_monitor_data.preprocessing_mode,
+                   roi=roi,
+                   clip_limit=parking_monitor_data.preprocessing_clip_limit,
+                   tile_grid=parking_monitor_data.preprocessing_tile_grid,
+                   downscale_factor=parking_monitor_data.preprocessing_downscale_factor,
+                   auto_daylight=parking_monitor_data.preprocessing_auto_daylight)
+
+    def process(self, frame: ndarray) -> ndarray:
+        """Returns the preprocessed frame.
+
+        Args:
+            frame (ndarray): the BGR video frame
+
+        Returns:
+            ndarray: the enhanced frame, or ``frame`` itself when enhancement is off
+        """
+        if self.mode == MODE_OFF:
+            return frame
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+
+        if self.auto_daylight and self._frame_count % DAYLIGHT_CHECK_INTERVAL == 0:
+            self._update_daylight(frame)
+        self._frame_count += 1
+        if self.is_daylight:
+            return frame
+
+        x1, y1, x2, y2 = self._region
+        if self.mode == MODE_ROI:
+            np.copyto(self._output, frame)
+            self._enhance(frame[y1:y2, x1:x2])
+            self._output[y1:y2, x1:x2] = self._region_output
+            return self._output
+        if self.mode == MODE_LUMINANCE:
+            self._enhance_downscaled(frame)
+        else:
+            self._enhance(frame)
+        return self._region_output
+
+    def _allocate(self, shape: tuple):
+        height, width = shape[:2]
+        if self.mode == MODE_ROI and self.roi is not None:
+            x1, y1, x2, y2 = self.roi
+            self._region = (max(x1, 0), max(y1, 0), min(x2, width), min(y2, height))
+        else:
+            self._region = (0, 0, width, height)
+        x1, y1, x2, y2 = self._region
+        region_shape = (y2 - y1, x2 - x1)
+
+        self._output = np.empty(shape, dtype=np.uint8)
+        self._region_output = np.empty(region_shape + (3,), dtype=np.uint8)
+        self._lab = np.empty(region_shape + (3,), dtype=np.uint8)
+        self._luminance = np.empty(region_shape, dtype=np.uint8)
+        self._enhanced = np.empty(region_shape, dtype=np.uint8)
+
+        small_shape = (max(region_shape[0] // self.downscale_factor, 1),
+                       max(region_shape[1] // self.downscale_factor, 1))
+        self._small = np.empty(small_shape, dtype=np.uint8)
+        self._small_enhanced = np.empty(small_shape, dtype=np.uint8)
+        self._small_delta = np.empty(small_shape, dtype=np.int16)
+        self._delta = np.empty(region_shape, dtype=np.int16)
+        self._color_delta = np.empty(region_shape + (3,), dtype=np.int16)
+
+        sample_height = max(height * DAYLIGHT_SAMPLE_WIDTH // max(width, 1), 1)
+        self._sample = np.empty((sample_height, DAYLIGHT_SAMPLE_WIDTH, 3), dtype=np.uint8)
+        self._sample_gray = np.empty((sample_height, DAYLIGHT_SAMPLE_WIDTH), dtype=np.uint8)
+        self._shape = shape
+
+    def _enhance(self, region: ndarray):
+        cv2.cvtColor(region, cv2.COLOR_BGR2LAB, dst=self._lab)
+        cv2.extractChannel(self._lab, 0, dst=self._luminance)
+        self.clahe.apply(self._luminance, dst=self._enhanced)
+        cv2.insertChannel(self._enhanced, self._lab, 0)
+        cv2.cvtColor(self._lab, cv2.COLOR_LAB2BGR, dst=self._region_output)
+
+    def _enhance_downscaled(self, region: ndarray):
+        """Runs CLAHE on a downscaled gray plane and adds the upscaled correction back."""
+        cv2.cvtColor(region, cv2.COLOR_BGR2GRAY, dst=self._luminance)
+        small_size = (self._small.shape[1], self._small.shape[0])
+        full_size = (self._luminance.shape[1], self._luminance.shape[0])
+        cv2.resize(self._luminance, small_size, dst=self._small, interpolation=cv2.INTER_AREA)
+        self.clahe.apply(self._small, dst=self._small_enhanced)
+        cv2.subtract(self._small_enhanced, self._small, dst=self._small_delta, dtype=cv2.CV_16S)
+        cv2.resize(self._small_delta, full_size, dst=self._delta, interpolation=cv2.INTER_LINEAR)
+        cv2.merge([self._delta, self._delta, self._delta], dst=self._color_delta)
+        cv2.add(region, self._color_delta, dst=self._region_output, dtype=cv2.CV_8U)
+
+    def _update_daylight(self, frame: ndarray):
+        """Switches enhancement off when the histogram says the scene is bright and contrasty."""
+        cv2.resize(frame, (self._sample.shape[1], self._sample.shape[0]), dst=self._sample,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._sample, cv2.COLOR_BGR2GRAY, dst=self._sample_gray)
+        mean, std = cv2.meanStdDev(self._sample_gray)
+        mean, std = float(mean[0][0]), float(std[0][0])
+        if self.is_daylight:
+            self.is_daylight = mean > DAYLIGHT_MEAN_LUMINANCE - DAYLIGHT_HYSTERESIS and std > DAYLIGHT_MIN_CONTRAST
+        else:
+            self.is_daylight = mean > DAYLIGHT_MEAN_LUMINANCE and std > DAYLIGHT_MIN_CONTRAST
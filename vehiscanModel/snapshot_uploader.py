@@ -0,0 +1,97 @@
+"""This module uploads periodic annotated snapshots of the lot to the server.
+
+Snapshots are taken at a low, configurable rate and handed to a worker thread which
+downscales, hashes, JPEG-compresses and uploads them as a separate multipart request, so
+the detection loop never waits on the network. Uploads are skipped while the scene hash
+(a coarse average hash of the frame plus the occupancy state) is unchanged.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+import requests
+from numpy import ndarray
+
+from perfectparking import ParkingMonitorData, RestApiUtility
+
+SCENE_HASH_SIZE = 16  # The frame is reduced to SCENE_HASH_SIZE x SCENE_HASH_SIZE for hashing
+
+
+def scene_hash(frame: ndarray, occupied: ndarray) -> bytes:
+    """Returns an average hash of the frame combined with the spot occupancy bits."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (SCENE_HASH_SIZE, SCENE_HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return np.packbits(small > small.mean()).tobytes() + np.packbits(np.asarray(occupied, dtype=bool)).tobytes()
+
+
+class SnapshotUploader:
+    """Uploads downscaled, JPEG-compressed snapshots to ParkingLotMonitor.image."""
+
+    def __init__(self, parking_monitor_data: ParkingMonitorData):
+        self.parking_monitor_data = parking_monitor_data
+        self.interval = parking_monitor_data.snapshot_interval_seconds
+        self.max_width = parking_monitor_data.snapshot_max_width
+        self.jpeg_quality = parking_monitor_data.snapshot_jpeg_quality
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self._last_submitted = float("-inf")
+        self._last_hash: Optional[bytes] = None
+        self._queue = queue.Queue(maxsize=1)
+        self._worker = threading.Thread(target=self._upload_loop, name="snapshot-uploader", daemon=True)
+        self._worker.start()
+
+    def is_due(self) -> bool:
+        return time.monotonic() - self._last_submitted >= self.interval
+
+    def submit(self, frame: ndarray, occupied: ndarray):
+        """Queues a copy of the annotated frame, dropping a snapshot still waiting for upload."""
+        self._last_submitted = time.monotonic()
+        snapshot = (frame.copy(), np.array(occupied, dtype=bool))
+        try:
+            self._queue.put_nowait(snapshot)
+        except queue.Full:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(snapshot)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _upload_loop(self):
+        while True:
+            snapshot = self._queue.get()
+            if snapshot is None:
+                return
+            frame, occupied = snapshot
+            height, width = frame.shape[:2]
+            if width > self.max_width:
+                frame = cv2.resize(frame, (self.max_width, height * self.max_width // width),
+                                   interpolation=cv2.INTER_AREA)
+
+            current_hash = scene_hash(frame, occupied)
+            if current_hash == self._last_hash:
+                self.skipped += 1
+                continue
+
+            is_encoded, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not is_encoded:
+                continue
+            try:
+                response = RestApiUtility.upload_parking_monitor_snapshot(self.parking_monitor_data, jpeg.tobytes())
+            except requests.RequestException as error:
+                self.failed += 1
+                logging.warning("Snapshot upload failed: %s", error)
+                continue
+            if response.ok:
+                self.uploaded += 1
+                self._last_hash = current_hash
+            else:
+                self.failed += 1
+                logging.warning("Snapshot upload rejected: %s %s", response.status_code, response.text[:200])
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from inference_scheduler import InferenceScheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class InferenceSchedulerTestSuite(unittest.TestCase):
+    """Inference scheduler test cases."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = InferenceScheduler(budget_per_second=2, min_refresh_seconds=20, clock=self.clock)
+        self.scheduler.register("entrance")
+        self.scheduler.register("overnight")
+
+    def run_frames(self, seconds: float, fps: int = 10) -> dict:
+        granted = {"entrance": 0, "overnight": 0}
+        for _ in range(int(seconds * fps)):
+            self.clock.now += 1.0 / fps
+            for camera_id in granted:
+                if self.scheduler.acquire(camera_id):
+                    granted[camera_id] += 1
+                    self.scheduler.report(camera_id, 2 if camera_id == "entrance" else 0)
+        return granted
+
+    def test_budget_follows_churn(self):
+        """The churning camera gets most of the budget, which is never exceeded."""
+        granted = self.run_frames(120)
+        self.assertGreater(granted["entrance"], 3 * granted["overnight"])
+        self.assertLessEqual(sum(granted.values()), 2 * 120 + 2 + len(granted))
+
+    def test_minimum_refresh_is_guaranteed(self):
+        """A quiet camera is still refreshed at least once per min_refresh_seconds."""
+        self.run_frames(120)
+        self.assertLessEqual(self.scheduler.staleness()["overnight"], 20 + 0.1)
+        self.assertIn("staleness_seconds", self.scheduler.stats()["overnight"])
+
+
+    def test_fractional_budget(self):
+        """Budgets below one detection per second are spent, not only the minimum refreshes."""
+        self.scheduler = InferenceScheduler(budget_per_second=0.5, min_refresh_seconds=20, clock=self.clock)
+        self.scheduler.register("entrance")
+        self.scheduler.register("overnight")
+        granted = self.run_frames(60)
+        self.assertGreaterEqual(sum(granted.values()), 0.5 * 60 - len(granted))
+        self.assertLessEqual(sum(granted.values()), 0.5 * 60 + 1 + len(granted))
+
+if __name__ == "__main__":
+    unittest.main()
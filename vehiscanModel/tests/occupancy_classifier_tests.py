@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from occupancy_classifier import OccupancyClassifier
+
+
+class Spot:
+    """Minimal stand-in for motion_detector.ParkingSpot, which needs YOLO to import."""
+
+    def __init__(self, x, y, w, h):
+        self.rect = (x, y, w, h)
+        self.mask = np.ones((h, w), dtype=bool)
+
+
+class OccupancyClassifierTestSuite(unittest.TestCase):
+    """Occupancy classifier test cases."""
+
+    def setUp(self):
+        self.spots = [Spot(10, 10, 40, 60), Spot(60, 10, 40, 60)]
+        self.classifier = OccupancyClassifier(self.spots)
+        self.empty_frame = np.full((100, 120, 3), 90, dtype=np.uint8)
+        cv2.randn(self.empty_frame, (90, 90, 90), (4, 4, 4))
+
+    def test_spots_are_ambiguous_until_learned(self):
+        """Spots without an empty reference are always sent to YOLO."""
+        _, ambiguous, _ = self.classifier.classify(self.empty_frame)
+        self.assertTrue(ambiguous.all())
+        self.assertEqual(self.classifier.stats.frames_without_yolo, 0)
+
+    def test_learned_spots_skip_yolo(self):
+        """Once learned, an empty spot is settled without YOLO and a car is flagged occupied."""
+        self.classifier.classify(self.empty_frame)
+        self.classifier.learn(np.array([0, 1]), np.array([False, False]))
+
+        car_frame = self.empty_frame.copy()
+        cv2.rectangle(car_frame, (62, 15), (97, 65), (20, 20, 200), -1)
+        cv2.rectangle(car_frame, (70, 25), (90, 55), (240, 240, 240), 2)
+        occupied, ambiguous, _ = self.classifier.classify(car_frame)
+
+        self.assertFalse(ambiguous[0])
+        self.assertFalse(occupied[0])
+        self.assertFalse(ambiguous[1])
+        self.assertTrue(occupied[1])
+        self.assertGreater(self.classifier.stats.spot_avoidance_rate, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import http.client
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from colors import COLOR_BLUE, COLOR_GREEN, COLOR_WHITE
+from drawing_utils import draw_contours, label_center
+from overlay_renderer import MjpegPreviewServer, OverlayRenderer, STREAM_BOUNDARY
+
+
+def create_spot(parking_spot_id: int, points: list) -> SimpleNamespace:
+    coordinates = np.array(points, dtype=np.int32)
+    return SimpleNamespace(parking_spot_id=parking_spot_id, coordinates=coordinates,
+                           label_center=label_center(coordinates))
+
+
+class OverlayRendererTestSuite(unittest.TestCase):
+    """Overlay renderer test cases."""
+
+    def setUp(self):
+        self.frame = np.empty((120, 160, 3), dtype=np.uint8)
+        cv2.randu(self.frame, 0, 256)
+        self.parking_spots = [
+            create_spot(1, [[10, 10], [70, 10], [70, 100], [10, 100]]),
+            create_spot(12, [[85, 10], [150, 10], [150, 100], [85, 100]]),
+        ]
+
+    def draw_directly(self, occupied: list) -> np.ndarray:
+        expected = self.frame.copy()
+        for spot, is_occupied in zip(self.parking_spots, occupied):
+            draw_contours(expected, spot.coordinates, str(spot.parking_spot_id), COLOR_WHITE,
+                          COLOR_BLUE if is_occupied else COLOR_GREEN, center=spot.label_center)
+        return expected
+
+    def test_overlay_matches_direct_draw(self):
+        """The overlay matches draw_contours, up to rounding on the anti-aliased label edges."""
+        renderer = OverlayRenderer(self.parking_spots)
+        for occupied in ([False, True], [True, False], [False, False]):
+            output = renderer.render(self.frame, np.array(occupied))
+            difference = np.abs(output.astype(np.int16) - self.draw_directly(occupied))
+            self.assertLessEqual(difference.max(), 2)
+
+    def test_label_has_no_halo(self):
+        """Pixels around a label keep the frame, the label stroke is no wider than the drawn text."""
+        renderer = OverlayRenderer(self.parking_spots)
+        output = renderer.render(self.frame, np.array([False, False]))
+        changed = np.any(output != self.frame, axis=2)
+        drawn = np.any(self.draw_directly([False, False]) != self.frame, axis=2)
+        self.assertFalse(np.any(changed & ~drawn))
+        self.assertIsNot(output, self.frame)
+
+
+class MjpegPreviewServerTestSuite(unittest.TestCase):
+    """MJPEG preview server test cases."""
+
+    def setUp(self):
+        self.preview = MjpegPreviewServer(port=0, fps=100.0)
+        self.preview.start()
+        self.addCleanup(self.preview.stop)
+        self.port = self.preview._http_server.server_address[1]
+        self.frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.frame[:, 32:] = COLOR_GREEN
+
+    def get(self, path: str) -> http.client.HTTPResponse:
+        connection = http.client.HTTPConnection(self.preview.host, self.port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("GET", path)
+        return connection.getresponse()
+
+    def wait_for_frame(self):
+        self.preview.submit(self.frame)
+        _, jpeg = self.preview.wait_for_jpeg(0, 5)
+        self.assertIsNotNone(jpeg)
+
+    def test_snapshot(self):
+        """The snapshot is unavailable until a frame is encoded, then it is the latest frame."""
+        self.assertEqual(self.get("/snapshot.jpg").status, 503)
+
+        self.wait_for_frame()
+        response = self.get("/snapshot.jpg")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "image/jpeg")
+        image = cv2.imdecode(np.frombuffer(response.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape, self.frame.shape)
+        self.assertLessEqual(np.abs(image.astype(np.int16) - self.frame).mean(), 2)
+
+    def test_stream(self):
+        """A stream client counts as a viewer and receives multipart JPEG frames."""
+        self.assertFalse(self.preview.wants_frame())
+        response = self.get("/stream")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"),
+                         f"multipart/x-mixed-replace; boundary={STREAM_BOUNDARY}")
+        self.assertTrue(self.preview.has_viewers())
+        self.assertTrue(self.preview.wants_frame())
+
+        self.wait_for_frame()
+        self.assertEqual(response.readline(), f"--{STREAM_BOUNDARY}\r\n".encode())
+        self.assertEqual(response.readline(), b"Content-Type: image/jpeg\r\n")
+        length = int(response.readline().decode().split(":")[1])
+        response.readline()
+        image = cv2.imdecode(np.frombuffer(response.read(length), dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape, self.frame.shape)
+
+    def test_unknown_path(self):
+        self.assertEqual(self.get("/missing").status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from preprocessing import FramePreprocessor, MODE_FULL, MODE_OFF, MODE_ROI
+
+
+class FramePreprocessorTestSuite(unittest.TestCase):
+    """Frame preprocessor test cases."""
+
+    def setUp(self):
+        self.frame = np.empty((120, 160, 3), dtype=np.uint8)
+        cv2.randu(self.frame, 0, 120)
+
+    def test_full_mode_matches_previous_enhancement(self):
+        """The full mode reproduces the old split/merge CLAHE output."""
+        lab = cv2.cvtColor(self.frame, cv2.COLOR_BGR2LAB)
+        l_channel, a, b = cv2.split(lab)
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        expected = cv2.cvtColor(cv2.merge([clahe.apply(l_channel), a, b]), cv2.COLOR_LAB2BGR)
+
+        preprocessor = FramePreprocessor(mode=MODE_FULL, auto_daylight=False)
+        np.testing.assert_array_equal(preprocessor.process(self.frame), expected)
+
+    def test_roi_mode_leaves_outside_untouched(self):
+        """Only the lot ROI is enhanced in roi mode."""
+        preprocessor = FramePreprocessor(mode=MODE_ROI, roi=(0, 60, 160, 120), auto_daylight=False)
+        output = preprocessor.process(self.frame)
+        np.testing.assert_array_equal(output[:60], self.frame[:60])
+
+    def test_daylight_switches_enhancement_off(self):
+        """A bright, contrasty frame is passed through untouched."""
+        daylight = np.zeros((120, 160, 3), dtype=np.uint8)
+        daylight[:, 40:] = 255
+        self.assertIs(FramePreprocessor().process(daylight), daylight)
+        self.assertIs(FramePreprocessor(mode=MODE_OFF).process(self.frame), self.frame)
+
+
+if __name__ == "__main__":
+    unittest.main()
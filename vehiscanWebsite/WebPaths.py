@@ -5,6 +5,10 @@ REGISTER_USER = 'register-user'
 PARKING_LOT_MONITOR = 'parking-lot-monitor'
 PARKING_LOT_MONITORS = 'parking-lot-monitors'
 PRIVACY_POLICY = "privacy-policy"
+AVAILABILITY_STREAM = "availability/stream"
+"""The server-sent events stream of availability changes."""
+LOG_WRITER_STATS = "stats/log-writers"
+"""The staff-only stats of the batched log writers."""
 PARKING_LOT = "parking-lot"
 BOOKING= "book_parking"
 USER_DETAILS = "user_details"
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from vehiscanWebsite.models import ParkingLot, ParkingLotMonitor, UserProfile, EmailOTP, PendingParkingLotRegistration
+from vehiscanWebsite.models import ParkingLot, ParkingLotMonitor, UserProfile, EmailOTP, PendingParkingLotRegistration, GeocodedPlace
 
 # Register your models here.
 
@@ -8,6 +8,7 @@ admin.site.register(ParkingLot)
 admin.site.register(ParkingLotMonitor)
 admin.site.register(UserProfile)
 admin.site.register(EmailOTP)
+admin.site.register(GeocodedPlace)
 
 class PendingParkingLotRegistrationAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'status', 'submitted_date')
@@ -0,0 +1,92 @@
+"""This module contains the live fleet availability snapshot read by the map page and the streams.
+
+Availability only changes when a camera pushes an update, so the whole fleet is kept in
+the Django cache instead of being read from the lot rows on every map view or stream poll:
+the snapshot (``get_fleet_snapshot``) holds the map fields and availability counters of
+every lot, exactly what ``ParkingLot.objects.with_availability`` reads, and is stored
+under a version number that is bumped on every change, so map pages and clients can tell
+whether anything changed. Pages and the API read the counters of the lot rows directly.
+
+The version follows the signals in ``signals.py`` once a transaction saving or deleting a
+monitor or a lot commits, so the snapshot never shows availability that is rolled back.
+The snapshot is never patched, a change only bumps the version and the next reader
+rebuilds the snapshot from the database. Writes that bypass ``save`` (queryset updates)
+show once ``manage.py recount_parking_lot_availability`` repaired the counters.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ParkingLot
+
+FLEET_VERSION_KEY = "availability:fleet-version"
+FLEET_KEY_PREFIX = "availability:fleet:"
+FLEET_CACHE_TIMEOUT = getattr(settings, "AVAILABILITY_FLEET_CACHE_TIMEOUT", 5 * 60)
+"""Keeps snapshots of versions nobody reads anymore from piling up in the cache."""
+
+
+def build_entries() -> dict:
+    """Reads the availability of every lot from the database in one query.
+
+    Returns:
+        dict: The availability entries by lot id.
+    """
+    return {
+        row["id"]: {
+            "id": row["id"],
+            "name": row["name"],
+            "latitude": float(row["latitude"]),
+            "longitude": float(row["longitude"]),
+            "parking_spaces": row["parking_spaces"],
+            "free_parking_spaces": row["annotated_free_parking_spaces"],
+            "probability_parking_available": row["annotated_probability_parking_available"],
+            "date_time_last_updated": row["annotated_date_time_last_updated"],
+        }
+        for row in ParkingLot.objects.with_availability().values(
+            "id", "name", "latitude", "longitude", "parking_spaces", "annotated_free_parking_spaces",
+            "annotated_probability_parking_available", "annotated_date_time_last_updated")
+    }
+
+
+def get_fleet_snapshot() -> tuple:
+    """Returns the availability of every lot with the version it was taken at.
+
+    Returns:
+        tuple: (version, entries by lot id)
+    """
+    # The version is read first: a change committed after the snapshot was read bumps it again
+    version = get_fleet_version()
+    entries = cache.get(f"{FLEET_KEY_PREFIX}{version}")
+    if entries is None:
+        entries = build_entries()
+        cache.set(f"{FLEET_KEY_PREFIX}{version}", entries, FLEET_CACHE_TIMEOUT)
+    return version, entries
+
+
+def invalidate_fleet_snapshot():
+    """Bumps the fleet version, so the next reader rebuilds the snapshot with the committed availability.
+
+    Call it once the change is committed, see ``signals.py``.
+    """
+    version = _bump_fleet_version()
+    cache.delete(f"{FLEET_KEY_PREFIX}{version - 1}")
+
+
+def get_fleet_version() -> int:
+    """Returns the current fleet snapshot version, a cheap way to tell whether anything changed."""
+    version = cache.get(FLEET_VERSION_KEY)
+    if version is None:
+        # Versions start from the clock, so a version evicted from the cache is never reused
+        version = time.time_ns() // 1000
+        cache.add(FLEET_VERSION_KEY, version, None)
+        version = cache.get(FLEET_VERSION_KEY, version)
+    return version
+
+
+def _bump_fleet_version() -> int:
+    try:
+        return cache.incr(FLEET_VERSION_KEY)
+    except ValueError:
+        # The version was evicted since it was read
+        return get_fleet_version()
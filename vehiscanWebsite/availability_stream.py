@@ -0,0 +1,259 @@
+"""This module streams availability changes to browsers over server-sent events.
+
+Every worker process runs one ``AvailabilityHub``. While it has subscribers, the hub
+watches the fleet snapshot version of the availability cache (see ``availability.py``)
+and, when the version moves, diffs the new snapshot against the previous one and fans
+the changed lots out to the subscribers whose region contains them. Updates saved by the
+worker itself wake its hub right away. Updates saved by other workers only reach it
+through a cache they share, Redis (``REDIS_URL`` in the settings): with the default
+local memory cache every process has its own version, so the site must run a single
+worker for its streams to see every update.
+
+A subscriber only holds a bounded queue of encoded events and each changed lot is
+encoded once per change, so one worker can keep thousands of streams open. Streams need
+an ASGI server; under WSGI the view sends the current snapshot and asks the browser to
+reconnect a few seconds later, which degrades to polling.
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .availability import get_fleet_snapshot, get_fleet_version
+
+DELTA_FIELDS = ("name", "latitude", "longitude", "parking_spaces", "free_parking_spaces",
+                "probability_parking_available", "date_time_last_updated")
+"""The entry fields whose change is streamed."""
+KEEPALIVE_EVENT = b": keepalive\n\n"
+DEFAULT_POLL_SECONDS = 1.0
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_KEEPALIVE_SECONDS = 15.0
+DEFAULT_MAX_SUBSCRIBERS = 10000
+POLLING_RETRY_MILLISECONDS = 5000
+"""How soon browsers reconnect when the stream could not be held open."""
+
+
+@dataclass(frozen=True)
+class Region:
+    """The lots a stream subscribes to: a bounding box, a set of lots, or both.
+
+    A region with neither covers the whole fleet.
+    """
+    min_latitude: Optional[float] = None
+    min_longitude: Optional[float] = None
+    max_latitude: Optional[float] = None
+    max_longitude: Optional[float] = None
+    parking_lot_ids: Optional[frozenset] = None
+
+    def contains(self, entry: dict) -> bool:
+        if self.parking_lot_ids is not None and entry["id"] in self.parking_lot_ids:
+            return True
+        if self.min_latitude is None:
+            return self.parking_lot_ids is None
+        return (self.min_latitude <= entry["latitude"] <= self.max_latitude
+                and self.min_longitude <= entry["longitude"] <= self.max_longitude)
+
+
+def parse_region(query_dict) -> Region:
+    """Reads the ``bbox`` (``south,west,north,east``) and ``lots`` (``1,2,3``) parameters.
+
+    Raises:
+        ValueError: When a parameter is malformed.
+    """
+    bounds = {}
+    if query_dict.get("bbox"):
+        south, west, north, east = (float(value) for value in query_dict["bbox"].split(","))
+        if south > north or west > east:
+            raise ValueError("The bounding box must be south,west,north,east.")
+        bounds = {"min_latitude": south, "min_longitude": west, "max_latitude": north, "max_longitude": east}
+    parking_lot_ids = None
+    if query_dict.get("lots"):
+        parking_lot_ids = frozenset(int(value) for value in query_dict["lots"].split(","))
+    return Region(parking_lot_ids=parking_lot_ids, **bounds)
+
+
+def diff_snapshots(previous: dict, current: dict) -> tuple:
+    """Compares two fleet snapshots.
+
+    Returns:
+        tuple: (entries of the new and changed lots, entries of the removed lots)
+    """
+    changed = [entry for parking_lot_id, entry in current.items()
+               if parking_lot_id not in previous
+               or any(previous[parking_lot_id][field] != entry[field] for field in DELTA_FIELDS)]
+    removed = [entry for parking_lot_id, entry in previous.items() if parking_lot_id not in current]
+    return changed, removed
+
+
+def format_event(event: str, data: str, event_id=None) -> bytes:
+    """Encodes a server-sent event whose data is already JSON."""
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", f"data: {data}", "", ""]
+    return "\n".join(lines).encode()
+
+
+def encode_lots(version: int, encoded_lots: list) -> str:
+    return f'{{"version": {version}, "lots": [{", ".join(encoded_lots)}]}}'
+
+
+def snapshot_event(region: Region, version: int, entries: dict) -> bytes:
+    """Encodes the snapshot event of the lots of a region, the first event of every stream."""
+    lots = [_encode(entry) for entry in entries.values() if region.contains(entry)]
+    return format_event("snapshot", encode_lots(version, lots), version)
+
+
+def _encode(value) -> str:
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+class Subscription:
+    """The queue of encoded events of one open stream."""
+
+    def __init__(self, region: Region, max_queued: int):
+        self.region = region
+        self.queue = asyncio.Queue(max_queued)
+        self.resyncs = 0
+
+    def push(self, event: bytes):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client cannot keep up, drop what it has not read and let it reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event("resync", "{}"))
+            self.resyncs += 1
+
+
+class AvailabilityHub:
+    """Watches the fleet snapshot and fans its changes out to the open streams of a worker."""
+
+    def __init__(self, poll_seconds: float = DEFAULT_POLL_SECONDS, max_queued: int = DEFAULT_QUEUE_SIZE,
+                 max_subscribers: int = DEFAULT_MAX_SUBSCRIBERS):
+        self.poll_seconds = poll_seconds
+        self.max_queued = max_queued
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.published = 0
+        self._version = None
+        self._entries = {}
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    def is_full(self) -> bool:
+        return len(self.subscribers) >= self.max_subscribers
+
+    async def subscribe(self, region: Region) -> tuple:
+        """Opens a stream of the changes in a region.
+
+        Returns:
+            tuple: (the subscription, the snapshot event of the region to send first)
+        """
+        version, entries = await sync_to_async(get_fleet_snapshot)()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Streams never outlive their event loop, start over on a new one
+            self._loop, self._wakeup, self._task = loop, asyncio.Event(), None
+            self.subscribers.clear()
+        if self._task is None:
+            self._version, self._entries = version, entries
+            self._task = loop.create_task(self._run())
+
+        subscription = Subscription(region, self.max_queued)
+        self.subscribers.add(subscription)
+        return subscription, snapshot_event(region, version, entries)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def notify(self):
+        """Wakes the hub up after an update was saved, callable from any thread."""
+        loop, wakeup = self._loop, self._wakeup
+        if self._task is None or loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            # The loop was closed
+            pass
+
+    async def poll(self) -> int:
+        """Publishes the changes since the last poll and returns the number of changed lots."""
+        if await sync_to_async(get_fleet_version)() == self._version:
+            return 0
+        version, entries = await sync_to_async(get_fleet_snapshot)()
+        changed, removed = diff_snapshots(self._entries, entries)
+        self._version, self._entries = version, entries
+        self.publish(version, changed, removed)
+        return len(changed) + len(removed)
+
+    def publish(self, version: int, changed: list, removed: list):
+        """Sends the changed and removed lots to the subscribers whose region contains them."""
+        if not changed and not removed:
+            return
+        encoded = [(entry, _encode(entry)) for entry in changed]
+        encoded += [(entry, _encode({"id": entry["id"], "removed": True})) for entry in removed]
+        for subscription in list(self.subscribers):
+            lots = [data for entry, data in encoded if subscription.region.contains(entry)]
+            if lots:
+                subscription.push(format_event("delta", encode_lots(version, lots), version))
+        self.published += 1
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.poll()
+            except Exception:
+                logging.exception("Availability hub could not publish the latest changes")
+        self._task = None
+
+
+async def stream_events(hub: AvailabilityHub, subscription: Subscription, first_event: bytes,
+                        keepalive_seconds: float = DEFAULT_KEEPALIVE_SECONDS):
+    """Yields the events of a stream until the client disconnects."""
+    try:
+        yield first_event
+        while True:
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), keepalive_seconds)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield KEEPALIVE_EVENT
+    finally:
+        hub.unsubscribe(subscription)
+
+
+_hub: Optional[AvailabilityHub] = None
+
+
+def get_hub() -> AvailabilityHub:
+    """Returns the availability hub of this worker process."""
+    global _hub
+    if _hub is None:
+        _hub = AvailabilityHub(
+            poll_seconds=getattr(settings, "AVAILABILITY_STREAM_POLL_SECONDS", DEFAULT_POLL_SECONDS),
+            max_queued=getattr(settings, "AVAILABILITY_STREAM_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+            max_subscribers=getattr(settings, "AVAILABILITY_STREAM_MAX_SUBSCRIBERS", DEFAULT_MAX_SUBSCRIBERS),
+        )
+    return _hub
+
+
+@receiver(setting_changed)
+def reset_hub(setting, **kwargs):
+    """Rebuilds the hub when tests override its settings."""
+    global _hub
+    if setting.startswith("AVAILABILITY_STREAM_"):
+        _hub = None
@@ -0,0 +1,207 @@
+"""This module contains a write-behind buffer that inserts model rows in batches.
+
+High-volume append-only rows (logs) are buffered in memory and inserted with a single
+``bulk_create`` once ``max_size`` rows are waiting or the oldest row has waited
+``max_delay_seconds``. A daemon thread performs the time-based flushes, and pending rows
+are flushed when the process exits. With ``max_size`` of 1 or less rows are inserted
+right away in the caller's thread, which is what tests use.
+
+A full batch is inserted by the caller that filled it, unless the writer flushes in the
+background, in which case the caller only wakes the flush thread up. At most
+``max_pending`` rows wait; further rows are dropped and counted, so a stalled database
+cannot grow the buffer without bounds.
+
+Writers are configured with the ``<PREFIX>_BATCH_SIZE``, ``<PREFIX>_FLUSH_SECONDS``,
+``<PREFIX>_MAX_PENDING`` and ``<PREFIX>_FLUSH_IN_BACKGROUND`` settings and shared per
+model through ``get_writer``.
+"""
+import atexit
+import logging
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connections
+from django.dispatch import receiver
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_SECONDS = 5.0
+DROP_LOG_INTERVAL = 1000  # Dropped rows between two warnings
+
+
+class BufferedWriter:
+    """Buffers unsaved model instances and inserts them with ``bulk_create``."""
+
+    def __init__(self, model, max_size: int, max_delay_seconds: float, name: Optional[str] = None,
+                 max_pending: Optional[int] = None, flush_in_background: bool = False):
+        self.model = model
+        self.max_size = max_size
+        self.max_delay_seconds = max_delay_seconds
+        self.name = name or model.__name__
+        self.max_pending = max_pending or 10 * max(max_size, 1)
+        self.flush_in_background = flush_in_background
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.dropped_rows = 0
+        self.last_flush_size = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self._rows = []
+        self._oldest = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        if self.is_buffered:
+            atexit.register(self.close)
+
+    @property
+    def is_buffered(self) -> bool:
+        return self.max_size > 1
+
+    def add(self, instance):
+        """Queues an unsaved instance for insertion."""
+        if not self.is_buffered:
+            instance.save()
+            return
+        with self._lock:
+            if len(self._rows) >= self.max_pending:
+                self.dropped_rows += 1
+                dropped_rows = self.dropped_rows
+            else:
+                dropped_rows = 0
+                if not self._rows:
+                    self._oldest = time.monotonic()
+                self._rows.append(instance)
+            is_full = len(self._rows) >= self.max_size
+            self._start_thread()
+        if dropped_rows % DROP_LOG_INTERVAL == 1:
+            logging.warning("%s writer is %d rows behind, %d rows dropped so far",
+                            self.name, self.max_pending, dropped_rows)
+        if is_full:
+            if self.flush_in_background:
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> int:
+        """Inserts every pending row and returns how many were inserted."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            inserted = self._insert(rows)
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.flushes += 1
+                self.flushed_rows += inserted
+                self.failed_rows += len(rows) - inserted
+                self.last_flush_size = len(rows)
+                self.last_flush_seconds = seconds
+                self.total_flush_seconds += seconds
+            logging.debug("%s writer flushed %d rows in %.1f ms", self.name, len(rows), seconds * 1000)
+            return inserted
+
+    def stats(self) -> dict:
+        """Returns the pending rows, the dropped rows and the flush counts, sizes and latencies."""
+        with self._lock:
+            return {
+                "pending": len(self._rows),
+                "max_pending": self.max_pending,
+                "dropped_rows": self.dropped_rows,
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+                "failed_rows": self.failed_rows,
+                "last_flush_size": self.last_flush_size,
+                "last_flush_ms": round(self.last_flush_seconds * 1000, 3),
+                "mean_flush_size": round(self.flushed_rows / self.flushes, 1) if self.flushes else 0.0,
+                "mean_flush_ms": round(self.total_flush_seconds / self.flushes * 1000, 3) if self.flushes else 0.0,
+            }
+
+    def close(self):
+        """Stops the flush thread and inserts the rows still pending."""
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+    def _insert(self, rows: list) -> int:
+        try:
+            self.model.objects.bulk_create(rows)
+            return len(rows)
+        except DatabaseError:
+            logging.exception("%s writer could not insert a batch of %d rows, inserting them one by one",
+                              self.name, len(rows))
+        inserted = 0
+        for row in rows:
+            try:
+                row.save()
+                inserted += 1
+            except DatabaseError as error:
+                logging.warning("%s writer dropped a row: %s", self.name, error)
+        return inserted
+
+    def _start_thread(self):
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._flush_loop, name=f"{self.name}-writer", daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stopped:
+            with self._lock:
+                due = self._oldest + self.max_delay_seconds if self._rows else None
+            timeout = self.max_delay_seconds if due is None else max(0.0, due - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            with self._lock:
+                is_due = bool(self._rows) and (len(self._rows) >= self.max_size
+                                               or time.monotonic() - self._oldest >= self.max_delay_seconds)
+            if is_due:
+                self.flush()
+                # The connection belongs to this thread, do not keep it open between flushes
+                connections.close_all()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(model, setting_prefix: str) -> BufferedWriter:
+    """Returns the process-wide writer of a model, configured by the settings with the prefix."""
+    with _writers_lock:
+        writer = _writers.get(setting_prefix)
+        if writer is None:
+            writer = _writers[setting_prefix] = BufferedWriter(
+                model,
+                max_size=getattr(settings, f"{setting_prefix}_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+                max_delay_seconds=getattr(settings, f"{setting_prefix}_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS),
+                max_pending=getattr(settings, f"{setting_prefix}_MAX_PENDING", None),
+                flush_in_background=getattr(settings, f"{setting_prefix}_FLUSH_IN_BACKGROUND", False),
+            )
+        return writer
+
+
+def writer_stats() -> dict:
+    """Returns the stats of every writer of the process by name."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return {writer.name: writer.stats() for writer in writers}
+
+
+@receiver(setting_changed)
+def reset_writers(setting, **kwargs):
+    """Flushes and rebuilds a writer when tests override its settings."""
+    with _writers_lock:
+        for setting_prefix in [prefix for prefix in _writers if setting.startswith(prefix)]:
+            _writers.pop(setting_prefix).close()
@@ -0,0 +1,51 @@
+"""Shared setup of the website benchmarks.
+
+Benchmarks run against a throwaway test database, exactly like the test suite, so they
+never touch db.sqlite3:
+
+    python vehiscanWebsite/benchmarks/nearby_search_benchmark.py
+"""
+import contextlib
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def setup_django():
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "VehiScan.settings")
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    """Creates the test database for the duration of the block."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def create_owner(username: str = "benchmark-owner"):
+    from django.contrib.auth.models import User
+
+    # The profile is created by the post_save signal of User
+    return User.objects.create_user(username=username, password="benchmark").profile
+
+
+def time_per_call(function, iterations: int) -> float:
+    """Returns the average duration of a call in milliseconds, after one warm-up call."""
+    function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
@@ -0,0 +1,85 @@
+"""Benchmarks syncing every parking lot monitor through the REST API.
+
+Compares walking the paginated monitor list (page numbers, ``COUNT(*)`` and ``OFFSET``
+per page, a serializer per row) against walking the cursor pages of the bulk sync mode.
+The full walk of the list is estimated from a first, a middle and a last page, walking
+its thousands of pages would take too long.
+
+    python vehiscanWebsite/benchmarks/bulk_sync_benchmark.py --monitors 100000
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from benchmark_setup import create_owner, setup_django, test_database, time_per_call
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from vehiscanWebsite.models import ParkingLot, ParkingLotMonitor, ParkingLotStatus  # noqa: E402
+
+MONITORS_PER_LOT = 10
+
+
+def create_monitors(count: int):
+    owner = create_owner()
+    lot_count = max(1, count // MONITORS_PER_LOT)
+    ParkingLot.objects.bulk_create([
+        ParkingLot(name=f"Lot {index}", address=f"{index} Benchmark Road", hours="24/7",
+                   latitude=Decimal("33.684400"), longitude=Decimal("73.047900"),
+                   parking_spaces=MONITORS_PER_LOT, owner=owner, status=ParkingLotStatus.LIVE)
+        for index in range(lot_count)
+    ], batch_size=1000)
+    lot_ids = list(ParkingLot.objects.order_by("id").values_list("id", flat=True))
+    ParkingLotMonitor.objects.bulk_create([
+        ParkingLotMonitor(parkingLot_id=lot_ids[index % lot_count], name=f"Monitor {index}",
+                          latitude=Decimal("33.684400"), longitude=Decimal("73.047900"),
+                          free_parking_spaces=index % MONITORS_PER_LOT, total_parking_spaces=MONITORS_PER_LOT)
+        for index in range(count)
+    ], batch_size=1000)
+
+
+def walk_sync(client: Client, page_size: int) -> tuple:
+    """Walks every sync page and returns the number of rows and pages."""
+    rows, pages = 0, 0
+    url = f"/api-auth/parking-lot-monitors/sync/?page_size={page_size}"
+    while url:
+        body = client.get(url).json()
+        rows += len(body["results"])
+        pages += 1
+        url = body["next"]
+    return rows, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks syncing every monitor through the REST API")
+    parser.add_argument("--monitors", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    with test_database():
+        create_monitors(args.monitors)
+        client = Client()
+        list_page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        list_pages = -(-args.monitors // list_page_size)
+
+        print(f"{args.monitors} monitors, {args.iterations} iterations")
+        page_times = []
+        for label, page in [("first", 1), ("middle", list_pages // 2), ("last", list_pages)]:
+            url = f"/api-auth/parking-lot-monitors/?page={page}"
+            page_times.append(time_per_call(lambda: client.get(url), args.iterations))
+            print(f"{'list, ' + label + ' page':<36}{page_times[-1]:10.2f} ms")
+        estimate = sum(page_times) / len(page_times) * list_pages / 1000
+        print(f"{f'list, {list_pages} pages (estimated)':<36}{estimate:10.2f} s")
+
+        start = time.perf_counter()
+        rows, pages = walk_sync(client, args.page_size)
+        seconds = time.perf_counter() - start
+        print(f"{f'sync, {pages} pages of {args.page_size}':<36}{seconds:10.2f} s  ({rows} rows)")
+
+
+if __name__ == "__main__":
+    main()
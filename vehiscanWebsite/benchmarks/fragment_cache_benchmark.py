@@ -0,0 +1,76 @@
+"""Benchmarks rendering the parking lot and monitor list pages with cached fragments.
+
+Renders the list templates for every lot and every monitor, cold (the fragment cache is
+cleared before each render, so every card is rendered and stored) and warm (every card
+comes from the cache), without the database queries of the views.
+
+    python vehiscanWebsite/benchmarks/fragment_cache_benchmark.py --lots 1000
+"""
+import argparse
+from decimal import Decimal
+
+from benchmark_setup import create_owner, setup_django, test_database, time_per_call
+
+setup_django()
+
+from django.core.cache import cache  # noqa: E402
+from django.template.loader import render_to_string  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from vehiscanWebsite.models import ParkingLot, ParkingLotMonitor, ParkingLotStatus  # noqa: E402
+from vehiscanWebsite.views import WebPages  # noqa: E402
+
+PARKING_SPACES = 20
+
+
+def create_lots(count: int):
+    owner = create_owner()
+    ParkingLot.objects.bulk_create([
+        ParkingLot(name=f"Lot {index}", address=f"{index} Benchmark Road", hours="24/7",
+                   latitude=Decimal("33.684400"), longitude=Decimal("73.047900"),
+                   parking_spaces=PARKING_SPACES, free_parking_spaces=index % PARKING_SPACES,
+                   owner=owner, status=ParkingLotStatus.LIVE)
+        for index in range(count)
+    ], batch_size=1000)
+    ParkingLotMonitor.objects.bulk_create([
+        ParkingLotMonitor(parkingLot=parking_lot, name=f"Monitor {parking_lot.pk}",
+                          latitude=parking_lot.latitude, longitude=parking_lot.longitude,
+                          free_parking_spaces=parking_lot.free_parking_spaces, total_parking_spaces=PARKING_SPACES,
+                          probabilityParkingAvailable=Decimal(parking_lot.free_parking_spaces) / PARKING_SPACES)
+        for parking_lot in ParkingLot.objects.all()
+    ], batch_size=1000)
+
+
+def cold(render):
+    def call():
+        cache.clear()
+        render()
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks rendering the list pages with cached fragments")
+    parser.add_argument("--lots", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        create_lots(args.lots)
+        request = RequestFactory().get("/")
+        parking_lots = list(ParkingLot.objects.all())
+        parking_lot_monitors = list(ParkingLotMonitor.objects.select_related("parkingLot"))
+        pages = [
+            ("parking lots", lambda: render_to_string(
+                WebPages.PARKING_LOTS, {"parking_lots": parking_lots}, request)),
+            ("parking lot monitors", lambda: render_to_string(
+                WebPages.PARKING_LOT_MONITORS, {"parking_lot_monitors": parking_lot_monitors}, request)),
+        ]
+
+        print(f"{args.lots} lots and monitors, {args.iterations} iterations")
+        for label, render in pages:
+            print(f"{label + ', cold':<30}{time_per_call(cold(render), args.iterations):10.2f} ms")
+            print(f"{label + ', warm':<30}{time_per_call(render, args.iterations):10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
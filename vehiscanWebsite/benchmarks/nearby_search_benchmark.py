@@ -0,0 +1,66 @@
+"""Benchmarks the nearby parking lot search.
+
+Compares the previous implementation, which loaded every lot and computed a geopy
+distance per lot in Python, against the bounding box prefilter and NumPy haversine of
+``proximity.find_nearby``.
+
+    python vehiscanWebsite/benchmarks/nearby_search_benchmark.py --lots 20000
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from benchmark_setup import create_owner, setup_django, test_database, time_per_call
+
+setup_django()
+
+from geopy.distance import distance  # noqa: E402
+
+from vehiscanWebsite.models import ParkingLot, ParkingLotStatus  # noqa: E402
+from vehiscanWebsite.proximity import find_nearby  # noqa: E402
+
+SEARCH_POINT = (33.6844, 73.0479)
+SPREAD_DEGREES = 2.0  # Lots are scattered over roughly 450 x 450 km around the search point
+
+
+def previous_search(latitude: float, longitude: float) -> list:
+    """The per-request implementation the proximity search replaced."""
+    parking_lots = ParkingLot.objects.with_availability()
+    for lot in parking_lots:
+        lot.distance = distance((latitude, longitude), (lot.latitude, lot.longitude)).km
+    return list(parking_lots)
+
+
+def create_lots(count: int):
+    owner = create_owner()
+    random.seed(0)
+    ParkingLot.objects.bulk_create([
+        ParkingLot(
+            name=f"Lot {index}", address=f"{index} Benchmark Road", hours="24/7",
+            latitude=Decimal(f"{SEARCH_POINT[0] + random.uniform(-SPREAD_DEGREES, SPREAD_DEGREES):.6f}"),
+            longitude=Decimal(f"{SEARCH_POINT[1] + random.uniform(-SPREAD_DEGREES, SPREAD_DEGREES):.6f}"),
+            parking_spaces=20, owner=owner, status=ParkingLotStatus.LIVE,
+        )
+        for index in range(count)
+    ], batch_size=1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the nearby parking lot search")
+    parser.add_argument("--lots", type=int, default=20000)
+    parser.add_argument("--radius", type=float, default=10.0)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        create_lots(args.lots)
+        queryset = ParkingLot.objects.with_availability()
+        page = find_nearby(queryset, *SEARCH_POINT, radius_km=args.radius)
+        print(f"{args.lots} lots, {page.paginator.count} within {args.radius} km, {args.iterations} iterations")
+        print(f"{'geopy loop (previous)':<30}{time_per_call(lambda: previous_search(*SEARCH_POINT), args.iterations):10.2f} ms")
+        print(f"{'find_nearby, first page':<30}"
+              f"{time_per_call(lambda: find_nearby(queryset, *SEARCH_POINT, radius_km=args.radius), args.iterations):10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""This module contains the bulk sync mode of the REST API viewsets.
+
+Clients mirroring the whole fleet walk ``<endpoint>/sync/`` instead of the paginated
+list. Pages are cursor based, so there is no ``COUNT(*)`` and no deep ``OFFSET``: every
+page is an index range scan after the position encoded in the cursor. Rows are read with
+``values()`` (joined columns included, so related rows are fetched in the same query) and
+returned as plain dictionaries, without model instances or serializers.
+
+Parameters:
+
+- ``fields``: comma separated fields, all the sync fields of the viewset by default,
+- ``ordering``: ``id`` or, where the viewset supports it, ``updated`` to follow changes
+  or ``available`` for the lots with the most free spaces first,
+- ``page_size``: up to ``API_SYNC_MAX_PAGE_SIZE`` rows, ``API_SYNC_PAGE_SIZE`` by default.
+"""
+from django.conf import settings
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+from .monitor_snapshot import parse_fields
+
+
+class BulkSyncPagination(CursorPagination):
+    """Cursor pagination over the ordering chosen with the ``ordering`` parameter."""
+    page_size = getattr(settings, "API_SYNC_PAGE_SIZE", 1000)
+    max_page_size = getattr(settings, "API_SYNC_MAX_PAGE_SIZE", 10000)
+    page_size_query_param = "page_size"
+    ordering = "id"
+
+    def get_ordering(self, request, queryset, view):
+        orderings = view.sync_orderings
+        name = request.query_params.get("ordering", "id")
+        if name not in orderings:
+            raise ValidationError({"ordering": [f"Choose among {', '.join(orderings)}."]})
+        return orderings[name]
+
+
+class BulkSyncMixin:
+    """Adds the ``sync`` action to a viewset.
+
+    Attributes:
+        sync_fields (dict): The lookup of every sync field, joined lookups included.
+        sync_orderings (dict): The cursor ordering of every ``ordering`` choice. The first
+            field of each ordering must be a sync field lookup.
+    """
+    sync_fields = {}
+    sync_orderings = {"id": ("id",)}
+
+    def get_sync_queryset(self):
+        return self.get_queryset()
+
+    @action(detail=False, methods=["get"], pagination_class=BulkSyncPagination)
+    def sync(self, request):
+        """
+        Returns the fleet in large cursor pages of plain rows, see ``bulk_sync.py`` for the parameters.
+        """
+        fields = parse_fields(request.query_params, self.sync_fields, list(self.sync_fields))
+        lookups = {name: self.sync_fields[name] for name in fields}
+        # The cursor positions are read from the rows, so the ordering fields are always selected
+        selected = set(lookups.values()) | {ordering[0].lstrip("-") for ordering in self.sync_orderings.values()}
+        rows = self.paginator.paginate_queryset(self.get_sync_queryset().values(*selected), request, view=self)
+        return self.paginator.get_paginated_response(
+            [{name: row[lookup] for name, lookup in lookups.items()} for row in rows])
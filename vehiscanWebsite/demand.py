@@ -0,0 +1,155 @@
+"""This module maintains the hourly search demand grid built from ParkingRequestLog.
+
+The coordinates of every search are counted per geohash cell (about 1.2 x 0.6 km) and
+hour, in id ranges above a stored high-water mark, so each run only reads the rows logged
+since the previous one. Like the log rollups (see ``rollups.py``), the mark only moves
+past rows that settled, so rows committed out of id order are not skipped. Rows that
+arrive late (batched logs keep their search time) are merged into their hour all the same. Heatmaps of a region and a time window are summed
+from the grid, optionally over coarser cells, without reading the raw logs.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Substr
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .history import parse_time_parameter
+from .models import ParkingRequestLog, RollupProgress, SearchDemandHour
+from .proximity import encode_geohash, geohash_bounds
+from .rollups import SETTLE_SECONDS, settled_above
+
+DEMAND_GEOHASH_PRECISION = 6
+PROGRESS_NAME = "search_demand"
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_RANGE = timedelta(days=7)
+MAX_CELLS = 5000
+
+
+def aggregate_searches(batch_size: int = DEFAULT_BATCH_SIZE, settle_seconds: float = SETTLE_SECONDS) -> int:
+    """Counts every settled search above the high-water mark into the demand grid.
+
+    Args:
+        batch_size (int): The number of searches aggregated per transaction.
+        settle_seconds (float): How long after their insert searches are counted.
+
+    Returns:
+        int: The number of searches aggregated.
+    """
+    aggregated = 0
+    while True:
+        count = _aggregate_batch(batch_size, settle_seconds)
+        if not count:
+            return aggregated
+        aggregated += count
+
+
+def parse_heatmap_parameters(query_params) -> dict:
+    """Reads the ``bbox`` (``south,west,north,east``), ``start``, ``end`` and ``precision`` parameters.
+
+    ``start`` and ``end`` are ISO 8601 date times (the last week by default) and
+    ``precision`` the geohash length of the heatmap cells, 6 at most.
+
+    Returns:
+        dict: The keyword arguments of ``demand_heatmap``.
+
+    Raises:
+        ValidationError: When a parameter is invalid.
+    """
+    end = parse_time_parameter(query_params, "end") or timezone.now()
+    start = parse_time_parameter(query_params, "start") or end - DEFAULT_RANGE
+    if start >= end:
+        raise ValidationError({"start": ["The start must be before the end."]})
+    parameters = {"start": start, "end": end}
+
+    if query_params.get("bbox"):
+        try:
+            south, west, north, east = (float(value) for value in query_params["bbox"].split(","))
+        except ValueError:
+            raise ValidationError({"bbox": ["Use south,west,north,east in degrees."]})
+        if south > north or west > east:
+            raise ValidationError({"bbox": ["Use south,west,north,east in degrees."]})
+        parameters.update(south=south, west=west, north=north, east=east)
+
+    precision = query_params.get("precision")
+    if precision is not None:
+        if not str(precision).isdigit() or not 1 <= int(precision) <= DEMAND_GEOHASH_PRECISION:
+            raise ValidationError({"precision": [f"Use a geohash length from 1 to {DEMAND_GEOHASH_PRECISION}."]})
+        parameters["precision"] = int(precision)
+    return parameters
+
+
+def demand_heatmap(start, end, south: float = -90, west: float = -180, north: float = 90, east: float = 180,
+                   precision: int = DEMAND_GEOHASH_PRECISION) -> dict:
+    """Sums the searches of the grid cells of a region over a time window, busiest cells first.
+
+    Args:
+        start (datetime): The start of the window.
+        end (datetime): The end of the window, exclusive. Hours are counted whole.
+        precision (int): The geohash length of the heatmap cells.
+
+    Returns:
+        dict: The columnar heatmap, with the center of every cell.
+    """
+    cells = SearchDemandHour.objects.filter(
+        bucket_start__gte=start, bucket_start__lt=end,
+        latitude__gte=south, latitude__lte=north, longitude__gte=west, longitude__lte=east,
+    ).annotate(cell=Substr("geohash", 1, precision)).values("cell") \
+        .annotate(count=Sum("search_count")).order_by("-count", "cell")[:MAX_CELLS]
+    heatmap = {"start": start.isoformat(), "end": end.isoformat(), "precision": precision,
+               "geohash": [], "latitude": [], "longitude": [], "count": []}
+    for cell in cells:
+        cell_south, cell_west, cell_north, cell_east = geohash_bounds(cell["cell"])
+        heatmap["geohash"].append(cell["cell"])
+        heatmap["latitude"].append(round((cell_south + cell_north) / 2, 6))
+        heatmap["longitude"].append(round((cell_west + cell_east) / 2, 6))
+        heatmap["count"].append(cell["count"])
+    return heatmap
+
+
+def _aggregate_batch(batch_size: int, settle_seconds: float) -> int:
+    with transaction.atomic():
+        progress, _ = RollupProgress.objects.select_for_update().get_or_create(name=PROGRESS_NAME)
+        searches = settled_above(ParkingRequestLog.objects.all(), progress.last_id, settle_seconds)
+        rows = list(searches.order_by("id").values_list(
+            "id", "area_of_interest_latitude", "area_of_interest_longitude", "time_stamp")[:batch_size])
+        if not rows:
+            return 0
+
+        # Hours are cut in the current time zone, like the database truncations of the rollups
+        counts = Counter(
+            (encode_geohash(float(latitude), float(longitude), DEMAND_GEOHASH_PRECISION),
+             timezone.localtime(time_stamp).replace(minute=0, second=0, microsecond=0))
+            for _, latitude, longitude, time_stamp in rows)
+        _merge(counts)
+
+        progress.last_id = rows[-1][0]
+        progress.save()
+    logging.info("Aggregated %d searches up to id %d", len(rows), rows[-1][0])
+    return len(rows)
+
+
+def _merge(counts: Counter):
+    existing = {
+        (cell.geohash, cell.bucket_start): cell
+        for cell in SearchDemandHour.objects.filter(
+            geohash__in={geohash for geohash, _ in counts},
+            bucket_start__gte=min(bucket for _, bucket in counts),
+            bucket_start__lte=max(bucket for _, bucket in counts),
+        )
+    }
+    created, updated = [], []
+    for (geohash, bucket), count in counts.items():
+        cell = existing.get((geohash, bucket))
+        if cell is None:
+            south, west, north, east = geohash_bounds(geohash)
+            created.append(SearchDemandHour(geohash=geohash, latitude=(south + north) / 2,
+                                            longitude=(west + east) / 2, bucket_start=bucket, search_count=count))
+        else:
+            cell.search_count += count
+            updated.append(cell)
+    SearchDemandHour.objects.bulk_create(created)
+    SearchDemandHour.objects.bulk_update(updated, ["search_count"])
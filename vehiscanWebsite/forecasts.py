@@ -0,0 +1,185 @@
+"""This module maintains the hour-of-week availability forecasts of the lots.
+
+Every lot has up to 168 AvailabilityForecast rows, one per hour of the week. Each
+complete hour of the ParkingLotLogHour rollups updates the row of its hour of the week
+with exponential smoothing, so recent weeks weigh most:
+
+    forecast = SMOOTHING * observed + (1 - SMOOTHING) * forecast
+
+Hours are merged once and in order, from a high-water mark kept in a RollupProgress row
+(its ``last_id`` holds the epoch seconds of the first hour not merged yet), and only once
+the rollups have moved past them, so each run only reads the hours that completed since
+the previous one. Searches for a future time read one row per lot and hour through the
+unique (lot, hour of the week) index.
+"""
+import logging
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AvailabilityForecast, ParkingLotLog, ParkingLotLogHour, RollupProgress
+from .rollups import PROGRESS_NAME as ROLLUP_PROGRESS_NAME
+
+SMOOTHING = getattr(settings, "AVAILABILITY_FORECAST_SMOOTHING", 0.3)
+"""The weight of the newest observation of an hour of the week."""
+PROGRESS_NAME = "availability_forecasts"
+HOURS_PER_WEEK = 7 * 24
+DEFAULT_BATCH_HOURS = HOURS_PER_WEEK  # Hours of rollups merged per transaction
+DEFAULT_DURATION_HOURS = 1.0
+
+
+def hour_of_week(moment: datetime) -> int:
+    """Returns the local hour of the week of a time, from Monday 00:00 (0) to Sunday 23:00 (167)."""
+    local = timezone.localtime(moment)
+    return local.weekday() * 24 + local.hour
+
+
+def update_forecasts(batch_hours: int = DEFAULT_BATCH_HOURS) -> int:
+    """Merges every complete rollup hour above the high-water mark into the forecasts.
+
+    Args:
+        batch_hours (int): The number of hours merged per transaction.
+
+    Returns:
+        int: The number of lot hours merged.
+    """
+    merged = 0
+    while True:
+        count, is_done = _update_batch(batch_hours)
+        merged += count
+        if is_done:
+            return merged
+
+
+def parse_forecast_parameters(query_dict) -> Optional[tuple]:
+    """Reads the ``start_time`` (ISO 8601) and ``duration`` (hours) search parameters.
+
+    Returns:
+        Optional[tuple]: (start time, duration in hours), or None without a valid start time.
+    """
+    try:
+        start_time = parse_datetime(query_dict.get("start_time") or "")
+    except ValueError:
+        start_time = None
+    if start_time is None:
+        return None
+    if timezone.is_naive(start_time):
+        start_time = timezone.make_aware(start_time)
+    try:
+        duration_hours = float(query_dict.get("duration") or DEFAULT_DURATION_HOURS)
+    except ValueError:
+        duration_hours = DEFAULT_DURATION_HOURS
+    if not math.isfinite(duration_hours):
+        duration_hours = DEFAULT_DURATION_HOURS
+    return start_time, min(max(duration_hours, 0.0), HOURS_PER_WEEK)
+
+
+def stay_hours(start_time: datetime, duration_hours: float = DEFAULT_DURATION_HOURS) -> set:
+    """Returns the hours of the week a stay overlaps, at least the one it starts in."""
+    end_time = start_time + timedelta(hours=duration_hours)
+    hours, moment = set(), _hour_start(start_time)
+    while (moment < end_time or not hours) and len(hours) < HOURS_PER_WEEK:
+        hours.add(hour_of_week(moment))
+        moment += timedelta(hours=1)
+    return hours
+
+
+def attach_forecasts(parking_lots: Iterable, start_time: datetime,
+                     duration_hours: float = DEFAULT_DURATION_HOURS) -> list:
+    """Attaches to lots the forecast of their least available hour during a stay, in one query.
+
+    The forecast is set as ``forecast`` on every lot, None when the lot has no profile yet.
+
+    Returns:
+        list: The lots.
+    """
+    parking_lots = list(parking_lots)
+    forecasts = {}
+    for forecast in AvailabilityForecast.objects.filter(
+            parking_lot__in=[parking_lot.pk for parking_lot in parking_lots],
+            hour_of_week__in=stay_hours(start_time, duration_hours)):
+        current = forecasts.get(forecast.parking_lot_id)
+        if current is None or forecast.free_ratio < current.free_ratio:
+            forecasts[forecast.parking_lot_id] = forecast
+    for parking_lot in parking_lots:
+        parking_lot.forecast = forecasts.get(parking_lot.pk)
+    return parking_lots
+
+
+def _horizon() -> Optional[datetime]:
+    # The first hour that can still change: the current one, or the one still being rolled up
+    last_id = RollupProgress.objects.filter(name=ROLLUP_PROGRESS_NAME).values_list("last_id", flat=True).first()
+    if not last_id:
+        return None
+    horizon = _hour_start(timezone.now())
+    last_time = ParkingLotLog.objects.filter(id=last_id).values_list("time_stamp", flat=True).first()
+    if last_time is not None:
+        horizon = min(horizon, _hour_start(last_time))
+    return horizon
+
+
+def _hour_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _update_batch(batch_hours: int) -> tuple:
+    with transaction.atomic():
+        progress, _ = RollupProgress.objects.select_for_update().get_or_create(name=PROGRESS_NAME)
+        horizon = _horizon()
+        if progress.last_id:
+            start = datetime.fromtimestamp(progress.last_id, tz=dt_timezone.utc)
+        else:
+            start = ParkingLotLogHour.objects.aggregate(start=Min("bucket_start"))["start"]
+        if horizon is None or start is None or start >= horizon:
+            return 0, True
+        end = min(start + timedelta(hours=batch_hours), horizon)
+
+        # The samples of all the monitors of a lot are merged, like in the occupancy history
+        rows = list(ParkingLotLogHour.objects.filter(bucket_start__gte=start, bucket_start__lt=end)
+                    .values("parking_lot_id", "parking_lot__parking_spaces", "bucket_start")
+                    .annotate(total=Sum("sum_free_parking_spaces"), samples=Sum("sample_count"))
+                    .order_by("bucket_start"))
+        _merge(rows)
+
+        progress.last_id = int(end.timestamp())
+        progress.save()
+    if rows:
+        logging.info("Merged %d lot hours into the availability forecasts up to %s", len(rows), end)
+    return len(rows), end >= horizon
+
+
+def _merge(rows: list):
+    if not rows:
+        return
+    existing = {
+        (forecast.parking_lot_id, forecast.hour_of_week): forecast
+        for forecast in AvailabilityForecast.objects.filter(
+            parking_lot_id__in={row["parking_lot_id"] for row in rows},
+            hour_of_week__in={hour_of_week(row["bucket_start"]) for row in rows})
+    }
+    created = {}
+    for row in rows:
+        if not row["samples"]:
+            continue
+        free_parking_spaces = row["total"] / row["samples"]
+        free_ratio = min(free_parking_spaces / row["parking_lot__parking_spaces"], 1.0) \
+            if row["parking_lot__parking_spaces"] > 0 else 0.0
+        key = (row["parking_lot_id"], hour_of_week(row["bucket_start"]))
+        forecast = existing.get(key)
+        if forecast is None:
+            existing[key] = created[key] = AvailabilityForecast(
+                parking_lot_id=key[0], hour_of_week=key[1], free_parking_spaces=free_parking_spaces,
+                free_ratio=free_ratio, observations=1)
+        else:
+            forecast.free_parking_spaces += SMOOTHING * (free_parking_spaces - forecast.free_parking_spaces)
+            forecast.free_ratio += SMOOTHING * (free_ratio - forecast.free_ratio)
+            forecast.observations += 1
+    AvailabilityForecast.objects.bulk_create(created.values())
+    AvailabilityForecast.objects.bulk_update([forecast for key, forecast in existing.items() if key not in created],
+                                             ["free_parking_spaces", "free_ratio", "observations"])
@@ -0,0 +1,234 @@
+"""This module contains the geocoding service used by the parking search.
+
+Free-text locations are resolved through ``get_geocoder()``, which wraps the configured
+backend (``settings.GEOCODER_BACKEND``) with a two-level cache of normalized queries: the
+Django cache backend in front of the persistent ``GeocodedPlace`` table. Queries missing
+from the cache are looked up in the local place index (see ``place_index.py``) before
+the backend is called. Queries the
+backend cannot resolve are cached too, for a shorter time. Identical queries arriving
+while a lookup is in flight wait for that lookup instead of calling the backend again.
+"""
+import hashlib
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from geopy.exc import GeopyError
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.geocoders import Nominatim
+
+from .models import GeocodedPlace
+
+DEFAULT_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_CACHE_TTL = 24 * 60 * 60
+NOMINATIM_USER_AGENT = "perfect_parking"
+NOMINATIM_TIMEOUT = 5  # Seconds
+NOMINATIM_MIN_DELAY_SECONDS = 1.0  # The public service allows one request per second
+COALESCE_TIMEOUT = 15.0  # Seconds a query waits for an identical lookup in flight
+CACHE_KEY_PREFIX = "geocode:"
+NOT_FOUND = "not-found"
+"""Cached in place of a location for queries the backend could not resolve."""
+QUERY_MAX_LENGTH = 255
+
+
+@dataclass(frozen=True)
+class GeocodedLocation:
+    latitude: float
+    longitude: float
+    address: str = ""
+
+    def __str__(self) -> str:
+        return self.address
+
+
+def normalize_query(query: str) -> str:
+    """Returns the cache key form of a query: case-folded with whitespace and commas collapsed."""
+    query = re.sub(r"\s*,\s*", ", ", query or "")
+    return re.sub(r"\s+", " ", query).strip(" ,").casefold()[:QUERY_MAX_LENGTH]
+
+
+class NominatimGeocoder:
+    """Geocodes with OpenStreetMap Nominatim, rate limited to the public usage policy."""
+
+    def __init__(self):
+        client = Nominatim(user_agent=NOMINATIM_USER_AGENT, timeout=NOMINATIM_TIMEOUT)
+        self._geocode = RateLimiter(client.geocode, min_delay_seconds=NOMINATIM_MIN_DELAY_SECONDS,
+                                    max_retries=0, swallow_exceptions=False)
+
+    def geocode(self, query: str) -> Optional[GeocodedLocation]:
+        location = self._geocode(query)
+        if location is None:
+            return None
+        return GeocodedLocation(location.latitude, location.longitude, location.address)
+
+
+class StubGeocoder:
+    """Geocodes from ``settings.GEOCODER_STUB_PLACES``, a dict of query to (latitude, longitude).
+
+    Meant for tests and offline development, it never touches the network.
+    """
+
+    def __init__(self):
+        self.places = {normalize_query(query): place
+                       for query, place in getattr(settings, "GEOCODER_STUB_PLACES", {}).items()}
+        self.calls = 0
+
+    def geocode(self, query: str) -> Optional[GeocodedLocation]:
+        self.calls += 1
+        place = self.places.get(normalize_query(query))
+        if place is None:
+            return None
+        return GeocodedLocation(place[0], place[1], query)
+
+
+class RequestCoalescer:
+    """Runs one call per key at a time, sharing its result with callers that arrive meanwhile."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+
+    def __init__(self, timeout: float = COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, function):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            if call.done.wait(self.timeout):
+                return call.result
+            # The lookup in flight is stuck, do not wait for it any longer
+            return function()
+        try:
+            call.result = function()
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CachingGeocoder:
+    """Caches the results of a geocoder backend in the Django cache and the GeocodedPlace table."""
+
+    def __init__(self, backend, ttl: int = DEFAULT_CACHE_TTL, negative_ttl: int = DEFAULT_NEGATIVE_CACHE_TTL,
+                 place_index=None):
+        self.backend = backend
+        self.place_index = place_index
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_hits = 0
+        self.database_hits = 0
+        self.backend_calls = 0
+        self.backend_errors = 0
+        self._coalescer = RequestCoalescer()
+
+    @property
+    def coalesced(self) -> int:
+        return self._coalescer.coalesced
+
+    def geocode(self, query: str) -> Optional[GeocodedLocation]:
+        """Resolves a free-text location.
+
+        Args:
+            query (str): The location typed by the user.
+
+        Returns:
+            Optional[GeocodedLocation]: The location, or None when it cannot be resolved.
+        """
+        normalized_query = normalize_query(query)
+        if not normalized_query:
+            return None
+        cache_key = CACHE_KEY_PREFIX + hashlib.sha1(normalized_query.encode()).hexdigest()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            self.cache_hits += 1
+            return None if cached == NOT_FOUND else cached
+        if self.place_index is not None:
+            # Local matches are cheap and follow lot edits, so they are not cached
+            location = self.place_index.search(query)
+            if location is not None:
+                return location
+        return self._coalescer.run(normalized_query, lambda: self._lookup(normalized_query, query, cache_key))
+
+    def _lookup(self, normalized_query: str, query: str, cache_key: str) -> Optional[GeocodedLocation]:
+        place = GeocodedPlace.objects.filter(query=normalized_query).first()
+        if place is not None:
+            ttl = self.ttl if place.is_found() else self.negative_ttl
+            remaining = (place.time_stamp + timedelta(seconds=ttl) - timezone.now()).total_seconds()
+            if remaining > 0:
+                self.database_hits += 1
+                location = self._location_of(place)
+                cache.set(cache_key, location or NOT_FOUND, int(remaining))
+                return location
+
+        self.backend_calls += 1
+        try:
+            location = self.backend.geocode(query)
+        except GeopyError as error:
+            # Service errors are transient, so they are not negatively cached
+            self.backend_errors += 1
+            logging.warning("Geocoding %r failed: %s", query, error)
+            return None
+
+        GeocodedPlace.objects.update_or_create(query=normalized_query, defaults={
+            "address": (location.address if location else "")[:QUERY_MAX_LENGTH],
+            "latitude": location.latitude if location else None,
+            "longitude": location.longitude if location else None,
+        })
+        cache.set(cache_key, location or NOT_FOUND, self.ttl if location else self.negative_ttl)
+        return location
+
+    @staticmethod
+    def _location_of(place: GeocodedPlace) -> Optional[GeocodedLocation]:
+        if not place.is_found():
+            return None
+        return GeocodedLocation(place.latitude, place.longitude, place.address)
+
+
+_geocoder: Optional[CachingGeocoder] = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder() -> CachingGeocoder:
+    """Returns the process-wide caching geocoder built from the GEOCODER_* settings."""
+    from .place_index import get_place_index
+
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            backend = import_string(getattr(settings, "GEOCODER_BACKEND", "vehiscanWebsite.geocoding.NominatimGeocoder"))
+            _geocoder = CachingGeocoder(
+                backend(),
+                ttl=getattr(settings, "GEOCODER_CACHE_TTL", DEFAULT_CACHE_TTL),
+                negative_ttl=getattr(settings, "GEOCODER_NEGATIVE_CACHE_TTL", DEFAULT_NEGATIVE_CACHE_TTL),
+                place_index=get_place_index() if getattr(settings, "GEOCODER_USE_PLACE_INDEX", True) else None,
+            )
+        return _geocoder
+
+
+@receiver(setting_changed)
+def reset_geocoder(setting, **kwargs):
+    """Rebuilds the geocoder when tests override one of its settings."""
+    global _geocoder
+    if setting.startswith("GEOCODER_"):
+        with _geocoder_lock:
+            _geocoder = None
@@ -0,0 +1,158 @@
+"""This module builds occupancy history series from the ParkingLotLog rollups.
+
+A request asks for a time range at a resolution; the coarsest rollup whose bucket
+divides that resolution is read (day, hour, then minute), and its buckets are merged
+into the requested resolution with NumPy. Series are returned as compact columnar
+JSON: one array per column, times as epoch seconds of the bucket starts.
+
+Ranges are widened to whole buckets of the resolution, counted from midnight in the
+current time zone like the rollup buckets, so every rollup bucket falls in exactly one
+series bucket. Series only cover logs that were already rolled up by
+``rollup_parking_lot_logs``, and are only cached for long once the rollups passed them.
+"""
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .rollups import ROLLUP_MODELS, rolled_up_until
+
+ROLLUP_SECONDS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+RESOLUTION_PATTERN = re.compile(r"^(\d+)([mhd])$")
+RESOLUTION_UNIT_SECONDS = {"m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+AUTOMATIC_RESOLUTIONS = [60, 5 * 60, 15 * 60, 60 * 60, 6 * 60 * 60, 24 * 60 * 60, 7 * 24 * 60 * 60]
+DEFAULT_RANGE = timedelta(days=1)
+MAX_POINTS = 2000
+
+
+def parse_history_parameters(query_params) -> tuple:
+    """Reads the ``start``, ``end`` and ``resolution`` request parameters.
+
+    ``start`` and ``end`` are ISO 8601 date times (the last day by default) and
+    ``resolution`` a number of minutes, hours or days such as ``15m``, ``1h`` or ``7d``
+    (by default the finest one giving at most a few hundred points).
+
+    Returns:
+        tuple: (start, end, resolution in seconds), the range widened to whole buckets
+
+    Raises:
+        ValidationError: When a parameter is invalid or the series would be too long.
+    """
+    end = parse_time_parameter(query_params, "end") or timezone.now()
+    start = parse_time_parameter(query_params, "start") or end - DEFAULT_RANGE
+    if start >= end:
+        raise ValidationError({"start": ["The start must be before the end."]})
+    seconds = (end - start).total_seconds()
+
+    resolution = query_params.get("resolution")
+    if resolution is None:
+        resolution_seconds = next((candidate for candidate in AUTOMATIC_RESOLUTIONS if seconds / candidate <= 500),
+                                  AUTOMATIC_RESOLUTIONS[-1])
+    else:
+        match = RESOLUTION_PATTERN.match(resolution)
+        if match is None or int(match.group(1)) == 0:
+            raise ValidationError({"resolution": ["Use a number of minutes, hours or days such as 15m, 1h or 1d."]})
+        resolution_seconds = int(match.group(1)) * RESOLUTION_UNIT_SECONDS[match.group(2)]
+    if seconds / resolution_seconds > MAX_POINTS:
+        raise ValidationError({"resolution": [f"The series would have more than {MAX_POINTS} points."]})
+    return (*align_range(start, end, resolution_seconds), resolution_seconds)
+
+
+def align_range(start, end, resolution_seconds: int) -> tuple:
+    """Floors the start and ceils the end of a range to buckets of the resolution.
+
+    Buckets are counted from midnight in the current time zone, at the offset of the start.
+
+    Returns:
+        tuple: (start, end)
+    """
+    offset = timezone.localtime(start).utcoffset().total_seconds()
+    start_seconds = (start.timestamp() + offset) // resolution_seconds * resolution_seconds
+    end_seconds = -(-(end.timestamp() + offset) // resolution_seconds) * resolution_seconds
+    return (datetime.fromtimestamp(start_seconds - offset, tz=start.tzinfo),
+            datetime.fromtimestamp(end_seconds - offset, tz=end.tzinfo))
+
+
+def pick_rollup(resolution_seconds: int) -> str:
+    """Returns the coarsest rollup whose buckets add up exactly to the resolution."""
+    for kind in ("day", "hour", "minute"):
+        if resolution_seconds % ROLLUP_SECONDS[kind] == 0:
+            return kind
+    return "minute"
+
+
+def occupancy_series(start, end, resolution_seconds: int, **filters) -> dict:
+    """Builds the occupancy series of the rollup rows matching the filters.
+
+    Samples of every monitor matching the filters are merged, so the series of a lot with
+    several monitors describes all their samples together.
+
+    Args:
+        start (datetime): The start of the range, floored to the resolution.
+        end (datetime): The end of the range, exclusive, ceiled to the resolution.
+        resolution_seconds (int): The width of the series buckets.
+        **filters: Filters of the rollup rows, ``parking_lot_id`` or ``monitor_id``.
+
+    Returns:
+        dict: The columnar series.
+    """
+    start, end = align_range(start, end, resolution_seconds)
+    kind = pick_rollup(resolution_seconds)
+    rows = ROLLUP_MODELS[kind].objects.filter(bucket_start__gte=start, bucket_start__lt=end, **filters) \
+        .order_by().values_list("bucket_start", "min_free_parking_spaces", "max_free_parking_spaces",
+                                "sum_free_parking_spaces", "sample_count")
+    origin = start.timestamp()
+    columns = np.array([(bucket.timestamp(), *values) for bucket, *values in rows], dtype=np.float64).reshape(-1, 5)
+
+    # Merge the rollup buckets into the requested buckets
+    indexes = ((columns[:, 0] - origin) // resolution_seconds).astype(np.int64)
+    buckets, inverse = np.unique(indexes, return_inverse=True)
+    minimum = np.full(len(buckets), np.inf)
+    maximum = np.full(len(buckets), -np.inf)
+    np.minimum.at(minimum, inverse, columns[:, 1])
+    np.maximum.at(maximum, inverse, columns[:, 2])
+    total = np.bincount(inverse, weights=columns[:, 3], minlength=len(buckets))
+    samples = np.bincount(inverse, weights=columns[:, 4], minlength=len(buckets))
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "resolution": resolution_seconds,
+        "source": kind,
+        "time": (origin + buckets * resolution_seconds).astype(np.int64).tolist(),
+        "min": minimum.astype(np.int64).tolist(),
+        "max": maximum.astype(np.int64).tolist(),
+        "avg": np.round(total / np.maximum(samples, 1), 2).tolist(),
+        "samples": samples.astype(np.int64).tolist(),
+    }
+
+
+def cache_max_age(end, resolution_seconds: int) -> int:
+    """Returns how long a series may be cached: long once the rollups passed its range, short otherwise."""
+    rolled_up = rolled_up_until()
+    if rolled_up is not None and end + timedelta(seconds=resolution_seconds) < min(rolled_up, timezone.now()):
+        return 24 * 60 * 60
+    return min(resolution_seconds, 60)
+
+
+def parse_time_parameter(query_params, name: str):
+    """Reads an ISO 8601 date time parameter, None when it is missing.
+
+    Raises:
+        ValidationError: When the parameter is not a date time.
+    """
+    value = query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: ["Use an ISO 8601 date time."]})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
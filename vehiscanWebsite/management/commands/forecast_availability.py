@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vehiscanWebsite.forecasts import DEFAULT_BATCH_HOURS, update_forecasts
+
+
+class Command(BaseCommand):
+    help = ("Merges the hours rolled up since the previous run into the hour-of-week "
+            "availability forecasts of the parking lots.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-hours", type=int, default=DEFAULT_BATCH_HOURS,
+                            help="Hours of rollups merged per transaction")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running, merging every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            merged = update_forecasts(options["batch_hours"])
+            self.stdout.write(f"Merged {merged} lot hours in {time.perf_counter() - start:.2f}s")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from vehiscanWebsite.models import ParkingLot
+from vehiscanWebsite.proximity import encode_geohash
+
+
+class Command(BaseCommand):
+    help = "Recomputes the geohashes grouping the parking lots into map clusters, e.g. after bulk imports."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Lots updated per statement")
+
+    def handle(self, *args, **options):
+        batch, updated = [], 0
+        for parking_lot in ParkingLot.objects.only("id", "latitude", "longitude", "geohash").iterator():
+            geohash = encode_geohash(float(parking_lot.latitude), float(parking_lot.longitude))
+            if parking_lot.geohash != geohash:
+                parking_lot.geohash = geohash
+                batch.append(parking_lot)
+            if len(batch) >= options["batch_size"]:
+                updated += ParkingLot.objects.bulk_update(batch, ["geohash"])
+                batch = []
+        if batch:
+            updated += ParkingLot.objects.bulk_update(batch, ["geohash"])
+        self.stdout.write(f"Updated the geohash of {updated} parking lots")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from vehiscanWebsite.place_index import get_place_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the local place index from the parking lots and geocoded places."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--search", nargs="*", default=[],
+                            help="Queries to resolve after the rebuild, reporting hit rate and latency")
+
+    def handle(self, *args, **options):
+        place_index = get_place_index()
+        count = place_index.rebuild()
+        self.stdout.write(f"Indexed {count} places with {type(place_index).__name__}")
+
+        for query in options["search"]:
+            location = place_index.search(query)
+            self.stdout.write(f"{query!r}: {location.address if location else 'miss'}"
+                              f"{f' ({location.latitude}, {location.longitude})' if location else ''}")
+        if options["search"]:
+            self.stdout.write(str(place_index.stats()))
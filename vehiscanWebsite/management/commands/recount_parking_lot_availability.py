@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from vehiscanWebsite.availability import invalidate_fleet_snapshot
+from vehiscanWebsite.models import ParkingLot
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the availability counters of the parking lots from their monitors, e.g. after "
+            "monitors were imported or updated in bulk, and invalidates the cached fleet snapshot.")
+
+    def handle(self, *args, **options):
+        recounted = ParkingLot.objects.recount_availability()
+        invalidate_fleet_snapshot()
+        self.stdout.write(f"Recounted the availability of {recounted} parking lots")
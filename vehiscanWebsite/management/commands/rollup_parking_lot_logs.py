@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vehiscanWebsite.rollups import DEFAULT_BATCH_SIZE, SETTLE_SECONDS, compact_logs, roll_up_logs
+
+
+class Command(BaseCommand):
+    help = ("Merges new parking lot log rows into the minute, hour and day rollups and "
+            "deletes rolled up rows older than the retention period.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Log rows aggregated per transaction")
+        parser.add_argument("--settle-seconds", type=float, default=SETTLE_SECONDS,
+                            help="Seconds after their insert log rows are rolled up")
+        parser.add_argument("--retention-days", type=int,
+                            default=getattr(settings, "PARKING_LOT_LOG_RETENTION_DAYS", 30),
+                            help="Days raw log rows are kept once rolled up")
+        parser.add_argument("--minute-retention-days", type=int,
+                            default=getattr(settings, "PARKING_LOT_LOG_MINUTE_RETENTION_DAYS", 90),
+                            help="Days minute rollups are kept")
+        parser.add_argument("--no-compact", action="store_true", help="Only roll up, delete nothing")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running, rolling up every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            rolled_up = roll_up_logs(options["batch_size"], options["settle_seconds"])
+            message = f"Rolled up {rolled_up} log rows"
+            if not options["no_compact"]:
+                raw, minutes = compact_logs(options["retention_days"], options["minute_retention_days"],
+                                            options["settle_seconds"])
+                message += f", deleted {raw} raw rows and {minutes} minute rollups"
+            self.stdout.write(f"{message} in {time.perf_counter() - start:.2f}s")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
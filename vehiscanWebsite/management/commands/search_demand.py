@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from vehiscanWebsite.demand import DEFAULT_BATCH_SIZE, aggregate_searches, demand_heatmap, parse_heatmap_parameters
+from vehiscanWebsite.rollups import SETTLE_SECONDS
+
+
+class Command(BaseCommand):
+    help = ("Counts new parking searches into the hourly demand grid, then prints the busiest "
+            "cells of a region and time window.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Searches aggregated per transaction")
+        parser.add_argument("--settle-seconds", type=float, default=SETTLE_SECONDS,
+                            help="Seconds after their insert searches are counted")
+        parser.add_argument("--no-update", action="store_true", help="Only print the heatmap")
+        parser.add_argument("--bbox", help="The region as south,west,north,east, the whole world by default")
+        parser.add_argument("--start", help="ISO 8601 start of the window, a week before the end by default")
+        parser.add_argument("--end", help="ISO 8601 end of the window, now by default")
+        parser.add_argument("--precision", help="The geohash length of the cells, from 1 to 6")
+        parser.add_argument("--top", type=int, default=20, help="The number of cells printed")
+
+    def handle(self, *args, **options):
+        if not options["no_update"]:
+            self.stdout.write(f"Aggregated {aggregate_searches(options['batch_size'], options['settle_seconds'])} searches")
+
+        try:
+            parameters = parse_heatmap_parameters({name: options[name] for name in ("bbox", "start", "end", "precision")
+                                                   if options[name] is not None})
+        except ValidationError as error:
+            raise CommandError(error.detail)
+        heatmap = demand_heatmap(**parameters)
+        self.stdout.write(f"Searches from {heatmap['start']} to {heatmap['end']}:")
+        for index in range(min(options["top"], len(heatmap["count"]))):
+            self.stdout.write(f"{heatmap['geohash'][index]:<8} {heatmap['latitude'][index]:>11.6f} "
+                              f"{heatmap['longitude'][index]:>11.6f} {heatmap['count'][index]:>8}")
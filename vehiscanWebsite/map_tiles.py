@@ -0,0 +1,158 @@
+"""This module serves the home page map by tiles: lot markers zoomed in, clusters zoomed out.
+
+A viewport is split into the tiles of the base map at its zoom level (Web Mercator
+256 pixel tiles), and every tile is built with one or two indexed queries and cached for
+``MAP_TILE_CACHE_TIMEOUT`` seconds, so visitors looking at the same area share them:
+
+- a tile holding at most ``MAP_TILE_MAX_MARKERS`` lots, or any tile from
+  ``MAP_CLUSTER_MAX_ZOOM`` on, lists its lots as markers,
+- any other tile groups its lots into clusters by geohash prefix (about 8 x 8 cells per
+  tile), with their lot count, total and free spaces and mean position.
+
+Lots are selected by their indexed coordinates and grouped by their indexed ``geohash``,
+which ``ParkingLot.save`` keeps up to date; run ``manage.py rebuild_map_index`` after
+bulk imports.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Sum
+from django.db.models.functions import Substr
+from rest_framework.exceptions import ValidationError
+
+from .models import ParkingLot
+from .proximity import GEOHASH_PRECISION, coordinate_limit
+
+TILE_KEY_PREFIX = "map:tile:"
+TILE_CACHE_TIMEOUT = getattr(settings, "MAP_TILE_CACHE_TIMEOUT", 30)
+"""Bounds how long a tile can lag behind availability updates."""
+TILE_MAX_MARKERS = getattr(settings, "MAP_TILE_MAX_MARKERS", 100)
+CLUSTER_MAX_ZOOM = getattr(settings, "MAP_CLUSTER_MAX_ZOOM", 14)
+"""From this zoom level on lots are never clustered."""
+MAX_ZOOM = 20
+MAX_TILES = 64
+MAX_LATITUDE = 85.0511287798
+"""The latitude limit of Web Mercator tiles."""
+
+
+def parse_viewport(query_params) -> tuple:
+    """Reads the ``bbox`` (``south,west,north,east``) and ``zoom`` parameters.
+
+    Returns:
+        tuple: (south, west, north, east, zoom)
+
+    Raises:
+        ValidationError: When a parameter is missing or invalid, or the viewport spans too many tiles.
+    """
+    try:
+        south, west, north, east = (float(value) for value in query_params.get("bbox", "").split(","))
+    except ValueError:
+        raise ValidationError({"bbox": ["Use south,west,north,east in degrees."]})
+    if south > north or west > east:
+        raise ValidationError({"bbox": ["Use south,west,north,east in degrees."]})
+    try:
+        zoom = int(query_params.get("zoom", ""))
+    except ValueError:
+        raise ValidationError({"zoom": ["Use a zoom level from 0 to %d." % MAX_ZOOM]})
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValidationError({"zoom": ["Use a zoom level from 0 to %d." % MAX_ZOOM]})
+    if len(tile_range(south, west, north, east, zoom)) > MAX_TILES:
+        raise ValidationError({"zoom": ["The viewport spans too many tiles at this zoom level."]})
+    return south, west, north, east, zoom
+
+
+def tile_range(south: float, west: float, north: float, east: float, zoom: int) -> list:
+    """Returns the (x, y) tiles covering a bounding box at a zoom level."""
+    west_x, north_y = _tile_of(north, west, zoom)
+    east_x, south_y = _tile_of(south, east, zoom)
+    return [(x, y) for x in range(west_x, east_x + 1) for y in range(north_y, south_y + 1)]
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> tuple:
+    """Returns the (south, west, north, east) bounds of a tile."""
+    tiles = 2 ** zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    return latitude(y + 1), x / tiles * 360 - 180, latitude(y), (x + 1) / tiles * 360 - 180
+
+
+def geohash_precision(zoom: int) -> int:
+    """Returns the geohash length whose cells are about an eighth of a tile wide."""
+    # A tile is 360 / 2^zoom degrees wide and a geohash cell 360 / 2^(5 * precision / 2)
+    return min(max(round(2 * (zoom + 3) / 5), 1), GEOHASH_PRECISION)
+
+
+def build_tile(zoom: int, x: int, y: int) -> dict:
+    """Reads the markers or the clusters of a tile from the database."""
+    south, west, north, east = tile_bounds(zoom, x, y)
+    limit = coordinate_limit(ParkingLot)
+    west, east = max(west, -limit), min(east, limit)
+    if west >= east:
+        # The tile lies beyond what the coordinate columns can hold
+        return {"markers": [], "clusters": []}
+
+    parking_lots = ParkingLot.objects.with_availability().filter(
+        latitude__gte=round(south, 9), latitude__lt=round(north, 9),
+        longitude__gte=round(west, 9), longitude__lt=round(east, 9))
+    is_clustered = zoom < CLUSTER_MAX_ZOOM
+    rows = parking_lots.order_by("pk").values(
+        "id", "name", "latitude", "longitude", "parking_spaces", "annotated_free_parking_spaces")
+    # One row more than a marker tile holds tells whether the tile must be clustered
+    rows = list(rows[:TILE_MAX_MARKERS + 1] if is_clustered else rows)
+    if not is_clustered or len(rows) <= TILE_MAX_MARKERS:
+        return {"markers": [_marker(row) for row in rows], "clusters": []}
+
+    cells = parking_lots.annotate(cell=Substr("geohash", 1, geohash_precision(zoom))).values("cell") \
+        .annotate(count=Count("id"), parking_spaces=Sum("parking_spaces"),
+                  free_parking_spaces=Sum("annotated_free_parking_spaces"),
+                  latitude=Avg("latitude"), longitude=Avg("longitude")) \
+        .order_by("cell")
+    return {"markers": [], "clusters": [_cluster(cell) for cell in cells]}
+
+
+def get_viewport(south: float, west: float, north: float, east: float, zoom: int) -> dict:
+    """Returns the markers and clusters of the tiles covering a viewport, from the cache when possible."""
+    keys = {f"{TILE_KEY_PREFIX}{zoom}:{x}:{y}": (x, y) for x, y in tile_range(south, west, north, east, zoom)}
+    tiles = cache.get_many(keys)
+    missing = {key: build_tile(zoom, *tile) for key, tile in keys.items() if key not in tiles}
+    if missing:
+        cache.set_many(missing, TILE_CACHE_TIMEOUT)
+        tiles.update(missing)
+    return {
+        "zoom": zoom,
+        "markers": [marker for key in keys for marker in tiles[key]["markers"]],
+        "clusters": [cluster for key in keys for cluster in tiles[key]["clusters"]],
+    }
+
+
+def _tile_of(latitude: float, longitude: float, zoom: int) -> tuple:
+    tiles = 2 ** zoom
+    latitude = math.radians(min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE))
+    x = int((min(max(longitude, -180.0), 180.0) + 180) / 360 * tiles)
+    y = int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * tiles)
+    return min(x, tiles - 1), min(max(y, 0), tiles - 1)
+
+
+def _marker(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "latitude": float(row["latitude"]),
+        "longitude": float(row["longitude"]),
+        "parking_spaces": row["parking_spaces"],
+        "free_parking_spaces": row["annotated_free_parking_spaces"],
+    }
+
+
+def _cluster(cell: dict) -> dict:
+    return {
+        "geohash": cell["cell"],
+        "count": cell["count"],
+        "parking_spaces": cell["parking_spaces"],
+        "free_parking_spaces": cell["free_parking_spaces"],
+        "latitude": float(cell["latitude"]),
+        "longitude": float(cell["longitude"]),
+    }
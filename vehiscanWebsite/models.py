@@ -1,11 +1,15 @@
 from geopy.distance import geodesic
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Least, Now
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from datetime import timedelta
+from .batching import get_writer
+from .proximity import GEOHASH_PRECISION, encode_geohash
 
 # User Schema
 
@@ -42,6 +46,45 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} ({self.get_user_type_display()})"
 
+class ParkingLotQuerySet(models.QuerySet):
+
+    def with_availability(self):
+        """Annotates each lot with its availability under the names ``values()`` queries use.
+
+        The availability is read from the counters of the lot row itself, no monitor is joined.
+        """
+        return self.annotate(
+            annotated_free_parking_spaces=F('free_parking_spaces'),
+            annotated_probability_parking_available=Case(
+                When(parking_spaces__gt=0,
+                     then=Least(F('free_parking_spaces') * 100 / F('parking_spaces'), Value(100))),
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ),
+            annotated_date_time_last_updated=F('availability_updated_at'),
+        )
+
+    def recount_availability(self) -> int:
+        """Recomputes the availability counters of the lots from their monitors in one update.
+
+        Repairs the counters after monitors were changed by queryset updates, which bypass ``save``.
+
+        Returns:
+            int: The number of lots recounted.
+        """
+        monitors = ParkingLotMonitor.objects.filter(parkingLot=OuterRef('pk')).order_by().values('parkingLot')
+        return self.update(
+            free_parking_spaces=Coalesce(Subquery(monitors.annotate(total=Sum('free_parking_spaces')).values('total')),
+                                         Value(0)),
+            monitored_parking_spaces=Coalesce(
+                Subquery(monitors.annotate(total=Sum('total_parking_spaces')).values('total')), Value(0)),
+            availability_updated_at=Subquery(monitors.annotate(latest=Max('dateTimeLastUpdated')).values('latest')),
+        )
+
+
+AVAILABILITY_COUNTERS = ('free_parking_spaces', 'monitored_parking_spaces', 'availability_updated_at')
+
+
 # Create your models here.
 class ParkingLot(models.Model):
     
@@ -74,6 +117,37 @@ class ParkingLot(models.Model):
         validators=[MinValueValidator(0)]
     )
     admin_notes = models.TextField(blank=True)
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, blank=True, db_index=True, editable=False)
+    # Availability counters summed over the monitors of the lot, maintained by ParkingLotMonitor
+    free_parking_spaces = models.IntegerField(default=0, editable=False)
+    monitored_parking_spaces = models.IntegerField(default=0, editable=False)
+    availability_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    """When the lot itself was last edited, it versions the cached lot cards with availability_updated_at"""
+
+    objects = ParkingLotQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='parking_lot_lat_lng_idx'),
+            models.Index(fields=['free_parking_spaces'], name='parking_lot_free_spaces_idx'),
+            models.Index(fields=['availability_updated_at'], name='parking_lot_availability_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The geohash follows the coordinates, it groups the lots into the map clusters
+        self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+            if {'latitude', 'longitude'} & set(update_fields):
+                kwargs['update_fields'].add('geohash')
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # The counters are only written by the monitors, this instance may hold stale values
+            skipped = {*AVAILABILITY_COUNTERS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in skipped]
+        super().save(*args, **kwargs)
 
     def get_image_url(self):
         if self.image:
@@ -84,22 +158,15 @@ class ParkingLot(models.Model):
         return geodesic((self.latitude, self.longitude), (user_latitude, user_longitude)).km
 
     def get_free_parking_spaces(self):
-        monitor = ParkingLotMonitor.objects.filter(parkingLot=self).first()
-        if monitor:
-            return monitor.free_parking_spaces
-        return 0
+        return self.free_parking_spaces
 
     def get_probability_parking_available(self):
-        monitor = ParkingLotMonitor.objects.filter(parkingLot=self).first()
-        if monitor:
-            return int(((monitor.free_parking_spaces)/(self.parking_spaces))*100)
-        return 0
+        if self.parking_spaces <= 0:
+            return 0
+        return min(self.free_parking_spaces * 100 // self.parking_spaces, 100)
 
     def get_date_time_last_updated(self):
-        monitor = ParkingLotMonitor.objects.filter(parkingLot=self).first()
-        if monitor:
-            return monitor.dateTimeLastUpdated
-        return None
+        return self.availability_updated_at
 
     def __str__(self) -> str:
         return str(self.name)
@@ -116,21 +183,18 @@ class ParkingLotMonitor(models.Model):
         max_digits=5, decimal_places=2, default=Decimal('0.00') )
     free_parking_spaces = models.IntegerField(default=0)
     total_parking_spaces = models.IntegerField(default=0)
-    dateTimeLastUpdated = models.DateTimeField(auto_now=True)
+    dateTimeLastUpdated = models.DateTimeField(auto_now=True, db_index=True)
     status = models.BooleanField(default=True)
     image = models.ImageField(upload_to="images/parking-lot-monitor/", blank=True)
     camera_stream_url = models.URLField(blank=True)
     detection_confidence = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
     
     def update_availability(self, new_count, confidence):
+        # save() logs the change, counts it into the lot and invalidates the fleet snapshot
         self.free_parking_spaces = new_count
         self.detection_confidence = confidence
         self.save()
-        ParkingLotLog.objects.create(
-            parking_lot=self.parkingLot,
-            free_parking_spaces=new_count,
-            confidence=confidence
-        )
+
     def get_occupancy_rate(self) -> int:
        
         return round(100 - self.probabilityParkingAvailable * 100)
@@ -151,14 +215,84 @@ class ParkingLotMonitor(models.Model):
     def __str__(self) -> str:
         return str(self.name)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to log only the saves that change the count
+        instance._logged_free_parking_spaces = instance.__dict__.get('free_parking_spaces')
+        return instance
+
     def update(self, *args, **kwargs):
-        super(ParkingLotMonitor, self).save(*args, **kwargs)
-        ParkingLotLog.objects.create(parking_lot=self.parkingLot, logged_by_monitor=self, free_parking_spaces=self.free_parking_spaces)
+        self.save(*args, **kwargs)
 
     def save(self, *args, **kwargs):
-
-        super(ParkingLotMonitor, self).save(*args, **kwargs)
-        ParkingLotLog.objects.create(parking_lot=self.parkingLot, logged_by_monitor=self, free_parking_spaces=self.free_parking_spaces)
+        is_changed = self._state.adding or \
+            getattr(self, '_logged_free_parking_spaces', None) != self.free_parking_spaces
+        with transaction.atomic():
+            # The stored counts are read under a row lock, so concurrent reports add up exactly
+            self._counted = None if self._state.adding else self._read_counted(lock=True)
+            super(ParkingLotMonitor, self).save(*args, **kwargs)
+        if is_changed:
+            get_writer(ParkingLotLog, 'PARKING_LOT_LOG').add(ParkingLotLog(
+                parking_lot_id=self.parkingLot_id, logged_by_monitor=self,
+                free_parking_spaces=self.free_parking_spaces))
+            self._logged_free_parking_spaces = self.free_parking_spaces
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self._counted = self._read_counted(lock=True)
+            return super().delete(*args, **kwargs)
+
+    def count_into_parking_lot(self, update_fields=None):
+        """Adds the change of the monitor since its stored counts to the counters of its lot.
+
+        Called by the post_save signal, inside the transaction of ``save``, so the lot counters
+        are up to date before the fleet snapshot is rebuilt from them. Moving the monitor to another
+        lot takes its counts out of the previous one.
+
+        Args:
+            update_fields (Optional[Iterable[str]]): The fields the save wrote, all when None.
+        """
+        previous = getattr(self, '_counted', None)
+        counted = {'parkingLot': self.parkingLot_id, 'free_parking_spaces': self.free_parking_spaces,
+                   'total_parking_spaces': self.total_parking_spaces}
+        if previous is not None and update_fields is not None:
+            update_fields = {field.removesuffix('_id') for field in update_fields}
+            counted = {field: value if field in update_fields else previous[field] for field, value in counted.items()}
+        if previous is not None and previous['parkingLot'] != counted['parkingLot']:
+            _add_to_counters(previous, -1)
+            previous = None
+        ParkingLot.objects.filter(pk=counted['parkingLot']).update(
+            free_parking_spaces=F('free_parking_spaces') + counted['free_parking_spaces']
+            - (previous['free_parking_spaces'] if previous else 0),
+            monitored_parking_spaces=F('monitored_parking_spaces') + counted['total_parking_spaces']
+            - (previous['total_parking_spaces'] if previous else 0),
+            availability_updated_at=self.dateTimeLastUpdated,
+        )
+        self._counted = counted
+
+    def count_out_of_parking_lot(self):
+        """Takes the stored counts of a deleted monitor out of the counters of its lot."""
+        counted = getattr(self, '_counted', None) or {
+            'parkingLot': self.parkingLot_id, 'free_parking_spaces': self.free_parking_spaces,
+            'total_parking_spaces': self.total_parking_spaces}
+        _add_to_counters(counted, -1)
+        self._counted = None
+
+    def _read_counted(self, lock: bool = False) -> dict:
+        monitors = ParkingLotMonitor.objects.filter(pk=self.pk)
+        if lock:
+            monitors = monitors.select_for_update()
+        return monitors.values('parkingLot', 'free_parking_spaces', 'total_parking_spaces').first()
+
+
+def _add_to_counters(counted: dict, sign: int):
+    # The availability time moves too, it versions the API pages and the cached lot cards
+    ParkingLot.objects.filter(pk=counted['parkingLot']).update(
+        free_parking_spaces=F('free_parking_spaces') + sign * counted['free_parking_spaces'],
+        monitored_parking_spaces=F('monitored_parking_spaces') + sign * counted['total_parking_spaces'],
+        availability_updated_at=timezone.now(),
+    )
 
 
 class ParkingLotLog(models.Model):
@@ -167,24 +301,166 @@ class ParkingLotLog(models.Model):
     parking_lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE)
     logged_by_monitor = models.ForeignKey(ParkingLotMonitor, on_delete=models.CASCADE)
     free_parking_spaces = models.IntegerField(default=0)
-    time_stamp = models.DateTimeField(auto_now=True)
+    time_stamp = models.DateTimeField(default=timezone.now)
+    """When the count was observed, not when the batched row was inserted"""
+    logged_at = models.DateTimeField(db_default=Now(), editable=False)
+    """When the row was inserted, by the database clock; the rollups wait for rows to settle"""
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['parking_lot', 'time_stamp'], name='parking_lot_log_lot_time_idx'),
+            models.Index(fields=['logged_by_monitor', 'time_stamp'], name='parking_lot_log_monitor_idx'),
+            models.Index(fields=['time_stamp'], name='parking_lot_log_time_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.parking_lot.name} - {self.time_stamp}"
 
 
+class ParkingLotLogRollup(models.Model):
+    """The free spaces reported by a monitor, aggregated over a time bucket.
+
+    The rollups are maintained incrementally from ParkingLotLog by the
+    ``rollup_parking_lot_logs`` management command. The average is kept as a sum so
+    new samples can be merged into an existing bucket.
+    """
+
+    parking_lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE)
+    monitor = models.ForeignKey(ParkingLotMonitor, on_delete=models.CASCADE)
+    bucket_start = models.DateTimeField()
+    min_free_parking_spaces = models.IntegerField()
+    max_free_parking_spaces = models.IntegerField()
+    sum_free_parking_spaces = models.BigIntegerField()
+    sample_count = models.IntegerField()
+
+    class Meta:
+        abstract = True
+
+    def get_average_free_parking_spaces(self) -> float:
+        return self.sum_free_parking_spaces / self.sample_count if self.sample_count else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.monitor_id} - {self.bucket_start}"
+
+
+class ParkingLotLogMinute(ParkingLotLogRollup):
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['monitor', 'bucket_start'], name='log_minute_bucket_unique')]
+        indexes = [models.Index(fields=['parking_lot', 'bucket_start'], name='log_minute_lot_bucket_idx')]
+
+
+class ParkingLotLogHour(ParkingLotLogRollup):
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['monitor', 'bucket_start'], name='log_hour_bucket_unique')]
+        indexes = [models.Index(fields=['parking_lot', 'bucket_start'], name='log_hour_lot_bucket_idx')]
+
+
+class ParkingLotLogDay(ParkingLotLogRollup):
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['monitor', 'bucket_start'], name='log_day_bucket_unique')]
+        indexes = [models.Index(fields=['parking_lot', 'bucket_start'], name='log_day_lot_bucket_idx')]
+
+
+class AvailabilityForecast(models.Model):
+    """The smoothed availability profile of a lot for one hour of the week.
+
+    Hours of the week count from Monday 00:00 local time (0) to Sunday 23:00 (167). The
+    profiles are updated incrementally from the hour rollups by the
+    ``forecast_availability`` management command, with exponential smoothing.
+    """
+
+    parking_lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE)
+    hour_of_week = models.PositiveSmallIntegerField()
+    free_parking_spaces = models.FloatField()
+    free_ratio = models.FloatField()
+    """The share of the lot's spaces expected to be free, from 0 to 1"""
+    observations = models.IntegerField(default=0)
+    """The number of hours merged into the profile"""
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['parking_lot', 'hour_of_week'],
+                                               name='availability_forecast_unique')]
+
+    def get_probability_parking_available(self) -> int:
+        return round(self.free_ratio * 100)
+
+    def __str__(self) -> str:
+        return f"{self.parking_lot_id} - {self.hour_of_week}"
+
+
+class RollupProgress(models.Model):
+    """The high-water mark of an incremental job over an append-only table."""
+
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    time_stamp = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} - {self.last_id}"
+
+
 class ParkingRequestLog(models.Model):
    
     id = models.AutoField(primary_key=True)
     area_of_interest_latitude = models.DecimalField(max_digits=17, decimal_places=15)
     """The latitude of the parking lot monitor"""
     area_of_interest_longitude = models.DecimalField(max_digits=17, decimal_places=15)
-    time_stamp = models.DateTimeField(auto_now=True)
+    time_stamp = models.DateTimeField(default=timezone.now)
+    """When the search was made, not when the batched row was inserted"""
+    logged_at = models.DateTimeField(db_default=Now(), editable=False)
+    """When the row was inserted, by the database clock; the demand grid waits for rows to settle"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     user_ip_address = models.CharField(max_length=15)
     
 # this is used to log the parking request made by the user
 
+
+class SearchDemandHour(models.Model):
+    """The number of parking searches in a geohash cell during an hour.
+
+    Maintained incrementally from ParkingRequestLog by the ``search_demand`` management
+    command. The cell center is stored so regions can be selected with indexed ranges.
+    """
+
+    geohash = models.CharField(max_length=12)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    bucket_start = models.DateTimeField()
+    search_count = models.IntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['geohash', 'bucket_start'], name='search_demand_bucket_unique')]
+        indexes = [models.Index(fields=['bucket_start', 'latitude', 'longitude'], name='search_demand_time_idx')]
+
+    def __str__(self) -> str:
+        return f"{self.geohash} - {self.bucket_start}"
+
+
+
+class GeocodedPlace(models.Model):
+    """A geocoded search query, persisted so a restart does not geocode it again.
+
+    Queries the geocoder could not resolve are stored too (without coordinates), so they
+    are not looked up again until the negative cache entry expires.
+    """
+
+    id = models.AutoField(primary_key=True)
+    query = models.CharField(max_length=255, unique=True)
+    """The normalized search query"""
+    address = models.CharField(max_length=255, blank=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    time_stamp = models.DateTimeField(auto_now=True)
+
+    def is_found(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+
+    def __str__(self) -> str:
+        return self.query
+
 class EmailOTP(models.Model):
     email = models.EmailField(unique=True)
     otp = models.CharField(max_length=6)
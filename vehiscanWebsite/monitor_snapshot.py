@@ -0,0 +1,84 @@
+"""This module builds the compact availability snapshot of the parking lot monitors.
+
+Pollers only need a few fields of every monitor, so the snapshot is read with a single
+``values_list`` query and returned as one array per monitor, in the order of the requested
+``fields``, instead of going through the model serializers. Its version is the latest
+``dateTimeLastUpdated`` of the monitors together with their count, which one aggregate
+query reads; the API derives its ETag from it and answers 304 before building anything.
+
+With ``since`` only the monitors updated after that time are returned. Clients pass the
+``last_updated`` of their previous snapshot and compare ``count`` to notice deletions.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from rest_framework.exceptions import ValidationError
+
+SNAPSHOT_FIELDS = {
+    "id": "id",
+    "parking_lot": "parkingLot_id",
+    "name": "name",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "free_parking_spaces": "free_parking_spaces",
+    "total_parking_spaces": "total_parking_spaces",
+    "probability_parking_available": "probabilityParkingAvailable",
+    "date_time_last_updated": "dateTimeLastUpdated",
+    "status": "status",
+}
+"""The model field of every snapshot field."""
+DEFAULT_FIELDS = ["id", "free_parking_spaces", "probability_parking_available", "date_time_last_updated"]
+
+
+def parse_fields(query_params, available: dict = SNAPSHOT_FIELDS, default: list = DEFAULT_FIELDS) -> list:
+    """Reads the comma separated ``fields`` parameter.
+
+    Args:
+        query_params (QueryDict): The request parameters.
+        available (dict): The fields that may be requested.
+        default (list): The fields returned when none is requested.
+
+    Raises:
+        ValidationError: When a field is unknown.
+    """
+    value = query_params.get("fields")
+    if not value:
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in value.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise ValidationError({"fields": [f"Choose among {', '.join(available)}."]})
+    return fields
+
+
+def snapshot_version(queryset) -> tuple:
+    """Returns the latest update time and the number of the monitors in one query.
+
+    Returns:
+        tuple: (latest dateTimeLastUpdated or None, count)
+    """
+    state = queryset.aggregate(last_updated=Max("dateTimeLastUpdated"), count=Count("id"))
+    return state["last_updated"], state["count"]
+
+
+def snapshot_etag(last_updated, count: int, fields: list, since) -> str:
+    key = f"{last_updated and last_updated.isoformat()}|{count}|{','.join(fields)}|{since and since.isoformat()}"
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+def build_snapshot(queryset, fields: list, since, last_updated, count: int) -> dict:
+    """Builds the snapshot of the monitors, only those updated after ``since`` when given.
+
+    Returns:
+        dict: The snapshot, one array of the requested fields per monitor.
+    """
+    if since is not None:
+        queryset = queryset.filter(dateTimeLastUpdated__gt=since)
+    rows = queryset.order_by("id").values_list(*(SNAPSHOT_FIELDS[field] for field in fields))
+    return {
+        "last_updated": last_updated,
+        "since": since,
+        "count": count,
+        "fields": fields,
+        "monitors": [list(row) for row in rows],
+    }
@@ -0,0 +1,255 @@
+"""This module contains the local place index searched before remote geocoding.
+
+Many searches are for our own lots, their addresses or places that were geocoded before,
+so they can be resolved without calling the geocoding service. The index covers
+``ParkingLot`` names and addresses and resolved ``GeocodedPlace`` rows:
+
+- on SQLite it is an FTS5 table, created after ``migrate`` and kept in sync by the
+  signals in ``signals.py`` (run ``manage.py rebuild_place_index`` after bulk imports),
+- on PostgreSQL the source tables are searched directly with pg_trgm similarity,
+- on other databases there is no local index and every search misses.
+
+A search only hits when the matched text is mostly made of the query, so a search for a
+city does not resolve to the one lot whose address happens to mention it.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Optional
+
+from django.db import DatabaseError, connection, transaction
+
+from .geocoding import GeocodedLocation
+from .models import GeocodedPlace, ParkingLot
+
+FTS_TABLE = "vehiscan_place_index"
+MIN_COVERAGE = 0.5
+"""The share of the matched text's words the query must contain for a hit."""
+MIN_TRIGRAM_SIMILARITY = 0.5
+STATS_LOG_INTERVAL = 1000  # Searches between two hit rate reports
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall((text or "").casefold())
+
+
+def coverage(query: str, text: str) -> float:
+    """Returns the share of the words of ``text`` found in ``query``."""
+    text_tokens = tokenize(text)
+    if not text_tokens:
+        return 0.0
+    query_tokens = set(tokenize(query))
+    return sum(token in query_tokens for token in text_tokens) / len(text_tokens)
+
+
+class PlaceIndex:
+    """A local place index that misses every search, and the base of the real indexes."""
+
+    def __init__(self):
+        self.searches = 0
+        self.hits = 0
+        self.total_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def search(self, query: str) -> Optional[GeocodedLocation]:
+        """Resolves a query from the local index.
+
+        Args:
+            query (str): The location typed by the user.
+
+        Returns:
+            Optional[GeocodedLocation]: The best local match, or None on a miss.
+        """
+        start = time.perf_counter()
+        location = None
+        if tokenize(query):
+            try:
+                location = self._search(query)
+            except DatabaseError as error:
+                logging.warning("Place index search failed: %s", error)
+        self._record(location is not None, time.perf_counter() - start)
+        return location
+
+    def stats(self) -> dict:
+        """Returns the number of searches, the hit rate and the mean search latency."""
+        with self._stats_lock:
+            return {
+                "searches": self.searches,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.searches, 3) if self.searches else 0.0,
+                "mean_latency_ms": round(self.total_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+            }
+
+    def index_parking_lot(self, parking_lot: ParkingLot):
+        pass
+
+    def index_geocoded_place(self, place: GeocodedPlace):
+        pass
+
+    def remove_parking_lot(self, parking_lot_id: int):
+        pass
+
+    def remove_geocoded_place(self, place_id: int):
+        pass
+
+    def create(self):
+        """Creates the index storage, called after every ``migrate``."""
+        pass
+
+    def rebuild(self) -> int:
+        """Rebuilds the index from the source tables and returns the number of indexed places."""
+        return 0
+
+    def _search(self, query: str) -> Optional[GeocodedLocation]:
+        return None
+
+    def _record(self, is_hit: bool, seconds: float):
+        with self._stats_lock:
+            self.searches += 1
+            self.hits += is_hit
+            self.total_seconds += seconds
+            should_log = self.searches % STATS_LOG_INTERVAL == 0
+        if should_log:
+            logging.info("Place index: %s", self.stats())
+
+
+class SqlitePlaceIndex(PlaceIndex):
+    """An FTS5 index of lot names, lot addresses and geocoded places.
+
+    Lots and geocoded places share the table, their rowids are ``2 * id`` and ``2 * id + 1``.
+    """
+
+    def index_parking_lot(self, parking_lot: ParkingLot):
+        self._replace(2 * parking_lot.pk, parking_lot.name, parking_lot.address,
+                      parking_lot.latitude, parking_lot.longitude)
+
+    def index_geocoded_place(self, place: GeocodedPlace):
+        if not place.is_found():
+            self.remove_geocoded_place(place.pk)
+            return
+        self._replace(2 * place.pk + 1, place.query, place.address, place.latitude, place.longitude)
+
+    def remove_parking_lot(self, parking_lot_id: int):
+        self._delete(2 * parking_lot_id)
+
+    def remove_geocoded_place(self, place_id: int):
+        self._delete(2 * place_id + 1)
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "name, address, latitude UNINDEXED, longitude UNINDEXED, tokenize = 'unicode61')")
+
+    def rebuild(self) -> int:
+        self.create()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            rows = [(2 * pk, name, address, float(latitude), float(longitude))
+                    for pk, name, address, latitude, longitude
+                    in ParkingLot.objects.values_list("pk", "name", "address", "latitude", "longitude")]
+            rows += [(2 * pk + 1, query, address, latitude, longitude)
+                     for pk, query, address, latitude, longitude
+                     in GeocodedPlace.objects.filter(latitude__isnull=False, longitude__isnull=False)
+                     .values_list("pk", "query", "address", "latitude", "longitude")]
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, address, latitude, longitude) VALUES (%s, %s, %s, %s, %s)",
+                rows)
+        return len(rows)
+
+    def _search(self, query: str) -> Optional[GeocodedLocation]:
+        # Every word must match, as a prefix so "blue are" still finds "Blue Area"
+        match = " ".join(f'"{token}"*' for token in tokenize(query))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT name, address, latitude, longitude FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}) LIMIT 10", [match])
+            for name, address, latitude, longitude in cursor.fetchall():
+                if max(coverage(query, name), coverage(query, address)) >= MIN_COVERAGE:
+                    return GeocodedLocation(latitude, longitude, address or name)
+        return None
+
+    def _replace(self, rowid: int, name: str, address: str, latitude, longitude):
+        self._write([(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [rowid]),
+                     (f"INSERT INTO {FTS_TABLE} (rowid, name, address, latitude, longitude) "
+                      "VALUES (%s, %s, %s, %s, %s)", [rowid, name, address, float(latitude), float(longitude)])])
+
+    def _delete(self, rowid: int):
+        self._write([(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [rowid])])
+
+    def _write(self, statements: list):
+        # A stale index only costs remote lookups, it must never fail the save of a lot
+        try:
+            with connection.cursor() as cursor:
+                for sql, parameters in statements:
+                    cursor.execute(sql, parameters)
+        except DatabaseError as error:
+            logging.warning("Place index update failed: %s", error)
+
+
+class PostgresPlaceIndex(PlaceIndex):
+    """Searches lot names, lot addresses and geocoded places with pg_trgm similarity.
+
+    The source tables are queried directly, so there is nothing to keep in sync; the
+    extension and the trigram indexes are created after ``migrate``.
+    """
+
+    def rebuild(self) -> int:
+        self.create()
+        return ParkingLot.objects.count() + GeocodedPlace.objects.filter(latitude__isnull=False).count()
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for model, column in [(ParkingLot, "name"), (ParkingLot, "address"),
+                                  (GeocodedPlace, "query"), (GeocodedPlace, "address")]:
+                table = model._meta.db_table
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column}_trgm_idx "
+                               f"ON {table} USING gin ({column} gin_trgm_ops)")
+
+    def _search(self, query: str) -> Optional[GeocodedLocation]:
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models import F, Q
+        from django.db.models.functions import Greatest
+
+        candidates = []
+        with transaction.atomic():
+            # The % operator is the one the trigram indexes serve, it matches above this threshold
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                               [str(MIN_TRIGRAM_SIMILARITY)])
+            for queryset, name_field in [(ParkingLot.objects.all(), "name"),
+                                         (GeocodedPlace.objects.filter(latitude__isnull=False), "query")]:
+                # Only the rows found through the indexes are scored
+                match = queryset.filter(Q(TrigramSimilar(F(name_field), query)) |
+                                        Q(TrigramSimilar(F("address"), query))) \
+                    .annotate(similarity=Greatest(TrigramSimilarity(name_field, query),
+                                                  TrigramSimilarity("address", query))) \
+                    .filter(similarity__gte=MIN_TRIGRAM_SIMILARITY) \
+                    .order_by("-similarity") \
+                    .values_list("similarity", "address", "latitude", "longitude").first()
+                if match is not None:
+                    candidates.append(match)
+        if not candidates:
+            return None
+        _, address, latitude, longitude = max(candidates)
+        return GeocodedLocation(float(latitude), float(longitude), address)
+
+
+_place_index: Optional[PlaceIndex] = None
+
+
+def get_place_index() -> PlaceIndex:
+    """Returns the place index matching the database backend."""
+    global _place_index
+    if _place_index is None:
+        if connection.vendor == "sqlite":
+            _place_index = SqlitePlaceIndex()
+        elif connection.vendor == "postgresql":
+            _place_index = PostgresPlaceIndex()
+        else:
+            _place_index = PlaceIndex()
+    return _place_index
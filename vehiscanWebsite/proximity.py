@@ -0,0 +1,200 @@
+"""This module contains the proximity search used to find parking near a point.
+
+Candidates are first narrowed down in the database with indexed latitude/longitude range
+filters (a bounding box around the search circle). Only the surviving rows' coordinates
+are loaded, their great-circle distances are computed at once with a NumPy haversine, and
+the rows inside the radius are sorted and paginated before any model is instantiated.
+"""
+import math
+
+import numpy as np
+from django.core.paginator import Page, Paginator
+from django.db.models import FloatField, Q, QuerySet
+from django.db.models.functions import Cast
+
+EARTH_RADIUS_KM = 6371.0088
+"""The mean earth radius used by the haversine formula."""
+DEFAULT_RADIUS_KM = 10
+DEFAULT_PAGE_SIZE = 20
+MAX_RADIUS_KM = 200
+MAX_PAGE_SIZE = 100
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+
+
+def bounding_box_filter(latitude: float, longitude: float, radius_km: float, coordinate_limit: float = 180) -> Q:
+    """Builds a latitude/longitude range filter enclosing the search circle.
+
+    Args:
+        latitude (float): The latitude of the circle center.
+        longitude (float): The longitude of the circle center.
+        radius_km (float): The radius of the circle in kilometers.
+        coordinate_limit (float): The largest absolute value the coordinate columns can hold;
+            bounds are clamped to it so they can be adapted to the decimal columns.
+
+    Returns:
+        Q: The filter, split in two longitude ranges when the box crosses the antimeridian.
+    """
+    def clamp(value: float) -> float:
+        return round(min(max(value, -coordinate_limit), coordinate_limit), 9)
+
+    latitude_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_latitude, max_latitude = latitude - latitude_delta, latitude + latitude_delta
+    latitude_filter = Q(latitude__gte=clamp(min_latitude), latitude__lte=clamp(max_latitude))
+    if min_latitude <= -90 or max_latitude >= 90:
+        # The circle contains a pole, so every longitude is inside the box
+        return latitude_filter
+
+    longitude_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if longitude_delta >= 180:
+        return latitude_filter
+    min_longitude, max_longitude = longitude - longitude_delta, longitude + longitude_delta
+    if min_longitude < -180:
+        longitude_filter = Q(longitude__gte=clamp(min_longitude + 360)) | Q(longitude__lte=clamp(max_longitude))
+    elif max_longitude > 180:
+        longitude_filter = Q(longitude__gte=clamp(min_longitude)) | Q(longitude__lte=clamp(max_longitude - 360))
+    else:
+        longitude_filter = Q(longitude__gte=clamp(min_longitude), longitude__lte=clamp(max_longitude))
+    return latitude_filter & longitude_filter
+
+
+def coordinate_limit(model) -> float:
+    """Returns the largest absolute value the model's decimal coordinate columns can hold."""
+    field = model._meta.get_field('longitude')
+    return 10 ** (field.max_digits - field.decimal_places) - 10 ** -9
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encodes a point as a geohash, whose prefixes are the ever coarser grid cells containing it."""
+    bounds = [[-90.0, 90.0], [-180.0, 180.0]]
+    values = (latitude, longitude)
+    characters = []
+    bit_count, index = 0, 0
+    is_longitude = True
+    while len(characters) < precision:
+        interval = bounds[is_longitude]
+        middle = (interval[0] + interval[1]) / 2
+        index <<= 1
+        if values[is_longitude] >= middle:
+            index |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        is_longitude = not is_longitude
+        bit_count += 1
+        if bit_count == 5:
+            characters.append(GEOHASH_ALPHABET[index])
+            bit_count, index = 0, 0
+    return "".join(characters)
+
+
+def geohash_bounds(geohash: str) -> tuple:
+    """Returns the (south, west, north, east) bounds of a geohash cell."""
+    bounds = [[-90.0, 90.0], [-180.0, 180.0]]
+    is_longitude = True
+    for character in geohash:
+        index = GEOHASH_ALPHABET.index(character)
+        for shift in range(4, -1, -1):
+            interval = bounds[is_longitude]
+            middle = (interval[0] + interval[1]) / 2
+            interval[0 if index >> shift & 1 else 1] = middle
+            is_longitude = not is_longitude
+    return bounds[0][0], bounds[1][0], bounds[0][1], bounds[1][1]
+
+
+def haversine_km(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Computes the great-circle distances from a point to many points at once.
+
+    Args:
+        latitude (float): The latitude of the origin.
+        longitude (float): The longitude of the origin.
+        latitudes (np.ndarray): The latitudes of the destinations.
+        longitudes (np.ndarray): The longitudes of the destinations.
+
+    Returns:
+        np.ndarray: The distances in kilometers.
+    """
+    origin_latitude = math.radians(latitude)
+    latitudes = np.radians(latitudes)
+    half_latitude_delta = (latitudes - origin_latitude) / 2
+    half_longitude_delta = (np.radians(longitudes) - math.radians(longitude)) / 2
+    a = np.sin(half_latitude_delta) ** 2 + \
+        math.cos(origin_latitude) * np.cos(latitudes) * np.sin(half_longitude_delta) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def nearest_ids(queryset: QuerySet, latitude: float, longitude: float, radius_km: float) -> tuple:
+    """Returns the primary keys of the rows within the radius, nearest first.
+
+    Args:
+        queryset (QuerySet): Rows with ``latitude`` and ``longitude`` fields.
+        latitude (float): The latitude of the search point.
+        longitude (float): The longitude of the search point.
+        radius_km (float): The search radius in kilometers.
+
+    Returns:
+        tuple: (ids, distances) NumPy arrays sorted by distance.
+    """
+    box = bounding_box_filter(latitude, longitude, radius_km, coordinate_limit(queryset.model))
+    rows = queryset.filter(box).annotate(
+        float_latitude=Cast('latitude', FloatField()),
+        float_longitude=Cast('longitude', FloatField()),
+    ).values_list('pk', 'float_latitude', 'float_longitude')
+    candidates = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+    distances = haversine_km(latitude, longitude, candidates[:, 1], candidates[:, 2])
+    inside = distances <= radius_km
+    ids, distances = candidates[inside, 0].astype(np.int64), distances[inside]
+    order = np.argsort(distances, kind='stable')
+    return ids[order], distances[order]
+
+
+def find_nearby(queryset: QuerySet, latitude: float, longitude: float, radius_km: float = DEFAULT_RADIUS_KM,
+                page_size: int = DEFAULT_PAGE_SIZE, page_number=1) -> Page:
+    """Finds the rows within the radius of a point, nearest first, one page at a time.
+
+    Only the rows of the requested page are loaded as model instances; each gets a
+    ``distance`` attribute in kilometers.
+
+    Args:
+        queryset (QuerySet): Rows with ``latitude`` and ``longitude`` fields.
+        latitude (float): The latitude of the search point.
+        longitude (float): The longitude of the search point.
+        radius_km (float): The search radius in kilometers.
+        page_size (int): The number of rows per page.
+        page_number: The 1-based page number; invalid numbers fall back like ``Paginator.get_page``.
+
+    Returns:
+        Page: The requested page.
+    """
+    ids, distances = nearest_ids(queryset, latitude, longitude, radius_km)
+    paginator = Paginator(range(len(ids)), page_size)
+    page = paginator.get_page(page_number)
+    positions = list(page.object_list)
+    rows = queryset.in_bulk(ids[positions].tolist())
+    object_list = []
+    for position in positions:
+        row = rows.get(int(ids[position]))
+        if row is not None:
+            row.distance = float(distances[position])
+            object_list.append(row)
+    page.object_list = object_list
+    return page
+
+
+def parse_search_parameters(query_dict) -> tuple:
+    """Reads and clamps the ``radius`` and ``page_size`` request parameters.
+
+    Returns:
+        tuple: (radius_km, page_size)
+    """
+    try:
+        radius_km = float(query_dict.get('radius', DEFAULT_RADIUS_KM))
+    except ValueError:
+        radius_km = DEFAULT_RADIUS_KM
+    if not math.isfinite(radius_km):
+        radius_km = DEFAULT_RADIUS_KM
+    try:
+        page_size = int(query_dict.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return min(max(radius_km, 0.1), MAX_RADIUS_KM), min(max(page_size, 1), MAX_PAGE_SIZE)
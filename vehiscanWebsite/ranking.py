@@ -0,0 +1,125 @@
+"""This module ranks the parking lots around a point by distance, availability and price.
+
+Candidates are narrowed down with the indexed bounding box of the search circle, then the
+database computes the haversine distance and the score of each of them, lowest first:
+
+    score = distance weight * distance / radius
+          + availability weight * (1 - free ratio)
+          + price weight * price / (price + PRICE_SCALE)
+
+and returns a page of the best lots with ``ORDER BY score LIMIT``, so no lot is loaded or
+sorted in Python. The free ratio is read from the availability counters of the lot, or for
+a later stay from its least available forecast hour of the stay (see ``forecasts.py``),
+falling back to the current ratio for lots without a forecast. Free parking costs nothing.
+"""
+import math
+from typing import Optional
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db.models import Case, F, FloatField, Min, OuterRef, Q, QuerySet, Subquery, Value, When
+from django.db.models.functions import ASin, Cast, Coalesce, Cos, Least, Power, Radians, Sin, Sqrt
+
+from .forecasts import stay_hours
+from .models import AvailabilityForecast
+from .proximity import DEFAULT_PAGE_SIZE, DEFAULT_RADIUS_KM, EARTH_RADIUS_KM, bounding_box_filter, coordinate_limit
+
+RANKINGS = {
+    "best": getattr(settings, "SEARCH_RANKING_WEIGHTS", {"distance": 0.5, "availability": 0.3, "price": 0.2}),
+    "nearest": {"distance": 1.0},
+    "available": {"distance": 0.2, "availability": 0.8},
+    "cheapest": {"distance": 0.2, "price": 0.8},
+}
+"""The weights of every ranking the search can be sorted by."""
+FILTERS = {
+    "paid": Q(isPaidParking=True),
+    "free": Q(isPaidParking=False),
+}
+"""The filters the search can be narrowed down with, ranked the best way."""
+DEFAULT_RANKING = "best"
+PRICE_SCALE = getattr(settings, "SEARCH_RANKING_PRICE_SCALE", 100.0)
+"""The hourly price whose price term is half of its weight."""
+
+
+def parse_ranking(query_dict) -> tuple:
+    """Reads the ``filter`` parameter, a ranking or a filter name, the best ranking by default.
+
+    Returns:
+        tuple: (name, weights, filter)
+    """
+    name = query_dict.get("filter") or DEFAULT_RANKING
+    if name in RANKINGS:
+        return name, RANKINGS[name], Q()
+    if name in FILTERS:
+        return name, RANKINGS[DEFAULT_RANKING], FILTERS[name]
+    return DEFAULT_RANKING, RANKINGS[DEFAULT_RANKING], Q()
+
+
+def rank_nearby(queryset: QuerySet, latitude: float, longitude: float, radius_km: float = DEFAULT_RADIUS_KM,
+                page_size: int = DEFAULT_PAGE_SIZE, page_number=1, weights: Optional[dict] = None,
+                forecast_window: Optional[tuple] = None) -> Page:
+    """Finds the lots within the radius of a point, best ranked first, one page at a time.
+
+    Every lot of the page gets ``distance`` in kilometers and ``score`` attributes.
+
+    Args:
+        queryset (QuerySet): The parking lots to search.
+        latitude (float): The latitude of the search point.
+        longitude (float): The longitude of the search point.
+        radius_km (float): The search radius in kilometers.
+        page_size (int): The number of lots per page.
+        page_number: The 1-based page number; invalid numbers fall back like ``Paginator.get_page``.
+        weights (Optional[dict]): The ``distance``, ``availability`` and ``price`` weights,
+            missing ones count for nothing. The best ranking by default.
+        forecast_window (Optional[tuple]): (start time, duration in hours) of a later stay.
+
+    Returns:
+        Page: The requested page.
+    """
+    weights = weights or RANKINGS[DEFAULT_RANKING]
+    box = bounding_box_filter(latitude, longitude, radius_km, coordinate_limit(queryset.model))
+    parking_lots = queryset.filter(box) \
+        .annotate(distance=_distance(latitude, longitude)).filter(distance__lte=radius_km) \
+        .annotate(score=_score(weights, radius_km, forecast_window)).order_by("score", "distance", "pk")
+    return Paginator(parking_lots, page_size).get_page(page_number)
+
+
+def _distance(latitude: float, longitude: float):
+    # The haversine formula, like proximity.haversine_km
+    origin_latitude = math.radians(latitude)
+    latitudes = Radians(Cast("latitude", FloatField()))
+    longitudes = Radians(Cast("longitude", FloatField()))
+    a = Power(Sin((latitudes - Value(origin_latitude)) / Value(2.0)), 2) + \
+        Value(math.cos(origin_latitude)) * Cos(latitudes) * \
+        Power(Sin((longitudes - Value(math.radians(longitude))) / Value(2.0)), 2)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def _score(weights: dict, radius_km: float, forecast_window: Optional[tuple]):
+    free_ratio = Case(
+        When(parking_spaces__gt=0, then=Least(
+            Cast("free_parking_spaces", FloatField()) / Cast("parking_spaces", FloatField()), Value(1.0))),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    if forecast_window is not None:
+        forecasts = AvailabilityForecast.objects.filter(
+            parking_lot=OuterRef("pk"), hour_of_week__in=stay_hours(*forecast_window)) \
+            .order_by().values("parking_lot").annotate(worst=Min("free_ratio")).values("worst")
+        free_ratio = Coalesce(Subquery(forecasts, output_field=FloatField()), free_ratio)
+    price = Case(
+        When(isPaidParking=False, then=Value(0.0)),
+        default=Cast("base_price_per_hour", FloatField()),
+        output_field=FloatField(),
+    )
+
+    terms = {
+        "distance": F("distance") / Value(float(radius_km)),
+        "availability": Value(1.0) - free_ratio,
+        "price": price / (price + Value(float(PRICE_SCALE))),
+    }
+    score = Value(0.0)
+    for name, term in terms.items():
+        if weights.get(name):
+            score = score + Value(float(weights[name])) * term
+    return score
@@ -0,0 +1,158 @@
+"""This module maintains the minute, hour and day rollups of ParkingLotLog.
+
+Raw log rows are aggregated per monitor and time bucket by the database, in id ranges
+above a stored high-water mark, and merged into the rollup tables. Rows that arrive late
+(batched logs keep their observation time) are merged into their bucket all the same.
+Once rolled up, raw rows older than the retention period are deleted, and so are minute
+rollups older than theirs; hour and day rollups are kept.
+
+Concurrent inserts can commit a lower id after a higher one, so the high-water mark only
+moves past rows inserted at least ``LOG_ROLLUP_SETTLE_SECONDS`` ago by the database
+clock (``logged_at``): by then every transaction that took a lower id has finished.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Now, Trunc
+from django.utils import timezone
+
+from .models import ParkingLotLog, ParkingLotLogDay, ParkingLotLogHour, ParkingLotLogMinute, RollupProgress
+
+ROLLUP_MODELS = {
+    "minute": ParkingLotLogMinute,
+    "hour": ParkingLotLogHour,
+    "day": ParkingLotLogDay,
+}
+"""The rollup model of every resolution, finest first."""
+PROGRESS_NAME = "parking_lot_log_rollups"
+DEFAULT_BATCH_SIZE = 50000
+DELETE_CHUNK_SIZE = 10000  # Rows deleted per statement, to keep write locks short
+SETTLE_SECONDS = getattr(settings, "LOG_ROLLUP_SETTLE_SECONDS", 60)
+"""How long after their insert log rows are rolled up, longer than any transaction inserting them."""
+
+
+def roll_up_logs(batch_size: int = DEFAULT_BATCH_SIZE, settle_seconds: float = SETTLE_SECONDS) -> int:
+    """Merges every settled log row above the high-water mark into the rollups.
+
+    Args:
+        batch_size (int): The number of log rows aggregated per transaction.
+        settle_seconds (float): How long after their insert rows are rolled up.
+
+    Returns:
+        int: The number of log rows rolled up.
+    """
+    rolled_up = 0
+    while True:
+        count = _roll_up_batch(batch_size, settle_seconds)
+        if not count:
+            return rolled_up
+        rolled_up += count
+
+
+def compact_logs(retention_days: int, minute_retention_days: int, settle_seconds: float = SETTLE_SECONDS) -> tuple:
+    """Deletes rolled up raw rows and minute rollups older than their retention periods.
+
+    Returns:
+        tuple: (deleted raw rows, deleted minute rollups)
+    """
+    now = timezone.now()
+    last_id = RollupProgress.objects.filter(name=PROGRESS_NAME).values_list("last_id", flat=True).first() or 0
+    # Only rows already merged into the rollups may go
+    raw = ParkingLotLog.objects.filter(id__lte=last_id, time_stamp__lt=now - timedelta(days=retention_days)) \
+        .exclude(is_unsettled(settle_seconds))
+    minutes = ParkingLotLogMinute.objects.filter(bucket_start__lt=now - timedelta(days=minute_retention_days))
+    return _delete_in_chunks(raw), _delete_in_chunks(minutes)
+
+
+def rolled_up_until() -> Optional[datetime]:
+    """Returns the time of the last log row rolled up, None before the first run."""
+    last_id = RollupProgress.objects.filter(name=PROGRESS_NAME).values_list("last_id", flat=True).first()
+    if not last_id:
+        return None
+    return ParkingLotLog.objects.filter(id=last_id).values_list("time_stamp", flat=True).first()
+
+
+def is_unsettled(settle_seconds: float = SETTLE_SECONDS) -> Q:
+    """Selects the log rows inserted less than ``settle_seconds`` ago, by the database clock."""
+    return Q(logged_at__gte=Now() - timedelta(seconds=settle_seconds))
+
+
+def settled_above(queryset, last_id: int, settle_seconds: float = SETTLE_SECONDS):
+    """Narrows log rows down to the ids above ``last_id`` that a high-water mark may move past.
+
+    They stop below the first row that is not settled yet: lower ids still missing then
+    belong to transactions that are still running and may commit later.
+    """
+    new_logs = queryset.filter(id__gt=last_id)
+    unsettled_id = new_logs.filter(is_unsettled(settle_seconds)).order_by("id").values_list("id", flat=True).first()
+    return new_logs if unsettled_id is None else new_logs.filter(id__lt=unsettled_id)
+
+
+def _roll_up_batch(batch_size: int, settle_seconds: float) -> int:
+    with transaction.atomic():
+        progress, _ = RollupProgress.objects.select_for_update().get_or_create(name=PROGRESS_NAME)
+        new_logs = settled_above(ParkingLotLog.objects.all(), progress.last_id, settle_seconds)
+        upper_id = new_logs.order_by("id").values_list("id", flat=True)[batch_size - 1:batch_size].first()
+        if upper_id is None:
+            upper_id = new_logs.aggregate(upper_id=Max("id"))["upper_id"]
+        if upper_id is None:
+            return 0
+
+        batch = new_logs.filter(id__lte=upper_id)
+        count = batch.count()
+        for kind, model in ROLLUP_MODELS.items():
+            _merge(model, batch.annotate(bucket=Trunc("time_stamp", kind))
+                   .values("logged_by_monitor_id", "parking_lot_id", "bucket")
+                   .annotate(minimum=Min("free_parking_spaces"), maximum=Max("free_parking_spaces"),
+                             total=Sum("free_parking_spaces"), samples=Count("id"))
+                   .order_by())
+
+        progress.last_id = upper_id
+        progress.save()
+    logging.info("Rolled up %d parking lot log rows up to id %d", count, upper_id)
+    return count
+
+
+def _merge(model, aggregates):
+    aggregates = list(aggregates)
+    if not aggregates:
+        return
+    existing = {
+        (rollup.monitor_id, rollup.bucket_start): rollup
+        for rollup in model.objects.filter(
+            monitor_id__in={row["logged_by_monitor_id"] for row in aggregates},
+            bucket_start__gte=min(row["bucket"] for row in aggregates),
+            bucket_start__lte=max(row["bucket"] for row in aggregates),
+        )
+    }
+    created, updated = [], []
+    for row in aggregates:
+        rollup = existing.get((row["logged_by_monitor_id"], row["bucket"]))
+        if rollup is None:
+            created.append(model(
+                parking_lot_id=row["parking_lot_id"], monitor_id=row["logged_by_monitor_id"],
+                bucket_start=row["bucket"], min_free_parking_spaces=row["minimum"],
+                max_free_parking_spaces=row["maximum"], sum_free_parking_spaces=row["total"],
+                sample_count=row["samples"]))
+        else:
+            rollup.min_free_parking_spaces = min(rollup.min_free_parking_spaces, row["minimum"])
+            rollup.max_free_parking_spaces = max(rollup.max_free_parking_spaces, row["maximum"])
+            rollup.sum_free_parking_spaces += row["total"]
+            rollup.sample_count += row["samples"]
+            updated.append(rollup)
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(updated, ["min_free_parking_spaces", "max_free_parking_spaces",
+                                        "sum_free_parking_spaces", "sample_count"])
+
+
+def _delete_in_chunks(queryset) -> int:
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list("id", flat=True)[:DELETE_CHUNK_SIZE])
+        if not ids:
+            return deleted
+        deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
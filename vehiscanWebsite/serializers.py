@@ -29,10 +29,17 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         
 class ParkingLotSerializer(serializers.HyperlinkedModelSerializer):
     """ this is a serializer for the ParkingLot model
+
+    The availability fields are read from the availability counters of the lot row.
     """
+    free_parking_spaces = serializers.IntegerField(source='get_free_parking_spaces', read_only=True)
+    probability_parking_available = serializers.IntegerField(source='get_probability_parking_available', read_only=True)
+    date_time_last_updated = serializers.DateTimeField(source='get_date_time_last_updated', read_only=True)
+
     class Meta:
         model = ParkingLot
-        fields = ['id', 'name', 'latitude', 'longitude']
+        fields = ['id', 'name', 'latitude', 'longitude', 'free_parking_spaces',
+                  'probability_parking_available', 'date_time_last_updated']
 
 class ParkingLotMonitorSerializer(serializers.HyperlinkedModelSerializer):
     """this is a serializer for the ParkingLotMonitor model
@@ -1,7 +1,13 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import ImageField
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .availability import invalidate_fleet_snapshot
+from .availability_stream import get_hub
+from .models import GeocodedPlace, ParkingLot, ParkingLotMonitor, PendingParkingLotRegistration, UserProfile
+from .place_index import get_place_index
+from .thumbnails import schedule_derivatives
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -12,4 +18,65 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     # Only save if profile exists
     if hasattr(instance, 'profile'):
-        instance.profile.save()
\ No newline at end of file
+        instance.profile.save()
+
+# Keep the local place index in sync with the lots and geocoded places it covers
+
+@receiver(post_migrate)
+def create_place_index(sender, app_config, **kwargs):
+    if app_config.name == 'vehiscanWebsite':
+        get_place_index().create()
+
+@receiver(post_save, sender=ParkingLot)
+def index_parking_lot(sender, instance, **kwargs):
+    get_place_index().index_parking_lot(instance)
+
+@receiver(post_delete, sender=ParkingLot)
+def remove_parking_lot_from_index(sender, instance, **kwargs):
+    get_place_index().remove_parking_lot(instance.pk)
+
+@receiver(post_save, sender=GeocodedPlace)
+def index_geocoded_place(sender, instance, **kwargs):
+    get_place_index().index_geocoded_place(instance)
+
+@receiver(post_delete, sender=GeocodedPlace)
+def remove_geocoded_place_from_index(sender, instance, **kwargs):
+    get_place_index().remove_geocoded_place(instance.pk)
+
+# Build the thumbnails of uploaded images off the request thread
+
+@receiver(post_save, sender=ParkingLot)
+@receiver(post_save, sender=ParkingLotMonitor)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_save, sender=PendingParkingLotRegistration)
+def create_image_derivatives(sender, instance, **kwargs):
+    for field in instance._meta.fields:
+        if isinstance(field, ImageField):
+            schedule_derivatives(getattr(instance, field.attname))
+
+# Keep the availability counters of the lots in step with their monitors, before the
+# receivers below read them
+
+@receiver(post_save, sender=ParkingLotMonitor)
+def count_saved_monitor(sender, instance, update_fields=None, **kwargs):
+    instance.count_into_parking_lot(update_fields)
+
+@receiver(post_delete, sender=ParkingLotMonitor)
+def count_deleted_monitor(sender, instance, **kwargs):
+    instance.count_out_of_parking_lot()
+
+# Invalidate the fleet snapshot and wake the open streams once availability changes are
+# committed
+
+def _refresh_after_commit():
+    def refresh():
+        invalidate_fleet_snapshot()
+        get_hub().notify()
+    transaction.on_commit(refresh)
+
+@receiver(post_save, sender=ParkingLotMonitor)
+@receiver(post_delete, sender=ParkingLotMonitor)
+@receiver(post_save, sender=ParkingLot)
+@receiver(post_delete, sender=ParkingLot)
+def refresh_parking_lot_availability(sender, instance, **kwargs):
+    _refresh_after_commit()
@@ -11,6 +11,9 @@ def call_method(object:object , method_name: str, *args):
 def get_distance_from_lat_lang(parking_lot_monitor, latitude, longitude):
     """Custom template tag to get the distance from a parking lot monitor to a point.
 
+    Monitors returned by the nearby search already carry their ``distance`` to the search
+    point, in which case no distance is computed while rendering.
+
     Args:
         parking_lot_monitor (ParkingLotMonitor): The parking lot monitor to get the distance from.
         latitude (float): Latitude of the point.
@@ -19,4 +22,7 @@ def get_distance_from_lat_lang(parking_lot_monitor, latitude, longitude):
     Returns:
         float : The distance from the parking lot monitor to the point.
     """
+    distance = getattr(parking_lot_monitor, "distance", None)
+    if distance is not None:
+        return round(distance, 2)
     return parking_lot_monitor.get_distance_from_lat_lang(latitude, longitude)
@@ -0,0 +1,16 @@
+from django import template
+
+from ..thumbnails import derivative_url
+
+register = template.Library()
+
+@register.filter
+def thumbnail_url(image, spec):
+    """
+    Returns the URL of a thumbnail of an uploaded image, e.g. ``{{ lot.image|thumbnail_url:"medium.webp" }}``.
+
+    The spec is a size of ``IMAGE_DERIVATIVE_SIZES``, optionally followed by ``.webp``; the
+    image itself is served until the thumbnail is built.
+    """
+    size, _, image_format = str(spec).partition('.')
+    return derivative_url(image, size, image_format or 'jpeg')
@@ -1,3 +1,1156 @@
-from django.test import TestCase
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+
+from asgiref.sync import sync_to_async
+
+from .availability import FLEET_KEY_PREFIX, get_fleet_snapshot, invalidate_fleet_snapshot
+from .availability_stream import AvailabilityHub, Region, Subscription, get_hub
+from .batching import BufferedWriter, get_writer
+from .demand import aggregate_searches, demand_heatmap
+from .forecasts import attach_forecasts, hour_of_week, update_forecasts
+from .geocoding import CachingGeocoder, RequestCoalescer, StubGeocoder
+from .history import cache_max_age, occupancy_series
+from .models import (AvailabilityForecast, GeocodedPlace, ParkingLot, ParkingLotLog, ParkingLotLogDay, ParkingLotLogHour,
+                     ParkingLotLogMinute, ParkingLotMonitor, ParkingLotStatus, ParkingRequestLog, RollupProgress,
+                     SearchDemandHour)
+from .place_index import get_place_index
+from .proximity import DEFAULT_PAGE_SIZE, DEFAULT_RADIUS_KM, find_nearby, parse_search_parameters
+from .ranking import parse_ranking, rank_nearby
+from .rollups import PROGRESS_NAME as ROLLUP_PROGRESS_NAME, compact_logs, roll_up_logs
+from .thumbnails import IMAGE_DERIVATIVE_SIZES, MONITOR_SNAPSHOT_SIZE, derivative_name, derivative_url
+
+STUB_GEOCODER_SETTINGS = {
+    "GEOCODER_BACKEND": "vehiscanWebsite.geocoding.StubGeocoder",
+    "GEOCODER_STUB_PLACES": {"Islamabad": (33.6844, 73.0479)},
+}
+SYNCHRONOUS_LOG_SETTINGS = {"PARKING_LOT_LOG_BATCH_SIZE": 1, "PARKING_REQUEST_LOG_BATCH_SIZE": 1}
+"""Log rows are inserted right away, inside the test transaction."""
+
+
+def create_parking_lot(owner, name, latitude=33.6844, longitude=73.0479, parking_spaces=10, **kwargs):
+    return ParkingLot.objects.create(
+        name=name,
+        address=kwargs.pop('address', f"{name} Road"),
+        hours="24/7",
+        latitude=Decimal(str(latitude)),
+        longitude=Decimal(str(longitude)),
+        parking_spaces=parking_spaces,
+        owner=owner,
+        status=kwargs.pop('status', ParkingLotStatus.LIVE),
+        **kwargs
+    )
+
+
+def create_parking_lot_monitor(parking_lot, name, free_parking_spaces=0, **kwargs):
+    return ParkingLotMonitor.objects.create(
+        parkingLot=parking_lot,
+        name=name,
+        latitude=parking_lot.latitude,
+        longitude=parking_lot.longitude,
+        free_parking_spaces=free_parking_spaces,
+        total_parking_spaces=parking_lot.parking_spaces,
+        **kwargs
+    )
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class ParkingLotMonitorSnapshotTestCase(TestCase):
+    """Snapshot upload test cases."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username="parkingMonitor", password="Letmein1$")
+        self.user.user_permissions.add(Permission.objects.get(codename="change_parkinglotmonitor"))
+        self.parking_lot = create_parking_lot(self.user.profile, "Henry Street")
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Henry Street Monitor")
+
+    def upload(self, content, name="monitor.jpg"):
+        self.client.force_login(self.user)
+        return self.client.put(
+            f"/api-auth/parking-lot-monitors/{self.monitor.id}/snapshot/",
+            data=encode_multipart(BOUNDARY, {"image": SimpleUploadedFile(name, content, content_type="image/jpeg")}),
+            content_type=MULTIPART_CONTENT,
+        )
+
+    def jpeg(self, size=(1920, 1080)):
+        buffer = BytesIO()
+        Image.new("RGB", size, (120, 60, 30)).save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+    def test_snapshot_is_stored_as_thumbnail(self):
+        """An uploaded snapshot is stored resized to fit the snapshot box."""
+        response = self.upload(self.jpeg())
+        self.assertEqual(response.status_code, 200)
+        self.monitor.refresh_from_db()
+        with Image.open(self.monitor.image.path) as stored:
+            self.assertLessEqual(stored.width, MONITOR_SNAPSHOT_SIZE[0])
+            self.assertLessEqual(stored.height, MONITOR_SNAPSHOT_SIZE[1])
+
+    def test_invalid_snapshots_are_rejected(self):
+        """Files that are not images, or decompression bombs, are a bad request rather than a server error."""
+        self.assertEqual(self.upload(b"not an image").status_code, 400)
+        self.assertEqual(self.upload(self.jpeg()[:200]).status_code, 400)
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            self.assertEqual(self.upload(self.jpeg((100, 100))).status_code, 400)
+        self.monitor.refresh_from_db()
+        self.assertFalse(self.monitor.image)
+
+@override_settings(IMAGE_DERIVATIVES_IN_BACKGROUND=False, **SYNCHRONOUS_LOG_SETTINGS)
+class ImageDerivativeTestCase(TestCase):
+    """Image derivative test cases."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+
+    def upload(self, name="lot.png", size=(2000, 1500)):
+        buffer = BytesIO()
+        Image.new("RGB", size, (30, 120, 60)).save(buffer, format="PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_uploads_get_thumbnails_of_every_size(self):
+        """Saving an uploaded image stores its JPEG and WebP thumbnails, served to the list pages."""
+        parking_lot = create_parking_lot(self.owner, "Pictured Lot", image=self.upload())
+        storage = parking_lot.image.storage
+        for size, box in IMAGE_DERIVATIVE_SIZES.items():
+            for image_format, extension in [("jpeg", "JPEG"), ("webp", "WEBP")]:
+                with storage.open(derivative_name(parking_lot.image.name, size, image_format)) as stored, \
+                        Image.open(stored) as thumbnail:
+                    self.assertEqual(thumbnail.format, extension)
+                    self.assertLessEqual(thumbnail.width, box[0])
+                    self.assertLessEqual(thumbnail.height, box[1])
+
+        url = derivative_url(parking_lot.image, "medium", "webp")
+        self.assertTrue(url.endswith("/medium.webp"))
+        with override_settings(**STUB_GEOCODER_SETTINGS):
+            self.assertContains(self.client.get(reverse("parking-lots"), {"location": "Islamabad"}), url)
+
+    def test_thumbnails_are_built_off_the_request_thread(self):
+        """In the background the original image is served and the thumbnails are built once."""
+        parking_lot = create_parking_lot(self.owner, "Pictured Lot")
+        parking_lot.image.save("lot.png", self.upload(), save=False)
+        executor = mock.Mock()
+        with override_settings(IMAGE_DERIVATIVES_IN_BACKGROUND=True), \
+                mock.patch("vehiscanWebsite.thumbnails._get_executor", return_value=executor):
+            self.assertEqual(derivative_url(parking_lot.image, "small"), parking_lot.image.url)
+            self.assertEqual(derivative_url(parking_lot.image, "large"), parking_lot.image.url)
+        executor.submit.assert_called_once()
+        # The worker builds them, later pages get the thumbnail
+        executor.submit.call_args.args[0](*executor.submit.call_args.args[1:])
+        self.assertTrue(derivative_url(parking_lot.image, "small").endswith("/small.jpg"))
+
+    def test_invalid_images_are_served_as_they_are(self):
+        """An image Pillow cannot read keeps being served without thumbnails."""
+        parking_lot = create_parking_lot(self.owner, "Broken Lot")
+        parking_lot.image.save("broken.png", SimpleUploadedFile("broken.png", b"not an image"), save=False)
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(derivative_url(parking_lot.image, "small"), parking_lot.image.url)
+        self.assertEqual(derivative_url(parking_lot.image, "small"), parking_lot.image.url)
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class ParkingLotAvailabilityQueryTestCase(TestCase):
+    """Annotated availability test cases."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+
+    def create_lots(self, count):
+        for index in range(ParkingLot.objects.count(), ParkingLot.objects.count() + count):
+            parking_lot = create_parking_lot(self.owner, f"Lot {index}", parking_spaces=8)
+            create_parking_lot_monitor(parking_lot, f"Monitor {index}", free_parking_spaces=index % 8)
+
+    def test_annotations_match_per_lot_queries(self):
+        """The annotated values are the ones the per-lot monitor queries return."""
+        self.create_lots(3)
+        ParkingLot.objects.create(name="No Monitor", address="Nowhere", hours="24/7", latitude=0,
+                                  longitude=0, parking_spaces=0, owner=self.owner)
+        for annotated in ParkingLot.objects.with_availability():
+            parking_lot = ParkingLot.objects.get(pk=annotated.pk)
+            if parking_lot.parking_spaces:
+                self.assertEqual(annotated.get_probability_parking_available(),
+                                 parking_lot.get_probability_parking_available())
+            else:
+                self.assertEqual(annotated.get_probability_parking_available(), 0)
+            self.assertEqual(annotated.get_free_parking_spaces(), parking_lot.get_free_parking_spaces())
+            self.assertEqual(annotated.get_date_time_last_updated(), parking_lot.get_date_time_last_updated())
+
+    @override_settings(**STUB_GEOCODER_SETTINGS)
+    def test_parking_lots_page_query_count_is_fixed(self):
+        """The parking lots page runs the same number of queries for 5 and 50 lots."""
+        cache.clear()
+        self.create_lots(5)
+        # Geocode once, later requests are served from the cache
+        self.client.get(reverse("parking-lots"), {"location": "Islamabad"})
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("parking-lots"), {"location": "Islamabad", "page_size": 100})
+        self.assertContains(response, "Lot 4")
+
+        self.create_lots(45)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("parking-lots"), {"location": "Islamabad", "page_size": 100})
+        self.assertContains(response, "Lot 49")
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class ProximitySearchTestCase(TestCase):
+    """Proximity search test cases."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        # Roughly 0, 1.1, 5.6, 11 and 55 km north of the search point
+        for name, latitude in [("Far", 34.18), ("Near", 33.69), ("Here", 33.68), ("Mid", 33.73), ("Edge", 33.78)]:
+            create_parking_lot(owner, name, latitude=latitude, longitude=73.0)
+
+    def test_results_are_within_radius_and_sorted(self):
+        """Only lots inside the radius are returned, nearest first, with their distance."""
+        page = find_nearby(ParkingLot.objects.all(), 33.68, 73.0, radius_km=12)
+        self.assertEqual([lot.name for lot in page.object_list], ["Here", "Near", "Mid", "Edge"])
+        self.assertAlmostEqual(page.object_list[1].distance, 1.11, places=2)
+
+    def test_pagination(self):
+        """Pages hold page_size lots and continue where the previous page stopped."""
+        page = find_nearby(ParkingLot.objects.all(), 33.68, 73.0, radius_km=100, page_size=2, page_number=3)
+        self.assertEqual([lot.name for lot in page.object_list], ["Far"])
+        self.assertEqual(page.paginator.count, 5)
+
+    def test_invalid_search_parameters_fall_back_to_defaults(self):
+        """Unparsable or non-finite radiuses and page sizes are replaced by the defaults."""
+        for radius in ["nan", "inf", "-inf", "far"]:
+            self.assertEqual(parse_search_parameters({"radius": radius})[0], DEFAULT_RADIUS_KM)
+        self.assertEqual(parse_search_parameters({"page_size": "inf"})[1], DEFAULT_PAGE_SIZE)
+        for parking_lot in ParkingLot.objects.all():
+            create_parking_lot_monitor(parking_lot, f"{parking_lot.name} Monitor")
+        response = self.client.post(reverse("parking-lot-monitors"),
+                                    {"latitude": 33.68, "longitude": 73.0, "radius": "nan"})
+        self.assertEqual([monitor.name for monitor in response.context["parking_lot_monitors"]],
+                         ["Here Monitor", "Near Monitor", "Mid Monitor"])
+
+    def test_parking_lot_monitors_are_sorted_without_geodesic(self):
+        """The monitors search returns the nearest monitors first and renders without geodesic math."""
+        for parking_lot in ParkingLot.objects.all():
+            create_parking_lot_monitor(parking_lot, f"{parking_lot.name} Monitor")
+        with mock.patch("vehiscanWebsite.models.geodesic") as geodesic:
+            response = self.client.post(reverse("parking-lot-monitors"),
+                                        {"latitude": 33.68, "longitude": 73.0, "radius": 12})
+        geodesic.assert_not_called()
+        self.assertEqual([monitor.name for monitor in response.context["parking_lot_monitors"]],
+                         ["Here Monitor", "Near Monitor", "Mid Monitor", "Edge Monitor"])
+        self.assertContains(response, "1.11 km")
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class RankedSearchTestCase(TestCase):
+    """Ranked parking lot search test cases."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        # About 0, 1.1 and 2.2 km north of the search point, and 55 km away
+        self.full = create_parking_lot(owner, "Full", latitude=33.68, longitude=73.0, base_price_per_hour=50)
+        self.open = create_parking_lot(owner, "Open", latitude=33.69, longitude=73.0, base_price_per_hour=200)
+        self.free = create_parking_lot(owner, "Free", latitude=33.70, longitude=73.0, isPaidParking=False)
+        create_parking_lot(owner, "Far", latitude=34.18, longitude=73.0)
+        create_parking_lot_monitor(self.open, "Open Monitor", free_parking_spaces=10)
+        create_parking_lot_monitor(self.free, "Free Monitor", free_parking_spaces=5)
+
+    def rank(self, ranking, **kwargs):
+        _, weights, lot_filter = parse_ranking({"filter": ranking})
+        page = rank_nearby(ParkingLot.objects.filter(lot_filter), 33.68, 73.0, radius_km=12, weights=weights, **kwargs)
+        return [parking_lot.name for parking_lot in page.object_list]
+
+    def test_rankings_weigh_distance_availability_and_price(self):
+        """Each ranking orders the lots within the radius by its own weights."""
+        self.assertEqual(self.rank("nearest"), ["Full", "Open", "Free"])
+        self.assertEqual(self.rank("available"), ["Open", "Free", "Full"])
+        self.assertEqual(self.rank("cheapest"), ["Free", "Full", "Open"])
+        self.assertEqual(self.rank("paid"), ["Open", "Full"])
+        page = rank_nearby(ParkingLot.objects.all(), 33.68, 73.0, radius_km=12, page_size=1)
+        self.assertAlmostEqual(page.object_list[0].distance, 1.11, places=2)
+        self.assertEqual(page.paginator.count, 3)
+
+    def test_forecasts_rank_later_stays(self):
+        """A later stay is ranked by the forecast of its hours, the current availability otherwise."""
+        start_time = datetime(2026, 1, 5, 8, 0, tzinfo=dt_timezone.utc)
+        AvailabilityForecast.objects.create(parking_lot=self.full, hour_of_week=hour_of_week(start_time),
+                                            free_parking_spaces=10, free_ratio=1.0, observations=4)
+        self.assertEqual(self.rank("available", forecast_window=(start_time, 1))[0], "Full")
+        self.assertEqual(self.rank("available", forecast_window=(start_time + timedelta(hours=2), 1))[0], "Open")
+
+    @override_settings(**STUB_GEOCODER_SETTINGS)
+    def test_parking_lots_page_is_ranked(self):
+        """The search page ranks the lots by the chosen filter in two queries."""
+        cache.clear()
+        self.client.get(reverse("parking-lots"), {"location": "Islamabad"})
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("parking-lots"), {"location": "Islamabad", "filter": "available",
+                                                                 "radius": 100})
+        self.assertEqual(response.context["ranking"], "available")
+        self.assertEqual(response.context["page_obj"].paginator.count, 4)
+
+
+@override_settings(**STUB_GEOCODER_SETTINGS)
+class GeocodingTestCase(TestCase):
+    """Caching geocoder test cases."""
+
+    def setUp(self):
+        cache.clear()
+        self.geocoder = CachingGeocoder(StubGeocoder())
+
+    def test_normalized_queries_share_one_lookup(self):
+        """Queries differing in case and spacing are geocoded once."""
+        location = self.geocoder.geocode("Islamabad")
+        self.assertEqual((location.latitude, location.longitude), (33.6844, 73.0479))
+        self.assertEqual(self.geocoder.geocode("  ISLAMABAD "), location)
+        self.assertEqual(self.geocoder.backend.calls, 1)
+        self.assertEqual(self.geocoder.cache_hits, 1)
+
+    def test_persistent_table_survives_cache_loss(self):
+        """Cached places are read back from the database after the cache is cleared."""
+        self.geocoder.geocode("Islamabad")
+        cache.clear()
+        self.assertIsNotNone(self.geocoder.geocode("Islamabad"))
+        self.assertEqual(self.geocoder.backend.calls, 1)
+        self.assertEqual(self.geocoder.database_hits, 1)
+
+    def test_unknown_queries_are_negatively_cached(self):
+        """A query the backend cannot resolve is not looked up again until its entry expires."""
+        self.assertIsNone(self.geocoder.geocode("Atlantis"))
+        cache.clear()
+        self.assertIsNone(self.geocoder.geocode("Atlantis"))
+        self.assertEqual(self.geocoder.backend.calls, 1)
+        self.assertFalse(GeocodedPlace.objects.get(query="atlantis").is_found())
+
+        GeocodedPlace.objects.filter(query="atlantis").update(time_stamp="2000-01-01T00:00:00Z")
+        cache.clear()
+        self.geocoder.geocode("Atlantis")
+        self.assertEqual(self.geocoder.backend.calls, 2)
+
+    def test_concurrent_identical_queries_are_coalesced(self):
+        """Callers arriving while a lookup is in flight share its result."""
+        coalescer = RequestCoalescer()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalescer.run("key", lookup)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(coalescer.run("key", lookup)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while coalescer.coalesced < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(**STUB_GEOCODER_SETTINGS)
+class PlaceIndexTestCase(TestCase):
+    """Local place index test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Centaurus Parking", latitude=33.7077, longitude=73.0498,
+                                              address="Jinnah Avenue, Blue Area")
+        self.place_index = get_place_index()
+        self.geocoder = CachingGeocoder(StubGeocoder(), place_index=self.place_index)
+
+    def test_lot_names_and_addresses_resolve_locally(self):
+        """Searches for a lot's name or address are resolved without the backend."""
+        for query in ["centaurus parking", "Jinnah Avenue Blue Area", "jinnah ave, blue area"]:
+            location = self.geocoder.geocode(query)
+            self.assertEqual((location.latitude, location.longitude), (33.7077, 73.0498), query)
+        self.assertEqual(self.geocoder.backend.calls, 0)
+
+    def test_partial_matches_fall_back_to_the_backend(self):
+        """A query covering a small part of an address is not resolved to that lot."""
+        self.assertIsNone(self.place_index.search("Avenue"))
+        self.assertEqual(self.geocoder.geocode("Islamabad").latitude, 33.6844)
+        self.assertEqual(self.geocoder.backend.calls, 1)
+
+    def test_index_follows_edits(self):
+        """Geocoded places are indexed, renamed and deleted lots are updated in the index."""
+        self.geocoder.geocode("Islamabad")
+        self.assertEqual(self.place_index.search("islamabad").latitude, 33.6844)
+
+        self.parking_lot.name = "Saudi Pak Tower Parking"
+        self.parking_lot.save()
+        self.assertIsNone(self.place_index.search("centaurus parking"))
+        self.assertIsNotNone(self.place_index.search("saudi pak tower parking"))
+        self.parking_lot.delete()
+        self.assertIsNone(self.place_index.search("saudi pak tower parking"))
+
+    def test_rebuild_and_stats(self):
+        """The index can be rebuilt from the source tables and reports its hit rate."""
+        ParkingLot.objects.filter(pk=self.parking_lot.pk).update(name="Renamed Parking")
+        self.assertEqual(self.place_index.rebuild(), 1)
+        searches = self.place_index.searches
+        self.assertIsNotNone(self.place_index.search("renamed parking"))
+        self.assertIsNone(self.place_index.search("nowhere"))
+        self.assertEqual(self.place_index.searches - searches, 2)
+        self.assertIn("mean_latency_ms", self.place_index.stats())
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class ParkingLotCountersTestCase(TestCase):
+    """Denormalized availability counter test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Counted Lot", parking_spaces=20)
+        self.other_parking_lot = create_parking_lot(owner, "Other Lot", parking_spaces=20)
+        self.monitors = [create_parking_lot_monitor(self.parking_lot, f"Counted Monitor {index}",
+                                                    free_parking_spaces=3)
+                         for index in range(2)]
+        # Each monitor watches half of the lot
+        ParkingLotMonitor.objects.filter(parkingLot=self.parking_lot).update(total_parking_spaces=10)
+        ParkingLot.objects.recount_availability()
+        for monitor in self.monitors:
+            monitor.refresh_from_db()
+
+    def counters(self, parking_lot):
+        parking_lot.refresh_from_db()
+        return parking_lot.free_parking_spaces, parking_lot.monitored_parking_spaces
+
+    def test_counters_sum_every_monitor(self):
+        """Reports, moves and deletions of monitors are added to the counters of their lots."""
+        self.assertEqual(self.counters(self.parking_lot), (6, 20))
+        # A stale instance of the monitor still adds the right change
+        stale = ParkingLotMonitor.objects.get(pk=self.monitors[0].pk)
+        self.monitors[0].update_availability(5, 90)
+        stale.free_parking_spaces = 4
+        stale.save(update_fields=["free_parking_spaces", "dateTimeLastUpdated"])
+        self.assertEqual(self.counters(self.parking_lot), (7, 20))
+        self.assertEqual(self.parking_lot.get_probability_parking_available(), 35)
+        self.assertEqual(self.parking_lot.get_date_time_last_updated(), stale.dateTimeLastUpdated)
+
+        monitor = ParkingLotMonitor.objects.get(pk=self.monitors[1].pk)
+        monitor.parkingLot = self.other_parking_lot
+        monitor.save()
+        self.assertEqual(self.counters(self.parking_lot), (4, 10))
+        self.assertEqual(self.counters(self.other_parking_lot), (3, 10))
+        monitor.delete()
+        self.assertEqual(self.counters(self.other_parking_lot), (0, 0))
+
+    def test_lot_saves_keep_the_counters(self):
+        """Saving a lot loaded before a report does not overwrite its counters."""
+        parking_lot = ParkingLot.objects.get(pk=self.parking_lot.pk)
+        self.monitors[0].update_availability(9, 90)
+        parking_lot.hours = "8-20"
+        parking_lot.save()
+        self.assertEqual(self.counters(self.parking_lot), (12, 20))
+        self.assertEqual(self.parking_lot.hours, "8-20")
+
+    def test_recount_repairs_queryset_updates(self):
+        """Counters drifted by queryset updates are recomputed from the monitors."""
+        ParkingLotMonitor.objects.filter(parkingLot=self.parking_lot).update(free_parking_spaces=1)
+        self.assertEqual(self.counters(self.parking_lot), (6, 20))
+        self.assertEqual(ParkingLot.objects.recount_availability(), 2)
+        self.assertEqual(self.counters(self.parking_lot), (2, 20))
+        self.assertEqual(self.counters(self.other_parking_lot), (0, 0))
+
+    def test_availability_ordering_is_single_table(self):
+        """Lots are sorted by availability without joining their monitors."""
+        with self.assertNumQueries(1) as queries:
+            parking_lots = list(ParkingLot.objects.with_availability().order_by("-free_parking_spaces"))
+        self.assertNotIn("JOIN", queries.captured_queries[0]["sql"])
+        self.assertEqual([parking_lot.name for parking_lot in parking_lots], ["Counted Lot", "Other Lot"])
+        rows = self.client.get("/api-auth/parking-lots/sync/", {"ordering": "available"}).json()["results"]
+        self.assertEqual([row["free_parking_spaces"] for row in rows], [6, 0])
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS, **STUB_GEOCODER_SETTINGS)
+class FragmentCacheTestCase(TestCase):
+    """Cached lot card and monitor row test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Cached Card Lot", parking_spaces=8)
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Cached Card Monitor", free_parking_spaces=2)
+
+    def test_lot_cards_follow_availability_and_edits(self):
+        """Cards are served from the cache until the lot or its availability changes."""
+        self.assertContains(self.client.get(reverse("parking-lots")), "2/8 Spaces")
+        with mock.patch("vehiscanWebsite.models.ParkingLot.get_free_parking_spaces") as get_free_parking_spaces:
+            response = self.client.get(reverse("parking-lots"))
+        get_free_parking_spaces.assert_not_called()
+        self.assertContains(response, "2/8 Spaces")
+
+        self.monitor.update_availability(5, 90)
+        self.assertContains(self.client.get(reverse("parking-lots")), "5/8 Spaces")
+        self.parking_lot.refresh_from_db()
+        self.parking_lot.hours = "9-17"
+        self.parking_lot.save()
+        self.assertContains(self.client.get(reverse("parking-lots")), "9-17")
+        self.monitor.delete()
+        self.assertContains(self.client.get(reverse("parking-lots")), "0/8 Spaces")
+
+    def test_cached_cards_keep_the_search_distance(self):
+        """The distance of a cached card is the one of the current search."""
+        self.client.get(reverse("parking-lots"))
+        response = self.client.get(reverse("parking-lots"), {"location": "Islamabad"})
+        self.assertContains(response, "0.0km")
+
+    def test_cached_fragments_are_well_formed(self):
+        """Every cached fragment closes the elements it opens, so fragments cached apart still fit together."""
+        self.client.get(reverse("parking-lots"))
+        lot = ParkingLot.objects.get(pk=self.parking_lot.pk)
+        vary_on = [lot.pk, lot.updated_at, lot.availability_updated_at, lot.free_parking_spaces]
+        media = cache.get(make_template_fragment_key("lot-card-media", [*vary_on, derivative_url(lot.image, "medium", "jpeg")]))
+        details = cache.get(make_template_fragment_key("lot-card-details", vary_on))
+        for fragment in (media, details):
+            self.assertIsNotNone(fragment)
+            self.assertEqual(fragment.count("<div"), fragment.count("</div>"))
+
+    def test_empty_update_fields_are_not_saved(self):
+        """An empty update_fields list stays a no-op."""
+        self.parking_lot.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.parking_lot.save(update_fields=[])
+
+    def test_monitor_rows_follow_reports(self):
+        """Monitor rows are rendered again once the monitor reports."""
+        self.monitor.probabilityParkingAvailable = Decimal("0.25")
+        self.monitor.save()
+        self.assertContains(self.client.get(reverse("parking-lot-monitors")), "25%")
+        self.monitor.probabilityParkingAvailable = Decimal("0.75")
+        self.monitor.save()
+        self.assertContains(self.client.get(reverse("parking-lot-monitors")), "75%")
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class AvailabilityCacheTestCase(TestCase):
+    """Availability cache test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Cached Lot", parking_spaces=8)
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Cached Monitor", free_parking_spaces=2)
+
+    def test_monitor_writes_bump_the_fleet_version(self):
+        """Committed monitor updates bump the fleet version, the next snapshot is read once."""
+        version, _ = get_fleet_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.monitor.update_availability(6, 90)
+        with self.assertNumQueries(1):
+            new_version, fleet = get_fleet_snapshot()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_fleet_snapshot(), (new_version, fleet))
+        self.assertEqual(fleet[self.parking_lot.pk]["free_parking_spaces"], 6)
+        self.assertEqual(fleet[self.parking_lot.pk]["probability_parking_available"], 75)
+        self.assertGreater(new_version, version)
+
+    def test_uncommitted_writes_are_not_cached(self):
+        """The cache only changes once the transaction commits, rolled back updates never show."""
+        version, _ = get_fleet_snapshot()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.monitor.update_availability(6, 90)
+                    self.assertEqual(get_fleet_snapshot(), (version, mock.ANY))
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        new_version, fleet = get_fleet_snapshot()
+        self.assertEqual(new_version, version)
+        self.assertEqual(fleet[self.parking_lot.pk]["free_parking_spaces"], 2)
+
+    def test_stale_snapshots_are_not_carried_forward(self):
+        """A change never copies the cached snapshot into the next version, whatever it holds."""
+        version, fleet = get_fleet_snapshot()
+        # As left by a concurrent writer that started from an older snapshot
+        stale = {**fleet, self.parking_lot.pk: {**fleet[self.parking_lot.pk], "free_parking_spaces": 0}}
+        cache.set(f"{FLEET_KEY_PREFIX}{version}", stale)
+        invalidate_fleet_snapshot()
+        new_version, fleet = get_fleet_snapshot()
+        self.assertGreater(new_version, version)
+        self.assertEqual(fleet[self.parking_lot.pk]["free_parking_spaces"], 2)
+
+    def test_lot_methods_read_the_cache(self):
+        """Lots loaded without annotations read their availability from their own counters."""
+        parking_lot = ParkingLot.objects.get(pk=self.parking_lot.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(parking_lot.get_free_parking_spaces(), 2)
+            self.assertEqual(parking_lot.get_probability_parking_available(), 25)
+            self.assertEqual(parking_lot.get_date_time_last_updated(), self.monitor.dateTimeLastUpdated)
+
+    def test_deleted_lots_leave_the_fleet_snapshot(self):
+        """Deleting a lot removes it from the fleet snapshot."""
+        self.assertIn(self.parking_lot.pk, get_fleet_snapshot()[1])
+        parking_lot_id = self.parking_lot.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parking_lot.delete()
+        self.assertNotIn(parking_lot_id, get_fleet_snapshot()[1])
+
+    def test_api_serves_cached_availability(self):
+        """The parking lots API includes the availability counters of the lots."""
+        response = self.client.get("/api-auth/parking-lots/")
+        self.assertEqual(response.json()["results"][0]["free_parking_spaces"], 2)
+
+
+@override_settings(AVAILABILITY_STREAM_POLL_SECONDS=60, **SYNCHRONOUS_LOG_SETTINGS)
+class AvailabilityStreamTestCase(TestCase):
+    """Server-sent availability events test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Streamed Lot", parking_spaces=8)
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Streamed Monitor", free_parking_spaces=2)
+        self.url = f"{reverse('availability-stream')}?lots={self.parking_lot.pk}"
+
+    def test_deltas_only_reach_subscribed_regions(self):
+        """A change is sent to the subscribers whose region contains the lot, and only to them."""
+        hub = AvailabilityHub()
+        inside = Subscription(Region(33.0, 73.0, 34.0, 74.0), max_queued=10)
+        outside = Subscription(Region(parking_lot_ids=frozenset([self.parking_lot.pk + 1])), max_queued=10)
+        hub.subscribers.update([inside, outside])
+        entry = get_fleet_snapshot()[1][self.parking_lot.pk]
+        hub.publish(2, [entry], [])
+        self.assertIn(b"event: delta", inside.queue.get_nowait())
+        self.assertTrue(outside.queue.empty())
+
+    def test_slow_subscribers_are_asked_to_resync(self):
+        """A subscriber whose queue overflows gets a single resync event instead of the backlog."""
+        subscription = Subscription(Region(), max_queued=2)
+        for version in range(3):
+            subscription.push(f"event {version}".encode())
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertIn(b"event: resync", subscription.queue.get_nowait())
+
+    async def test_stream_pushes_monitor_updates(self):
+        """Over ASGI the stream sends the lot's snapshot, then its change when a monitor update lands."""
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        self.assertIn(b'"free_parking_spaces": 2', await anext(events))
+
+        # The commit wakes the hub up, long before its next poll
+        def update_availability():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.monitor.update_availability(6, 90)
+        await sync_to_async(update_availability)()
+        delta = await asyncio.wait_for(anext(events), 5)
+        self.assertIn(b"event: delta", delta)
+        self.assertIn(b'"free_parking_spaces": 6', delta)
+        self.assertEqual(len(get_hub().subscribers), 1)
+        await events.aclose()
+
+    def test_wsgi_clients_poll(self):
+        """Without ASGI the view sends the snapshot with a retry delay instead of holding a worker."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b"retry: "))
+        self.assertIn(b"event: snapshot", response.content)
+        self.assertEqual(self.client.get(reverse("availability-stream") + "?bbox=1,2").status_code, 400)
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class MonitorSnapshotApiTestCase(TestCase):
+    """Compact availability snapshot and conditional GET test cases."""
+
+    url = "/api-auth/parking-lot-monitors/availability/"
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        parking_lot = create_parking_lot(owner, "Polled Lot", parking_spaces=8)
+        self.first = create_parking_lot_monitor(parking_lot, "First Monitor", free_parking_spaces=2)
+        self.second = create_parking_lot_monitor(parking_lot, "Second Monitor", free_parking_spaces=5)
+
+    def test_sparse_fields(self):
+        """The snapshot holds one array of the requested fields per monitor."""
+        snapshot = self.client.get(self.url, {"fields": "id,free_parking_spaces"}).json()
+        self.assertEqual(snapshot["fields"], ["id", "free_parking_spaces"])
+        self.assertEqual(snapshot["monitors"], [[self.first.pk, 2], [self.second.pk, 5]])
+        self.assertEqual(snapshot["count"], 2)
+        self.assertEqual(self.client.get(self.url, {"fields": "id,password"}).status_code, 400)
+
+    def test_unchanged_snapshots_are_not_modified(self):
+        """A poller presenting the current ETag gets a 304 until a monitor is updated."""
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.second.update_availability(4, 90)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_since_returns_updated_monitors(self):
+        """With since only the monitors updated after the previous snapshot are returned."""
+        last_updated = self.client.get(self.url).json()["last_updated"]
+        self.second.update_availability(4, 90)
+        snapshot = self.client.get(self.url, {"since": last_updated, "fields": "id,free_parking_spaces"}).json()
+        self.assertEqual(snapshot["monitors"], [[self.second.pk, 4]])
+
+    def test_parking_lot_pages_are_conditional(self):
+        """Parking lot pages are versioned by the lot rows, whatever the cache of the worker holds."""
+        etag = self.client.get("/api-auth/parking-lots/")["ETag"]
+        cache.clear()
+        self.assertEqual(self.client.get("/api-auth/parking-lots/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.first.update_availability(3, 90)
+        response = self.client.get("/api-auth/parking-lots/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        parking_lot = self.first.parkingLot
+        parking_lot.name = "Renamed Lot"
+        parking_lot.save()
+        self.assertEqual(self.client.get("/api-auth/parking-lots/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+
+    def test_parking_lot_pages_follow_removed_monitors(self):
+        """Deleting a monitor or moving it to another lot changes the parking lot pages."""
+        etag = self.client.get("/api-auth/parking-lots/")["ETag"]
+        self.second.delete()
+        response = self.client.get("/api-auth/parking-lots/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["free_parking_spaces"], 2)
+
+        other_lot = create_parking_lot(self.first.parkingLot.owner, "Other Lot", parking_spaces=8)
+        etag = self.client.get("/api-auth/parking-lots/")["ETag"]
+        self.first.parkingLot = other_lot
+        self.first.save(update_fields=["parkingLot"])
+        self.assertEqual(self.client.get("/api-auth/parking-lots/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class BulkSyncApiTestCase(TestCase):
+    """Bulk sync mode test cases."""
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Synced Lot", parking_spaces=8)
+        self.monitors = [create_parking_lot_monitor(self.parking_lot, f"Synced Monitor {index}", free_parking_spaces=index)
+                         for index in range(5)]
+
+    def walk(self, url, params):
+        rows, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            body = response.json()
+            rows += body["results"]
+            pages += 1
+            if not body["next"]:
+                return rows, pages
+            with self.assertNumQueries(1):
+                response = self.client.get(body["next"])
+
+    def test_cursor_pages_cover_every_monitor(self):
+        """Walking the cursor pages returns every monitor once, one query per page."""
+        rows, pages = self.walk("/api-auth/parking-lot-monitors/sync/",
+                                {"page_size": 2, "fields": "id,free_parking_spaces,parking_lot_name"})
+        self.assertEqual(pages, 3)
+        self.assertEqual([row["id"] for row in rows], [monitor.pk for monitor in self.monitors])
+        self.assertEqual(rows[0], {"id": self.monitors[0].pk, "free_parking_spaces": 0, "parking_lot_name": "Synced Lot"})
+
+    def test_updated_ordering_follows_changes(self):
+        """With the updated ordering the monitor updated last comes last."""
+        self.monitors[0].update_availability(7, 90)
+        rows, _ = self.walk("/api-auth/parking-lot-monitors/sync/", {"ordering": "updated", "page_size": 2})
+        self.assertEqual(rows[-1]["id"], self.monitors[0].pk)
+        self.assertEqual(rows[-1]["free_parking_spaces"], 7)
+        self.assertEqual(self.client.get("/api-auth/parking-lots/sync/", {"ordering": "price"}).status_code, 400)
+
+    def test_updated_ordering_pages_across_unmonitored_lots(self):
+        """Lots without monitors have no availability time, they are ordered by their last edit."""
+        owner = self.parking_lot.owner
+        unmonitored = [create_parking_lot(owner, f"Unmonitored Lot {index}") for index in range(2)]
+        rows, pages = self.walk("/api-auth/parking-lots/sync/", {"ordering": "updated", "page_size": 1, "fields": "id"})
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(row["id"] for row in rows), sorted([self.parking_lot.pk, *(lot.pk for lot in unmonitored)]))
+        self.assertEqual(rows[-1]["id"], unmonitored[-1].pk)
+
+    def test_lot_rows_include_availability(self):
+        """Lot rows carry the availability summed over their monitors."""
+        rows = self.client.get("/api-auth/parking-lots/sync/").json()["results"]
+        self.assertEqual(rows[0]["free_parking_spaces"], 10)
+        self.assertEqual(rows[0]["name"], "Synced Lot")
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class MapTilesTestCase(TestCase):
+    """Map viewport markers and clusters test cases."""
+
+    url = "/api-auth/parking-lots/map/"
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lots = [create_parking_lot(owner, f"Mapped Lot {index}", latitude=33.70 + index * 0.001,
+                                                longitude=73.05, parking_spaces=10) for index in range(3)]
+        create_parking_lot_monitor(self.parking_lots[0], "Mapped Monitor", free_parking_spaces=4)
+
+    def test_lots_keep_their_geohash(self):
+        """Saving a lot stores the geohash of its coordinates."""
+        self.assertEqual(self.parking_lots[0].geohash[:5], "ttgzw")
+        parking_lot = ParkingLot.objects.get(pk=self.parking_lots[0].pk)
+        parking_lot.latitude = Decimal("51.5")
+        parking_lot.longitude = Decimal("-0.12")
+        parking_lot.save(update_fields=["latitude", "longitude"])
+        parking_lot.refresh_from_db()
+        self.assertEqual(parking_lot.geohash[:5], "gcpuv")
+
+    def test_zoomed_in_viewports_list_markers(self):
+        """Zoomed in, the visible lots are returned as markers with their availability."""
+        viewport = self.client.get(self.url, {"bbox": "33.69,73.04,33.71,73.06", "zoom": 15}).json()
+        self.assertEqual(len(viewport["markers"]), 3)
+        self.assertEqual(viewport["clusters"], [])
+        self.assertEqual(viewport["markers"][0]["free_parking_spaces"], 4)
+        viewport = self.client.get(self.url, {"bbox": "40,10,41,11", "zoom": 10}).json()
+        self.assertEqual(viewport["markers"], [])
+
+    def test_busy_zoomed_out_tiles_are_clustered_and_cached(self):
+        """Tiles with more lots than markers are clustered, then served from the cache."""
+        parameters = {"bbox": "33,72,34,74", "zoom": 5}
+        with mock.patch("vehiscanWebsite.map_tiles.TILE_MAX_MARKERS", 2):
+            viewport = self.client.get(self.url, parameters).json()
+        self.assertEqual(viewport["markers"], [])
+        self.assertEqual([(cluster["count"], cluster["free_parking_spaces"], cluster["parking_spaces"])
+                          for cluster in viewport["clusters"]], [(3, 4, 30)])
+        with self.assertNumQueries(0):
+            self.client.get(self.url, parameters)
+
+    def test_invalid_viewports_are_rejected(self):
+        """Malformed bounding boxes and viewports spanning too many tiles are rejected."""
+        self.assertEqual(self.client.get(self.url, {"bbox": "1,2", "zoom": 5}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"bbox": "-80,-170,80,170", "zoom": 12}).status_code, 400)
+
+
+class ParkingLotLogWriterTestCase(TestCase):
+    """Write-behind log batching test cases."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Logged Lot", parking_spaces=8)
+
+    def test_only_changed_counts_are_logged(self):
+        """Saves that do not change the free count are not logged."""
+        with override_settings(**SYNCHRONOUS_LOG_SETTINGS):
+            monitor = create_parking_lot_monitor(self.parking_lot, "Logged Monitor", free_parking_spaces=2)
+            monitor = ParkingLotMonitor.objects.get(pk=monitor.pk)
+            monitor.name = "Renamed Monitor"
+            monitor.save()
+            monitor.update_availability(5, 80)
+            monitor.update()
+        self.assertEqual(list(ParkingLotLog.objects.values_list("free_parking_spaces", flat=True)), [2, 5])
+
+    def test_rows_are_inserted_in_batches(self):
+        """Rows wait in the buffer until the batch is full, then are inserted in one query."""
+        with override_settings(**SYNCHRONOUS_LOG_SETTINGS):
+            monitor = create_parking_lot_monitor(self.parking_lot, "Batched Monitor")
+        writer = BufferedWriter(ParkingLotLog, max_size=3, max_delay_seconds=3600)
+        self.addCleanup(writer.close)
+        for count in range(2):
+            writer.add(ParkingLotLog(parking_lot=self.parking_lot, logged_by_monitor=monitor,
+                                     free_parking_spaces=count))
+        self.assertEqual(writer.pending(), 2)
+        with self.assertNumQueries(1):
+            writer.add(ParkingLotLog(parking_lot=self.parking_lot, logged_by_monitor=monitor,
+                                     free_parking_spaces=2))
+        self.assertEqual(ParkingLotLog.objects.filter(logged_by_monitor=monitor).count(), 4)
+        self.assertEqual(writer.stats()["last_flush_size"], 3)
+
+    def test_background_writers_bound_their_queue(self):
+        """A background writer never inserts in the caller, and drops rows beyond its queue bound."""
+        writer = BufferedWriter(ParkingRequestLog, max_size=2, max_delay_seconds=3600, max_pending=2,
+                                flush_in_background=True)
+        self.addCleanup(writer.close)
+        # The flush thread would insert through its own connection, outside the test transaction
+        with mock.patch.object(writer, "_start_thread"), self.assertNumQueries(0):
+            for _ in range(3):
+                writer.add(ParkingRequestLog(area_of_interest_latitude=1, area_of_interest_longitude=2))
+        self.assertTrue(writer._wakeup.is_set())
+        self.assertEqual((writer.stats()["pending"], writer.stats()["dropped_rows"]), (2, 1))
+
+    @override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+    def test_searches_log_the_requesting_user(self):
+        """Monitor searches are logged with the signed in user, without looking it up again."""
+        user = User.objects.create_user(username="driver", password="Letmein1$")
+        self.client.force_login(user)
+        self.client.post(reverse("parking-lot-monitors"), {"latitude": 33.68, "longitude": 73.04})
+        self.assertEqual(ParkingRequestLog.objects.get().user, user)
+
+    def test_writer_stats_are_staff_only(self):
+        """Queue depths and drop counters are exposed to staff."""
+        url = reverse("log-writer-stats")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user(username="staff", password="Letmein1$", is_staff=True))
+        with override_settings(**SYNCHRONOUS_LOG_SETTINGS):
+            get_writer(ParkingRequestLog, "PARKING_REQUEST_LOG")
+            self.assertIn("dropped_rows", self.client.get(url).json()["ParkingRequestLog"])
+
+    def test_close_flushes_pending_rows(self):
+        """Rows still buffered are inserted when the writer is closed."""
+        with override_settings(**SYNCHRONOUS_LOG_SETTINGS):
+            monitor = create_parking_lot_monitor(self.parking_lot, "Closed Monitor")
+        writer = BufferedWriter(ParkingLotLog, max_size=100, max_delay_seconds=3600)
+        writer.add(ParkingLotLog(parking_lot=self.parking_lot, logged_by_monitor=monitor, free_parking_spaces=7))
+        writer.close()
+        self.assertTrue(ParkingLotLog.objects.filter(free_parking_spaces=7).exists())
+        self.assertEqual(writer.stats()["flushed_rows"], 1)
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS)
+class ParkingLotLogRollupTestCase(TestCase):
+    """Log rollup and retention test cases."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Rolled Lot", parking_spaces=8)
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Rolled Monitor")
+        ParkingLotLog.objects.all().delete()
+        self.start = datetime(2026, 1, 5, 8, 0, tzinfo=dt_timezone.utc)
+
+    def log(self, minutes, free_parking_spaces):
+        ParkingLotLog.objects.create(parking_lot=self.parking_lot, logged_by_monitor=self.monitor,
+                                     free_parking_spaces=free_parking_spaces,
+                                     time_stamp=self.start + timedelta(minutes=minutes))
+
+    def test_rollups_are_merged_incrementally(self):
+        """Rows rolled up in several runs give the same buckets as one run."""
+        self.log(0, 2)
+        self.log(0.5, 6)
+        self.log(61, 4)
+        self.assertEqual(roll_up_logs(batch_size=2, settle_seconds=0), 3)
+        self.log(1.5, 1)  # A late row for an hour that was already rolled up
+        self.assertEqual(roll_up_logs(settle_seconds=0), 1)
+        self.assertEqual(roll_up_logs(settle_seconds=0), 0)
+
+        hour = ParkingLotLogHour.objects.get(bucket_start=self.start)
+        self.assertEqual((hour.min_free_parking_spaces, hour.max_free_parking_spaces, hour.sample_count), (1, 6, 3))
+        self.assertEqual(hour.get_average_free_parking_spaces(), 3)
+        self.assertEqual(ParkingLotLogMinute.objects.count(), 3)
+        self.assertEqual(ParkingLotLogDay.objects.get().sample_count, 4)
+
+    def test_only_rolled_up_rows_are_compacted(self):
+        """Raw rows past the retention period are deleted once they are rolled up."""
+        self.log(0, 2)
+        roll_up_logs(settle_seconds=0)
+        self.log(1, 3)
+        raw, minutes = compact_logs(retention_days=1, minute_retention_days=10000, settle_seconds=0)
+        self.assertEqual((raw, minutes), (1, 0))
+        self.assertEqual(list(ParkingLotLog.objects.values_list("free_parking_spaces", flat=True)), [3])
+        self.assertEqual(ParkingLotLogMinute.objects.count(), 1)
+
+    def test_unsettled_rows_hold_the_high_water_mark(self):
+        """Rows are rolled up and compacted once settled, never past a row that is not."""
+        for minutes in range(3):
+            self.log(minutes, minutes)
+        first, second, third = ParkingLotLog.objects.order_by("id")
+        ParkingLotLog.objects.filter(pk__in=[first.pk, third.pk]).update(logged_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(roll_up_logs(), 1)
+        self.assertEqual(RollupProgress.objects.get(name=ROLLUP_PROGRESS_NAME).last_id, first.pk)
+        self.assertEqual(compact_logs(retention_days=1, minute_retention_days=10000), (1, 0))
+
+        ParkingLotLog.objects.filter(pk=second.pk).update(logged_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(roll_up_logs(), 2)
+        self.assertEqual(ParkingLotLogMinute.objects.count(), 3)
+
+    def test_history_ranges_are_aligned_to_the_resolution(self):
+        """Unaligned ranges are widened to whole buckets, so no rollup bucket is cut or split."""
+        self.log(10, 2)
+        self.log(50, 4)
+        self.log(70, 6)
+        roll_up_logs(settle_seconds=0)
+        series = occupancy_series(self.start + timedelta(minutes=20), self.start + timedelta(minutes=65), 3600,
+                                  parking_lot_id=self.parking_lot.pk)
+        self.assertEqual(series["start"], self.start.isoformat())
+        self.assertEqual(series["time"], [int(self.start.timestamp()), int(self.start.timestamp()) + 3600])
+        self.assertEqual(series["samples"], [2, 1])
+
+    def test_history_is_cached_for_long_once_rolled_up(self):
+        """Ended ranges are only cached for long once the rollups moved past them."""
+        self.log(0, 2)
+        roll_up_logs(settle_seconds=0)
+        self.assertEqual(cache_max_age(self.start + timedelta(hours=1), 3600), 60)
+        self.log(180, 4)
+        roll_up_logs(settle_seconds=0)
+        self.assertEqual(cache_max_age(self.start + timedelta(hours=1), 3600), 24 * 60 * 60)
+
+    def test_history_endpoints_use_the_coarsest_rollup(self):
+        """History is served in columns from the coarsest rollup fitting the resolution."""
+        for minutes, free_parking_spaces in [(0, 2), (30, 4), (90, 6), (150, 8)]:
+            self.log(minutes, free_parking_spaces)
+        roll_up_logs(settle_seconds=0)
+        parameters = {"start": "2026-01-05T08:00:00+00:00", "end": "2026-01-05T12:00:00+00:00"}
+
+        response = self.client.get(f"/api-auth/parking-lots/{self.parking_lot.pk}/history/",
+                                   {**parameters, "resolution": "2h"})
+        series = response.json()
+        self.assertEqual(series["source"], "hour")
+        # Buckets start at even local hours, 07:00 UTC in Karachi
+        self.assertEqual(series["time"], [int(self.start.timestamp()) - 3600, int(self.start.timestamp()) + 3600])
+        self.assertEqual((series["min"], series["max"], series["avg"], series["samples"]),
+                         ([2, 6], [4, 8], [3.0, 7.0], [2, 2]))
+        # The rollups have not reached the end of the range yet
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+        response = self.client.get(f"/api-auth/parking-lot-monitors/{self.monitor.pk}/history/",
+                                   {**parameters, "resolution": "30m"})
+        self.assertEqual(response.json()["source"], "minute")
+        self.assertEqual(response.json()["avg"], [2.0, 4.0, 6.0, 8.0])
+        response = self.client.get(f"/api-auth/parking-lot-monitors/{self.monitor.pk}/history/",
+                                   {**parameters, "resolution": "30m"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f"/api-auth/parking-lots/{self.parking_lot.pk}/history/",
+                                   {**parameters, "resolution": "1s"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**SYNCHRONOUS_LOG_SETTINGS, **STUB_GEOCODER_SETTINGS)
+class AvailabilityForecastTestCase(TestCase):
+    """Hour-of-week availability forecast test cases."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="Letmein1$").profile
+        self.parking_lot = create_parking_lot(owner, "Forecast Lot", parking_spaces=10)
+        self.monitor = create_parking_lot_monitor(self.parking_lot, "Forecast Monitor")
+        ParkingLotLog.objects.all().delete()
+        self.start = datetime(2026, 1, 5, 8, 0, tzinfo=dt_timezone.utc)
+
+    def log(self, hours, free_parking_spaces):
+        ParkingLotLog.objects.create(parking_lot=self.parking_lot, logged_by_monitor=self.monitor,
+                                     free_parking_spaces=free_parking_spaces,
+                                     time_stamp=self.start + timedelta(hours=hours))
+
+    def test_forecasts_are_smoothed_incrementally(self):
+        """Each run merges the complete hours rolled up since the previous one, newest weeks weighing most."""
+        self.log(0, 2)
+        self.log(7 * 24, 6)
+        self.log(7 * 24 + 1, 8)  # Its hour may still receive rows, it is left for the next run
+        roll_up_logs(settle_seconds=0)
+        self.assertEqual(update_forecasts(), 2)
+        forecast = AvailabilityForecast.objects.get()
+        self.assertEqual(forecast.hour_of_week, hour_of_week(self.start))
+        self.assertAlmostEqual(forecast.free_parking_spaces, 2 + 0.3 * (6 - 2))
+        self.assertEqual((forecast.observations, forecast.get_probability_parking_available()), (2, 32))
+
+        self.assertEqual(update_forecasts(), 0)
+        self.log(7 * 24 + 2, 8)
+        roll_up_logs(settle_seconds=0)
+        self.assertEqual(update_forecasts(), 1)
+        self.assertEqual(AvailabilityForecast.objects.count(), 2)
+
+    def test_search_results_show_the_worst_hour_of_the_stay(self):
+        """Searches for a later time attach the least available forecast hour of the stay in one query."""
+        hour = hour_of_week(self.start)
+        AvailabilityForecast.objects.bulk_create([
+            AvailabilityForecast(parking_lot=self.parking_lot, hour_of_week=hour, free_parking_spaces=6,
+                                 free_ratio=0.6, observations=3),
+            AvailabilityForecast(parking_lot=self.parking_lot, hour_of_week=hour + 1, free_parking_spaces=3,
+                                 free_ratio=0.3, observations=3),
+        ])
+        with self.assertNumQueries(1):
+            parking_lot, = attach_forecasts([self.parking_lot], self.start + timedelta(days=7, minutes=30), 1)
+        self.assertEqual(parking_lot.forecast.free_parking_spaces, 3)
+        self.assertIsNone(attach_forecasts([self.parking_lot], self.start + timedelta(hours=5))[0].forecast)
+
+        response = self.client.get(reverse("parking-lots"), {
+            "location": "Islamabad", "start_time": (self.start + timedelta(days=7)).isoformat(), "duration": "0.5"})
+        self.assertEqual(response.context["parking_lots"][0].forecast.free_parking_spaces, 6)
+        self.assertContains(response, "~6 free")
+
+
+class SearchDemandTestCase(TestCase):
+    """Incremental search demand grid test cases."""
+
+    def setUp(self):
+        self.hour = datetime(2026, 3, 2, 9, tzinfo=dt_timezone.utc)
+
+    def log_search(self, latitude, longitude, minutes=0):
+        ParkingRequestLog.objects.create(area_of_interest_latitude=Decimal(str(latitude)),
+                                         area_of_interest_longitude=Decimal(str(longitude)),
+                                         time_stamp=self.hour + timedelta(minutes=minutes))
+
+    def test_searches_are_counted_once_per_cell_and_hour(self):
+        """Each run only counts the searches logged since the previous one."""
+        self.log_search(33.6844, 73.0479)
+        self.log_search(33.6845, 73.0480, minutes=20)
+        self.log_search(33.6844, 73.0479, minutes=70)
+        self.assertEqual(aggregate_searches(batch_size=2, settle_seconds=0), 3)
+        self.log_search(33.6844, 73.0479, minutes=30)
+        self.assertEqual(aggregate_searches(settle_seconds=0), 1)
+        self.assertEqual(sorted(SearchDemandHour.objects.values_list("search_count", flat=True)), [1, 3])
+
+    def test_unsettled_searches_hold_the_high_water_mark(self):
+        """Searches are only counted once settled, and never past one that is not."""
+        self.log_search(33.6844, 73.0479)
+        self.log_search(33.6844, 73.0479)
+        first, second = ParkingRequestLog.objects.order_by("id")
+        ParkingRequestLog.objects.filter(pk=first.pk).update(logged_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(aggregate_searches(), 1)
+        ParkingRequestLog.objects.filter(pk=second.pk).update(logged_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(aggregate_searches(), 1)
+        self.assertEqual(SearchDemandHour.objects.get().search_count, 2)
+
+    def test_heatmap_of_a_region_and_window(self):
+        """The heatmap sums the hours of the window in the region, over cells of the requested size."""
+        self.log_search(33.6844, 73.0479)
+        self.log_search(33.7000, 73.0600)
+        self.log_search(51.5000, -0.1200)
+        self.log_search(33.6844, 73.0479, minutes=24 * 60)
+        aggregate_searches(settle_seconds=0)
+
+        heatmap = demand_heatmap(self.hour, self.hour + timedelta(hours=1), 33, 72, 34, 74, precision=4)
+        self.assertEqual(heatmap["count"], [2])
+        self.assertEqual(heatmap["geohash"], ["ttgz"])
+        heatmap = demand_heatmap(self.hour, self.hour + timedelta(days=2))
+        self.assertEqual(sum(heatmap["count"]), 4)
+
+    def test_heatmap_endpoint_is_staff_only(self):
+        """The heatmap endpoint serves staff and validates its parameters."""
+        self.log_search(33.6844, 73.0479)
+        aggregate_searches(settle_seconds=0)
+        url = "/api-auth/search-demand/"
+        parameters = {"start": self.hour.isoformat(), "end": (self.hour + timedelta(hours=1)).isoformat()}
+        self.assertEqual(self.client.get(url, parameters).status_code, 403)
+        self.client.force_login(User.objects.create_user(username="staff", password="Letmein1$", is_staff=True))
+        self.assertEqual(self.client.get(url, parameters).json()["count"], [1])
+        self.assertEqual(self.client.get(url, {"precision": 9}).status_code, 400)
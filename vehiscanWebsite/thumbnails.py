@@ -0,0 +1,208 @@
+"""This module contains helpers to store uploaded images as bounded-size thumbnails.
+
+Besides the camera snapshots, every uploaded image gets derivatives: a JPEG and a WebP
+thumbnail per size of ``IMAGE_DERIVATIVE_SIZES``, stored next to the uploads under
+``derivatives/<upload name>/<size>.<extension>``. They are built by a small thread pool,
+off the request thread, when an image is saved (see ``signals.py``) or first asked for by
+``derivative_url``, which serves the original image until they are ready. Built images are
+remembered in the cache, so the pages do not check the storage for every image.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+MONITOR_SNAPSHOT_SIZE = getattr(settings, "MONITOR_SNAPSHOT_SIZE", (640, 360))
+"""The box camera snapshots are fitted into before they are stored."""
+MONITOR_SNAPSHOT_QUALITY = getattr(settings, "MONITOR_SNAPSHOT_QUALITY", 75)
+MONITOR_SNAPSHOT_PREFIX = "snapshot-"
+"""Prefix of stored snapshot file names, so older snapshots can be replaced safely."""
+IMAGE_DERIVATIVE_SIZES = getattr(settings, "IMAGE_DERIVATIVE_SIZES", {
+    "small": (160, 160),
+    "medium": (480, 360),
+    "large": (1280, 960),
+})
+"""The boxes the derivatives of every uploaded image are fitted into, by size name."""
+IMAGE_DERIVATIVE_FORMATS = {"jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+"""The Pillow format and the file extension of every derivative format."""
+IMAGE_DERIVATIVE_QUALITY = getattr(settings, "IMAGE_DERIVATIVE_QUALITY", 80)
+IMAGE_DERIVATIVE_WORKERS = getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2)
+DERIVATIVE_DIRECTORY = "derivatives"
+DERIVATIVE_KEY_PREFIX = "image:derivatives:"
+DERIVATIVE_RETRY_SECONDS = 60 * 60
+"""How long an image whose derivatives failed is served as it is before trying again."""
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def build_thumbnail(image_file, size: tuple, quality: int) -> ContentFile:
+    """Builds a JPEG thumbnail that fits inside ``size``.
+
+    Args:
+        image_file: An uploaded image file or any file-like object Pillow can open.
+        size (tuple): The (width, height) box the thumbnail must fit into.
+        quality (int): The JPEG quality of the thumbnail.
+
+    Returns:
+        ContentFile: The encoded thumbnail.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        return _encode(_fit(image, size), "JPEG", quality)
+
+
+def derivative_name(name: str, size: str, image_format: str = "jpeg") -> str:
+    """Returns the storage name of a derivative of an uploaded image."""
+    return f"{DERIVATIVE_DIRECTORY}/{name.rsplit('.', 1)[0]}/{size}.{IMAGE_DERIVATIVE_FORMATS[image_format][1]}"
+
+
+def create_derivatives(storage, name: str) -> list:
+    """Builds and stores every derivative of an uploaded image that is not stored yet.
+
+    Args:
+        storage (Storage): The storage of the image.
+        name (str): The storage name of the image.
+
+    Returns:
+        list: The storage names of the derivatives built.
+    """
+    missing = [(size, image_format) for size in IMAGE_DERIVATIVE_SIZES for image_format in IMAGE_DERIVATIVE_FORMATS
+               if not storage.exists(derivative_name(name, size, image_format))]
+    created = []
+    if missing:
+        with storage.open(name) as image_file, Image.open(image_file) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            # From the largest size down, each thumbnail is scaled from the previous one
+            for size in sorted({size for size, _ in missing}, key=lambda size: -max(IMAGE_DERIVATIVE_SIZES[size])):
+                image = _fit(image, IMAGE_DERIVATIVE_SIZES[size])
+                for image_format in [image_format for missing_size, image_format in missing if missing_size == size]:
+                    thumbnail = _encode(image, IMAGE_DERIVATIVE_FORMATS[image_format][0], IMAGE_DERIVATIVE_QUALITY)
+                    created.append(storage.save(derivative_name(name, size, image_format), thumbnail))
+    cache.set(_derivative_key(name), True, None)
+    return created
+
+
+def delete_derivatives(storage, name: str):
+    """Deletes the derivatives of an uploaded image, before its file is replaced."""
+    for size in IMAGE_DERIVATIVE_SIZES:
+        for image_format in IMAGE_DERIVATIVE_FORMATS:
+            storage.delete(derivative_name(name, size, image_format))
+    cache.delete(_derivative_key(name))
+
+
+def schedule_derivatives(image) -> bool:
+    """Builds the derivatives of an image off the request thread, unless they are known.
+
+    Set ``IMAGE_DERIVATIVES_IN_BACKGROUND`` to False to build them right away.
+
+    Args:
+        image (FieldFile): The image of a model field.
+
+    Returns:
+        bool: Whether the derivatives are ready.
+    """
+    if not image:
+        return False
+    state = cache.get(_derivative_key(image.name))
+    if state is not None:
+        return state
+    if not getattr(settings, "IMAGE_DERIVATIVES_IN_BACKGROUND", True):
+        return _create_derivatives(image.storage, image.name)
+    with _lock:
+        if image.name in _pending:
+            return False
+        _pending.add(image.name)
+    _get_executor().submit(_create_derivatives, image.storage, image.name)
+    return False
+
+
+def derivative_url(image, size: str, image_format: str = "jpeg") -> str:
+    """Returns the URL of a derivative of an image, or of the image itself until it is built.
+
+    Args:
+        image (FieldFile): The image of a model field.
+        size (str): A size of ``IMAGE_DERIVATIVE_SIZES``.
+        image_format (str): ``jpeg`` or ``webp``.
+
+    Returns:
+        str: The URL, empty without an image.
+    """
+    if not image:
+        return ""
+    if size in IMAGE_DERIVATIVE_SIZES and image_format in IMAGE_DERIVATIVE_FORMATS and schedule_derivatives(image):
+        return image.storage.url(derivative_name(image.name, size, image_format))
+    return image.url
+
+
+def _create_derivatives(storage, name: str) -> bool:
+    try:
+        create_derivatives(storage, name)
+        return True
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logging.warning("Could not build the derivatives of %s", name, exc_info=True)
+        cache.set(_derivative_key(name), False, DERIVATIVE_RETRY_SECONDS)
+        return False
+    finally:
+        with _lock:
+            _pending.discard(name)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_DERIVATIVE_WORKERS, thread_name_prefix="image-derivatives")
+        return _executor
+
+
+def _derivative_key(name: str) -> str:
+    return f"{DERIVATIVE_KEY_PREFIX}{name}"
+
+
+def _fit(image: Image.Image, size: tuple) -> Image.Image:
+    image = image.copy()
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    return image
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> ContentFile:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def store_monitor_snapshot(parking_lot_monitor, image_file) -> str:
+    """Stores an uploaded camera snapshot as the monitor's image thumbnail.
+
+    The previous snapshot file is deleted, but images uploaded by owners (which may be shared
+    with their registration) are left alone. The row is updated with a queryset update so
+    that storing a snapshot neither logs an availability change nor bumps dateTimeLastUpdated.
+
+    Args:
+        parking_lot_monitor (ParkingLotMonitor): The monitor the snapshot was taken by.
+        image_file: The uploaded snapshot.
+
+    Returns:
+        str: The storage name of the stored thumbnail.
+    """
+    thumbnail = build_thumbnail(image_file, MONITOR_SNAPSHOT_SIZE, MONITOR_SNAPSHOT_QUALITY)
+    field = parking_lot_monitor.image.field
+    previous_name = parking_lot_monitor.image.name or ""
+    name = field.generate_filename(parking_lot_monitor, f"{MONITOR_SNAPSHOT_PREFIX}{parking_lot_monitor.id}.jpg")
+    if previous_name.rsplit("/", 1)[-1].startswith(MONITOR_SNAPSHOT_PREFIX):
+        # The new snapshot may reuse the name, its derivatives are built again on request
+        delete_derivatives(field.storage, previous_name)
+        field.storage.delete(previous_name)
+    name = field.storage.save(name, thumbnail)
+    type(parking_lot_monitor).objects.filter(pk=parking_lot_monitor.pk).update(image=name)
+    parking_lot_monitor.image.name = name
+    return name
@@ -1,4 +1,4 @@
-from django.contrib.auth.models import User
+from .batching import get_writer
 from .models import ParkingLotMonitor, ParkingRequestLog
 
 def build_all_config_ini_content() -> str:
@@ -38,17 +38,17 @@ Password=Letmein1$
 ServerUrl=http://127.0.0.1:8000/api-auth/parking-lot-monitors"""
 
 def record_user_query(area_of_interest_latitude, area_of_interest_longitude, request):
-    """Records a user query in the database.
+    """Records a user query, inserted later in a batch so the search does not wait for it.
 
     Args:
         latitude (float): The latitude of the user query.
         longitude (float): The longitude of the user query.
+        request (HttpRequest): The search request, whose user and address are recorded.
     """
-
-    parking_request_log:ParkingRequestLog = ParkingRequestLog()
-    parking_request_log.area_of_interest_latitude = area_of_interest_latitude
-    parking_request_log.area_of_interest_longitude = area_of_interest_longitude
-    parking_request_log.user = User.objects.filter(username=request.user.username).first()
-    parking_request_log.user_ip_address = request.META.get("REMOTE_ADDR")
-
-    parking_request_log.save()
+    parking_request_log: ParkingRequestLog = ParkingRequestLog(
+        area_of_interest_latitude=area_of_interest_latitude,
+        area_of_interest_longitude=area_of_interest_longitude,
+        user=request.user if request.user.is_authenticated else None,
+        user_ip_address=request.META.get("REMOTE_ADDR"),
+    )
+    get_writer(ParkingRequestLog, 'PARKING_REQUEST_LOG').add(parking_request_log)
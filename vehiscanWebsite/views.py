@@ -6,14 +6,23 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import logout
 from .models import ParkingLot, ParkingLotMonitor, PendingParkingLotRegistration
 from .utility import record_user_query
+from .proximity import find_nearby, parse_search_parameters
+from .geocoding import get_geocoder
+from .availability import get_fleet_snapshot
+from .batching import writer_stats
+from .forecasts import attach_forecasts, parse_forecast_parameters
+from .ranking import parse_ranking, rank_nearby
+from .availability_stream import (DEFAULT_KEEPALIVE_SECONDS, POLLING_RETRY_MILLISECONDS, get_hub, parse_region,
+                                  snapshot_event, stream_events)
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.db.models import QuerySet
-from geopy.geocoders import Nominatim
-from geopy.distance import distance
-from geopy.distance import distance as geopy_distance
 from .forms import  UserDetailsForm
 from .models import UserProfile
 from . import WebPaths
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from datetime import datetime, timedelta, timezone
 from .forms import ParkingLotRegistrationForm, ParkingLotForm
 from django.contrib import messages
@@ -49,8 +58,8 @@ class WebPages:
  
     
 def index(request):
-    parking_lots: QuerySet = ParkingLot.objects.all()
-    return render(request, WebPages.HOME_PAGE, {"parking_lots": parking_lots})
+    # The map loads the lots of its viewport from the map API, see map_tiles.py
+    return render(request, WebPages.HOME_PAGE)
 
 def login_user(request):
     if request.method == "POST":  # FORM SUBMITTED
@@ -78,27 +87,38 @@ def parking_lots(request):
     location_query = request.GET.get('location', '')
     start_time = request.GET.get('start_time')
     duration = request.GET.get('duration')
+    # Searches for a later time show the hour-of-week forecast of every lot
+    forecast_window = parse_forecast_parameters(request.GET)
 
-    # Geocode using OpenStreetMap Nominatim
-    geolocator = Nominatim(user_agent="perfect_parking")
-    location = geolocator.geocode(location_query)
+    # Geocode through the cached geocoding service
+    location = get_geocoder().geocode(location_query)
     
-    parking_lots = ParkingLot.objects.all()  # Replace with your actual query
+    parking_lots = ParkingLot.objects.all()
     if not location:
-        return render(request, WebPages.PARKING_LOTS, {'parking_lots': parking_lots} )
-
-    # Get nearby parking lots (example query - adjust with your actual model)
-    parking_lots = ParkingLot.objects.all()  # Replace with your actual query
-    for lot in parking_lots:
-        lot.distance = distance((location.latitude, location.longitude), 
-                             (lot.latitude, lot.longitude)).km
+        if forecast_window:
+            parking_lots = attach_forecasts(parking_lots, *forecast_window)
+        return render(request, WebPages.PARKING_LOTS, {'parking_lots': parking_lots,
+                                                       'forecast_time': forecast_window and forecast_window[0]})
+
+    # Get nearby parking lots, ranked by distance, availability and price in the database
+    radius_km, page_size = parse_search_parameters(request.GET)
+    ranking, weights, lot_filter = parse_ranking(request.GET)
+    page = rank_nearby(parking_lots.filter(lot_filter), location.latitude, location.longitude,
+                       radius_km, page_size, request.GET.get('page'), weights, forecast_window)
+    parking_lots = page.object_list
+    if forecast_window:
+        parking_lots = attach_forecasts(parking_lots, *forecast_window)
 
     context = {
         'location': location,
         'parking_lots': parking_lots,
+        'page_obj': page,
+        'radius_km': radius_km,
+        'ranking': ranking,
         'search_coords': [location.latitude, location.longitude],
         'start_time': start_time,
-        'duration': duration
+        'duration': duration,
+        'forecast_time': forecast_window and forecast_window[0],
     }
     return render(request, WebPages.PARKING_LOTS, context)
 
@@ -115,27 +135,26 @@ def parking_lot_monitor(request, parking_lot_monitor_id):
 
 
 def parking_lot_monitors(request):
-    parking_lot_monitor_list: QuerySet = ParkingLotMonitor.objects.all()
-
-    if request.method == "POST":  # FORM SUBMITTED
-        latitude = float(request.POST["latitude"])
-        longitude = float(request.POST["longitude"])
+    parking_lot_monitor_list: QuerySet = ParkingLotMonitor.objects.select_related('parkingLot')
 
-        record_user_query(latitude, longitude, request)
+    # The search is submitted by POST, its further pages are requested by GET
+    parameters = request.POST if request.method == "POST" else request.GET
+    if "latitude" in parameters and "longitude" in parameters:
+        latitude = float(parameters["latitude"])
+        longitude = float(parameters["longitude"])
 
-        # Calculate distance for each monitor
-        for monitor in parking_lot_monitor_list:
-            monitor.distance = geopy_distance(
-                (latitude, longitude), (monitor.latitude, monitor.longitude)
-            ).km
+        if request.method == "POST":  # FORM SUBMITTED
+            record_user_query(latitude, longitude, request)
 
-        # Sort by distance (nearest first)
-        parking_lot_monitor_list = sorted(
-            parking_lot_monitor_list, key=lambda m: m.distance
-        )
+        # Nearest monitors first, distances are computed once and attached to the rows
+        radius_km, page_size = parse_search_parameters(parameters)
+        page = find_nearby(parking_lot_monitor_list, latitude, longitude,
+                           radius_km, page_size, parameters.get('page'))
 
         context = {
-            "parking_lot_monitors": parking_lot_monitor_list,
+            "parking_lot_monitors": page.object_list,
+            "page_obj": page,
+            "radius_km": radius_km,
             "user_point": {"latitude": latitude, "longitude": longitude},
         }
         return render(request, WebPages.PARKING_LOT_MONITORS, context)
@@ -146,6 +165,33 @@ def parking_lot_monitors(request):
         {"parking_lot_monitors": parking_lot_monitor_list},
     )
 
+async def availability_stream(request):
+    """Streams the availability changes of a region as server-sent events."""
+    try:
+        region = parse_region(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Use bbox=south,west,north,east and lots=1,2,3.")
+
+    hub = get_hub()
+    if not isinstance(request, ASGIRequest) or hub.is_full():
+        # A WSGI worker cannot hold streams open: send the snapshot and let the browser poll
+        version, entries = await sync_to_async(get_fleet_snapshot)()
+        event = f"retry: {POLLING_RETRY_MILLISECONDS}\n\n".encode() + snapshot_event(region, version, entries)
+        response = HttpResponse(event, content_type="text/event-stream")
+    else:
+        subscription, first_event = await hub.subscribe(region)
+        keepalive_seconds = getattr(settings, "AVAILABILITY_STREAM_KEEPALIVE_SECONDS", DEFAULT_KEEPALIVE_SECONDS)
+        response = StreamingHttpResponse(stream_events(hub, subscription, first_event, keepalive_seconds),
+                                         content_type="text/event-stream")
+        response["X-Accel-Buffering"] = "no"
+    response["Cache-Control"] = "no-cache"
+    return response
+
+@staff_member_required
+def log_writer_stats(request):
+    """Returns the queue depth, dropped rows and flush stats of this worker's log writers."""
+    return JsonResponse(writer_stats())
+
 def privacy_policy(request):
     """Builds the privacy policy page."""
     return render(request, WebPages.PRIVACY_POLICY)
@@ -1,8 +1,25 @@
+import hashlib
+import json
+
 from django.contrib.auth.models import User, Group
-from rest_framework.viewsets import ModelViewSet
-from rest_framework import permissions
+from django.db.models import Count, Max
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from PIL import Image, UnidentifiedImageError
+from rest_framework.viewsets import ModelViewSet, ViewSet
+from rest_framework import permissions, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
 from .serializers import UserSerializer, GroupSerializer, ParkingLotSerializer, ParkingLotMonitorSerializer
 from .models import ParkingLot, ParkingLotMonitor
+from .thumbnails import store_monitor_snapshot
+from .history import cache_max_age, occupancy_series, parse_history_parameters, parse_time_parameter
+from .monitor_snapshot import SNAPSHOT_FIELDS, build_snapshot, parse_fields, snapshot_etag, snapshot_version
+from .bulk_sync import BulkSyncMixin
+from .map_tiles import get_viewport, parse_viewport
+from .demand import demand_heatmap, parse_heatmap_parameters
 
 class UserViewSet(ModelViewSet):
     """
@@ -21,18 +38,151 @@ class GroupViewSet(ModelViewSet):
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticated]
     
-class ParkingLotViewSet(ModelViewSet):
+class ParkingLotViewSet(BulkSyncMixin, ModelViewSet):
     """
     API endpoint that allows parking lots to be viewed or edited.
     """
-    queryset = ParkingLot.objects.all()
+    queryset = ParkingLot.objects.order_by('pk')
     serializer_class = ParkingLotSerializer
+    sync_fields = {
+        'id': 'id',
+        'name': 'name',
+        'address': 'address',
+        'hours': 'hours',
+        'is_paid_parking': 'isPaidParking',
+        'latitude': 'latitude',
+        'longitude': 'longitude',
+        'parking_spaces': 'parking_spaces',
+        'base_price_per_hour': 'base_price_per_hour',
+        'status': 'status',
+        'free_parking_spaces': 'annotated_free_parking_spaces',
+        'probability_parking_available': 'annotated_probability_parking_available',
+        'date_time_last_updated': 'annotated_date_time_last_updated',
+    }
     #permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request, *args, **kwargs):
+        # Every edit of a lot moves its updated_at and every monitor update its availability_updated_at,
+        # read from the database so that every worker agrees on the version
+        state = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            updated=Max('updated_at'), availability_updated=Max('availability_updated_at'), count=Count('id'))
+        version = '|'.join(str(state[key] and state[key].isoformat()) for key in ('updated', 'availability_updated'))
+        etag = '"%s"' % hashlib.md5(f'{version}|{state["count"]}|{request.get_full_path()}'.encode()).hexdigest()
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    # The availability counters are indexed columns of the lot rows. Lots without monitors have
+    # no availability_updated_at, the cursor positions need a non-null key, so their edits count
+    sync_orderings = {'id': ('id',), 'available': ('-free_parking_spaces', 'id'),
+                      'updated': ('changed_at', 'id')}
+
+    def get_sync_queryset(self):
+        return ParkingLot.objects.with_availability().annotate(
+            changed_at=Greatest('updated_at', Coalesce('availability_updated_at', 'updated_at')))
+
+    @action(detail=False, methods=['get'])
+    def map(self, request):
+        """
+        Returns the lot markers, or the lot clusters when zoomed out, of a map viewport.
+
+        Takes the viewport as ``bbox=south,west,north,east`` and its ``zoom`` level, see ``map_tiles.py``.
+        """
+        return Response(get_viewport(*parse_viewport(request.query_params)))
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Returns the occupancy series of the parking lot, see ``history.py`` for the parameters.
+        """
+        parking_lot = self.get_object()
+        start, end, resolution = parse_history_parameters(request.query_params)
+        series = occupancy_series(start, end, resolution, parking_lot_id=parking_lot.pk)
+        return history_response(request, {'parking_lot': parking_lot.pk, **series}, end, resolution)
     
-class ParkingLotMonitorViewSet(ModelViewSet):
+class ParkingLotMonitorViewSet(BulkSyncMixin, ModelViewSet):
     """
     API endpoint that allows parking lot monitors to be viewed or edited.
     """
-    queryset = ParkingLotMonitor.objects.all()
+    queryset = ParkingLotMonitor.objects.select_related('parkingLot').order_by('pk')
     serializer_class = ParkingLotMonitorSerializer
-    #permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    # The lot columns are joined in the same query
+    sync_fields = {**SNAPSHOT_FIELDS, 'parking_lot_name': 'parkingLot__name', 'parking_lot_address': 'parkingLot__address'}
+    sync_orderings = {'id': ('id',), 'updated': ('dateTimeLastUpdated', 'id')}
+    #permission_classes = [permissions.IsAuthenticated]
+
+    @action(detail=True, methods=['put'], parser_classes=[MultiPartParser])
+    def snapshot(self, request, pk=None):
+        """
+        Stores a camera snapshot uploaded by the monitor client as a thumbnail of its image.
+        """
+        parking_lot_monitor = self.get_object()
+        image = request.FILES.get('image')
+        if image is None:
+            return Response({'image': ['No snapshot was uploaded.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            store_monitor_snapshot(parking_lot_monitor, image)
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            # Hostile uploads too: Pillow refuses to decode images far above MAX_IMAGE_PIXELS
+            return Response({'image': ['The snapshot is not a valid image.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'image': request.build_absolute_uri(parking_lot_monitor.image.url)})
+
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        Returns the compact availability snapshot of the monitors, see ``monitor_snapshot.py``.
+
+        ``fields`` selects the columns and ``since`` keeps only the monitors updated after it.
+        The ETag changes with any monitor update, so pollers get a 304 while nothing changed.
+        """
+        fields = parse_fields(request.query_params)
+        since = parse_time_parameter(request.query_params, 'since')
+        queryset = ParkingLotMonitor.objects.order_by()
+        last_updated, count = snapshot_version(queryset)
+        etag = snapshot_etag(last_updated, count, fields, since)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(build_snapshot(queryset, fields, since, last_updated, count))
+        response['ETag'] = etag
+        if last_updated is not None:
+            # Informative only: it has a one second resolution, the ETag decides
+            response['Last-Modified'] = http_date(last_updated.timestamp())
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Returns the occupancy series of the parking lot monitor, see ``history.py`` for the parameters.
+        """
+        parking_lot_monitor = self.get_object()
+        start, end, resolution = parse_history_parameters(request.query_params)
+        series = occupancy_series(start, end, resolution, monitor_id=parking_lot_monitor.pk)
+        return history_response(request, {'parking_lot_monitor': parking_lot_monitor.pk, **series}, end, resolution)
+
+
+class SearchDemandViewSet(ViewSet):
+    """
+    API endpoint that returns the heatmap of parking searches, see ``demand.py`` for the parameters.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        return Response(demand_heatmap(**parse_heatmap_parameters(request.query_params)))
+
+
+def history_response(request, series: dict, end, resolution: int) -> Response:
+    """Returns a series with caching headers, or 304 when the client already has it."""
+    etag = '"%s"' % hashlib.md5(json.dumps(series, sort_keys=True).encode()).hexdigest()
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(series)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=cache_max_age(end, resolution))
+    return response